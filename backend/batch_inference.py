@@ -0,0 +1,58 @@
+"""Batched TFLite inference shared by the API and offline tools"""
+import logging
+from typing import List, Union
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+class BatchClassifier:
+    """Runs the TFLite model on fixed-size batches, padding the final partial batch"""
+
+    def __init__(self, interpreter, batch_size: int, input_size: int = 224):
+        self.interpreter = interpreter
+        self.input_index = interpreter.get_input_details()[0]['index']
+        self.output_index = interpreter.get_output_details()[0]['index']
+        self.batch_size = batch_size
+        try:
+            interpreter.resize_tensor_input(self.input_index, [batch_size, input_size, input_size, 3])
+            interpreter.allocate_tensors()
+        except Exception as e:
+            logger.warning("Model does not support batch size %d (%s); falling back to 1", batch_size, e)
+            self.batch_size = 1
+            interpreter.resize_tensor_input(self.input_index, [1, input_size, input_size, 3])
+            interpreter.allocate_tensors()
+        self._buffer = np.zeros((self.batch_size, input_size, input_size, 3), dtype=np.float32)
+
+    def predict(self, arrays: Union[List[np.ndarray], np.ndarray]) -> np.ndarray:
+        """Return class probabilities for preprocessed images (a list or an (N, H, W, 3) array)"""
+        results = []
+        for start in range(0, len(arrays), self.batch_size):
+            chunk = arrays[start:start + self.batch_size]
+            self._buffer[:len(chunk)] = chunk
+            self._buffer[len(chunk):] = 0.0
+            self.interpreter.set_tensor(self.input_index, self._buffer)
+            self.interpreter.invoke()
+            results.append(self.interpreter.get_tensor(self.output_index)[:len(chunk)].copy())
+        return np.concatenate(results)
+
+    def predict_grid(self, grid: np.ndarray) -> np.ndarray:
+        """Class probabilities for a (rows, cols, H, W, 3) grid of tiles, returned as (rows, cols, classes)
+
+        Whole grid rows are copied straight from the (possibly strided) grid
+        into the input buffer, so a grid that fits the batch runs in one invoke.
+        """
+        rows, cols = grid.shape[:2]
+        if cols > self.batch_size:
+            return np.stack([self.predict(grid[row]) for row in range(rows)])
+        rows_per_batch = self.batch_size // cols
+        results = []
+        for start in range(0, rows, rows_per_batch):
+            chunk = grid[start:start + rows_per_batch]
+            count = chunk.shape[0] * cols
+            self._buffer[:count].reshape(chunk.shape)[...] = chunk
+            self._buffer[count:] = 0.0
+            self.interpreter.set_tensor(self.input_index, self._buffer)
+            self.interpreter.invoke()
+            results.append(self.interpreter.get_tensor(self.output_index)[:count].copy())
+        return np.concatenate(results).reshape(rows, cols, -1)
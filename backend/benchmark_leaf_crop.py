@@ -0,0 +1,107 @@
+"""Compare Layer 1 confidence with and without leaf cropping.
+
+Classifies every image twice (whole photo and leaf crop) and reports the
+confidence distribution of each, how many results would clear the Layer 2
+threshold, how often the two disagree and the cost of locating the leaf.
+When images sit in folders named after model labels (PlantVillage layout)
+top-1 accuracy is reported as well.
+
+Usage:
+    python benchmark_leaf_crop.py /data/field_photos --limit 500
+"""
+import argparse
+import os
+import sys
+import time
+from typing import List, Optional
+
+import numpy as np
+
+from classify_cli import iter_sources, open_image  # Sets up console logging before main is imported
+import main as backend
+from batch_inference import BatchClassifier
+from image_ops import locate_leaf
+
+def describe(name: str, confidences: np.ndarray, threshold: float) -> str:
+    p10, p25, p50 = np.percentile(confidences, (10, 25, 50))
+    return (f"{name:<10} mean {confidences.mean():.3f} | p10 {p10:.3f} | p25 {p25:.3f} | median {p50:.3f} | "
+            f">= {threshold}: {(confidences >= threshold).mean():.1%}")
+
+def expected_label(source: str, label_set: set) -> Optional[str]:
+    folder = os.path.basename(os.path.dirname(source.split("::")[-1]))
+    return folder if folder in label_set else None
+
+def run(args) -> int:
+    interpreter, labels, _, backend.label_records = backend.load_classifier(num_threads=args.threads)
+    classifier = BatchClassifier(interpreter, args.batch_size, backend.INPUT_SIZE)
+    label_set = set(labels)
+    threshold = backend.LAYER2_CONFIDENCE_THRESHOLD
+
+    sources: List[str] = []
+    whole, cropped = [], []  # Preprocessed arrays awaiting inference
+    whole_probs, cropped_probs = [], []
+    crop_found = 0
+    locate_seconds = 0.0
+
+    def classify_pending():
+        if whole:
+            whole_probs.append(classifier.predict(whole))
+            cropped_probs.append(classifier.predict(cropped))
+            whole.clear()
+            cropped.clear()
+
+    for source, payload in iter_sources(args.inputs):
+        try:
+            image = open_image(payload, backend.DECODE_MAX_SIDE).convert("RGB")
+        except Exception as e:
+            print(f"Skipping {source}: {e}", file=sys.stderr)
+            continue
+        started = time.perf_counter()
+        box = locate_leaf(image)
+        locate_seconds += time.perf_counter() - started
+        crop_found += box is not None
+        sources.append(source)
+        whole.append(backend.preprocess_image(image)[0])
+        cropped.append(backend.preprocess_image(image.crop(box) if box else image)[0])
+        if len(whole) >= classifier.batch_size:
+            classify_pending()
+        if args.limit and len(sources) >= args.limit:
+            break
+    classify_pending()
+
+    if not sources:
+        print("No images found", file=sys.stderr)
+        return 1
+
+    whole_probs = np.concatenate(whole_probs)
+    cropped_probs = np.concatenate(cropped_probs)
+    whole_top = whole_probs.argmax(axis=1)
+    cropped_top = cropped_probs.argmax(axis=1)
+    whole_conf = whole_probs.max(axis=1)
+    cropped_conf = cropped_probs.max(axis=1)
+
+    print(f"Images: {len(sources)} | leaf region found: {crop_found / len(sources):.1%} | "
+          f"locate: {locate_seconds / len(sources) * 1000:.2f} ms/image")
+    print(describe("whole", whole_conf, threshold))
+    print(describe("leaf crop", cropped_conf, threshold))
+    print(f"Top-1 disagreement: {(whole_top != cropped_top).mean():.1%} | "
+          f"confidence improved on {(cropped_conf > whole_conf).mean():.1%} of images")
+
+    expected = [expected_label(source, label_set) for source in sources]
+    known = [i for i, label in enumerate(expected) if label]
+    if known:
+        truth = np.array([labels.index(expected[i]) for i in known])
+        print(f"Accuracy on {len(known)} labelled images: whole {(whole_top[known] == truth).mean():.1%} | "
+              f"leaf crop {(cropped_top[known] == truth).mean():.1%}")
+    return 0
+
+def parse_args(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Benchmark leaf cropping against whole-photo classification")
+    parser.add_argument("inputs", nargs="+", help="Image directories, tar archives or image files")
+    parser.add_argument("--limit", type=int, default=1000, help="Maximum images to evaluate (0 = all)")
+    parser.add_argument("--batch-size", type=int, default=32, help="Images per model invocation")
+    parser.add_argument("--threads", type=int, default=None, help="TFLite interpreter threads")
+    return parser.parse_args(argv)
+
+if __name__ == "__main__":
+    sys.exit(run(parse_args()))
@@ -0,0 +1,355 @@
+"""Offline bulk classification of image directories and tarballs.
+
+Reuses the backend's model loading, preprocessing and label/solution table,
+decodes images in parallel worker threads, runs batched inference and
+appends results to CSV, JSONL or Parquet. Processed items, and whether they
+failed, are recorded in a progress file after each flush, so an interrupted
+run resumes where it stopped and the output holds one row per image.
+--retry-failed retries images that failed before and replaces their error
+rows with the new results.
+
+Usage:
+    python classify_cli.py /data/photos archive.tar.gz -o results.csv
+    python classify_cli.py /data/photos -o results.jsonl --batch-size 64 --workers 8
+    python classify_cli.py /data/photos -o results.parquet
+    python classify_cli.py /data/photos -o results.csv --retry-failed
+"""
+import argparse
+import csv
+import io
+import json
+import logging
+import os
+import sys
+import tarfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+from typing import Iterator, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+from log_config import configure_logging
+
+# Console-only logging, set up before importing main: the backend leaves an already
+# configured root logger alone, so no backend.log or queue listener is created
+configure_logging(path=None, use_queue=False)
+
+import main as backend  # noqa: E402
+from batch_inference import BatchClassifier  # noqa: E402
+from image_ops import crop_to_leaf  # noqa: E402
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+logger = logging.getLogger("classify_cli")
+
+OUTPUT_FIELDS = ["source", "disease", "display_name", "confidence", "healthy", "severity", "solution_key", "error"]
+TAR_SUFFIXES = (".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tar.xz")
+
+def is_image_name(name: str) -> bool:
+    return os.path.splitext(name.lower())[1] in backend.ALLOWED_EXTENSIONS
+
+def iter_sources(inputs: List[str]) -> Iterator[Tuple[str, object]]:
+    """Yield (source key, path or bytes) for every image in the given directories, files and tarballs"""
+    for input_path in inputs:
+        if os.path.isdir(input_path):
+            for root, dirs, files in os.walk(input_path):
+                dirs.sort()
+                for name in sorted(files):
+                    if is_image_name(name):
+                        path = os.path.join(root, name)
+                        yield path, path
+        elif input_path.lower().endswith(TAR_SUFFIXES):
+            # Stream members sequentially; bytes are handed to decode workers
+            with tarfile.open(input_path, "r|*") as archive:
+                for member in archive:
+                    if member.isfile() and is_image_name(member.name):
+                        yield f"{input_path}::{member.name}", archive.extractfile(member).read()
+        elif is_image_name(input_path):
+            yield input_path, input_path
+        else:
+            logger.warning(f"Skipping unsupported input: {input_path}")
+
+def open_image(payload, max_side: int) -> Image.Image:
+    """Open an image, letting JPEG decoding downscale towards max_side"""
+    image = Image.open(payload if isinstance(payload, str) else io.BytesIO(payload))
+    image.draft("RGB", (max_side, max_side))
+    return image
+
+def decode(payload, leaf_crop: bool = False) -> np.ndarray:
+    """Decode and preprocess one image to a (224, 224, 3) float32 array"""
+    # Cropping needs resolution to spare; otherwise twice the model input is enough
+    image = open_image(payload, backend.DECODE_MAX_SIDE if leaf_crop else backend.INPUT_SIZE * 2)
+    if leaf_crop:
+        image = crop_to_leaf(image.convert("RGB"))
+    return backend.preprocess_image(image)[0]
+
+class ResultWriter:
+    """Appends result rows to CSV/JSONL, or to numbered Parquet part files in a directory"""
+
+    def __init__(self, output: str, output_format: str):
+        self.output = output
+        self.format = output_format
+        if output_format == "parquet":
+            if pq is None:
+                raise SystemExit("Parquet output requires pyarrow (pip install pyarrow)")
+            os.makedirs(output, exist_ok=True)
+            self._part = len([name for name in os.listdir(output) if name.endswith(".parquet")])
+            self._file = None
+        else:
+            new_file = not os.path.exists(output) or os.path.getsize(output) == 0
+            self._file = open(output, "a", encoding="utf-8", newline="")
+            if output_format == "csv":
+                self._csv = csv.DictWriter(self._file, fieldnames=OUTPUT_FIELDS)
+                if new_file:
+                    self._csv.writeheader()
+
+    def write(self, rows: List[dict]):
+        if not rows:
+            return
+        if self.format == "parquet":
+            table = pa.Table.from_pylist(rows)
+            pq.write_table(table, os.path.join(self.output, f"part-{self._part:05d}.parquet"))
+            self._part += 1
+            return
+        for row in rows:
+            if self.format == "csv":
+                self._csv.writerow(row)
+            else:
+                self._file.write(json.dumps(row) + "\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        if self._file:
+            self._file.close()
+
+    def drop_superseded_errors(self) -> int:
+        """Remove error rows for sources that have a later row; call after close()"""
+        if self.format == "parquet":
+            return self._drop_superseded_parquet()
+        if self.format == "csv":
+            def read_rows(f):
+                return csv.DictReader(f)
+        else:
+            def read_rows(f):
+                return (json.loads(line) for line in f if line.strip())
+
+        with open(self.output, "r", encoding="utf-8", newline="") as f:
+            last = {row["source"]: index for index, row in enumerate(read_rows(f))}
+        dropped = 0
+        temp_path = f"{self.output}.tmp"
+        with open(self.output, "r", encoding="utf-8", newline="") as f, \
+                open(temp_path, "w", encoding="utf-8", newline="") as out:
+            if self.format == "csv":
+                writer = csv.DictWriter(out, fieldnames=OUTPUT_FIELDS)
+                writer.writeheader()
+            for index, row in enumerate(read_rows(f)):
+                if row["error"] and last[row["source"]] != index:
+                    dropped += 1
+                elif self.format == "csv":
+                    writer.writerow(row)
+                else:
+                    out.write(json.dumps(row) + "\n")
+        if dropped:
+            os.replace(temp_path, self.output)
+        else:
+            os.remove(temp_path)
+        return dropped
+
+    def _drop_superseded_parquet(self) -> int:
+        parts = sorted(name for name in os.listdir(self.output) if name.endswith(".parquet"))
+        columns = [pq.read_table(os.path.join(self.output, name), columns=["source", "error"]).to_pydict()
+                   for name in parts]
+        last = {}
+        for part, column in enumerate(columns):
+            for row, source in enumerate(column["source"]):
+                last[source] = (part, row)
+        dropped = 0
+        for part, (name, column) in enumerate(zip(parts, columns)):
+            keep = [not error or last[source] == (part, row)
+                    for row, (source, error) in enumerate(zip(column["source"], column["error"]))]
+            if all(keep):
+                continue
+            path = os.path.join(self.output, name)
+            table = pq.read_table(path).filter(pa.array(keep))
+            pq.write_table(table, f"{path}.tmp")
+            os.replace(f"{path}.tmp", path)
+            dropped += keep.count(False)
+        return dropped
+
+class ProgressCheckpoint:
+    """Append-only record of processed sources and whether they failed, written after their results are flushed
+
+    Lines are "ok<TAB>source" or "error<TAB>source"; a bare source (from
+    progress files written before failures were recorded) counts as ok.
+    The last line for a source wins.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.done = set()
+        self.failed = set()
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    status, _, source = line.rstrip("\n").partition("\t")
+                    if not source:
+                        status, source = "ok", status
+                    if not source:
+                        continue
+                    if status == "error":
+                        self.failed.add(source)
+                        self.done.discard(source)
+                    else:
+                        self.done.add(source)
+                        self.failed.discard(source)
+        self._file = open(path, "a", encoding="utf-8")
+
+    def mark(self, rows: List[dict]):
+        self._file.write("".join(f"{'error' if row['error'] else 'ok'}\t{row['source']}\n" for row in rows))
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        for row in rows:
+            if row["error"]:
+                self.failed.add(row["source"])
+            else:
+                self.done.add(row["source"])
+                self.failed.discard(row["source"])
+
+    def close(self):
+        self._file.close()
+
+def build_rows(sources: List[str], probabilities: np.ndarray) -> List[dict]:
+    """Map model outputs to result rows via the precomputed label table"""
+    rows = []
+    top_indices = np.argmax(probabilities, axis=1)
+    for source, index, probs in zip(sources, top_indices, probabilities):
+        record = backend.label_records[int(index)]
+        rows.append({
+            "source": source,
+            "disease": record.label,
+            "display_name": record.display_name,
+            "confidence": float(probs[index]),
+            "healthy": record.healthy,
+            "severity": record.severity,
+            "solution_key": record.solution_key,
+            "error": ""
+        })
+    return rows
+
+def error_row(source: str, error: Exception) -> dict:
+    return {"source": source, "disease": "", "display_name": "", "confidence": 0.0,
+            "healthy": False, "severity": "", "solution_key": "", "error": str(error)[:200]}
+
+def run(args) -> int:
+    interpreter, labels, _, backend.label_records = backend.load_classifier(num_threads=args.threads)
+    classifier = BatchClassifier(interpreter, args.batch_size, backend.INPUT_SIZE)
+    writer = ResultWriter(args.output, args.format)
+    checkpoint = ProgressCheckpoint(args.checkpoint or f"{args.output.rstrip(os.sep)}.progress")
+    if checkpoint.done or checkpoint.failed:
+        retry_note = "will be retried" if args.retry_failed else "are skipped (use --retry-failed to retry them)"
+        logger.info(f"Resuming: {len(checkpoint.done)} items already processed, "
+                    f"{len(checkpoint.failed)} failed items {retry_note}")
+
+    processed = 0
+    failed = 0
+    submitted = 0
+    retried = 0
+    started = time.time()
+    pending = deque()  # (source, future) in submission order
+    batch_sources, batch_arrays, rows = [], [], []
+    # Bound memory: one batch being filled plus a few decodes per worker
+    max_in_flight = classifier.batch_size + 2 * args.workers
+
+    def infer_batch():
+        if batch_arrays:
+            rows.extend(build_rows(batch_sources, classifier.predict(batch_arrays)))
+            batch_sources.clear()
+            batch_arrays.clear()
+
+    def flush():
+        nonlocal processed
+        infer_batch()
+        writer.write(rows)
+        checkpoint.mark(rows)
+        processed += len(rows)
+        rows.clear()
+        elapsed = time.time() - started
+        logger.info(f"Processed {processed} images ({processed / max(elapsed, 1e-6):.1f}/s, {failed} failed)")
+
+    def collect_one():
+        nonlocal failed
+        source, future = pending.popleft()
+        try:
+            batch_arrays.append(future.result())
+            batch_sources.append(source)
+        except Exception as e:
+            failed += 1
+            rows.append(error_row(source, e))
+        if len(batch_arrays) >= classifier.batch_size:
+            infer_batch()
+        if len(rows) >= args.flush_every:
+            flush()
+
+    try:
+        with ThreadPoolExecutor(max_workers=args.workers) as pool:
+            for source, payload in iter_sources(args.inputs):
+                if source in checkpoint.done or (source in checkpoint.failed and not args.retry_failed):
+                    continue
+                retried += source in checkpoint.failed
+                pending.append((source, pool.submit(decode, payload, args.leaf_crop)))
+                submitted += 1
+                if len(pending) >= max_in_flight:
+                    collect_one()
+                if args.limit and submitted >= args.limit:
+                    break
+            while pending:
+                collect_one()
+        flush()
+    finally:
+        writer.close()
+        checkpoint.close()
+
+    if args.retry_failed:
+        # Also catches error rows left behind by an interrupted retry run
+        dropped = writer.drop_superseded_errors()
+        logger.info(f"Retried {retried} previously failed items; removed {dropped} superseded error rows")
+    logger.info(f"Done: {processed} images in {time.time() - started:.1f}s ({failed} failed)")
+    return 0
+
+def parse_args(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Classify image directories and tarballs offline with the FloraGuard model")
+    parser.add_argument("inputs", nargs="+", help="Image directories, tar archives or image files")
+    parser.add_argument("-o", "--output", required=True,
+                        help="Output file (.csv/.jsonl) or directory (.parquet, or a path ending in /)")
+    parser.add_argument("--format", choices=["csv", "jsonl", "parquet"], help="Output format (default: from extension)")
+    parser.add_argument("--batch-size", type=int, default=32, help="Images per model invocation")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 4, help="Parallel decode threads")
+    parser.add_argument("--threads", type=int, default=None, help="TFLite interpreter threads")
+    parser.add_argument("--flush-every", type=int, default=1024, help="Write results and checkpoint every N images")
+    parser.add_argument("--checkpoint", help="Progress file (default: <output>.progress)")
+    parser.add_argument("--leaf-crop", action="store_true", help="Crop to the detected leaf region before resizing")
+    parser.add_argument("--limit", type=int, default=0, help="Stop after N new images (0 = no limit)")
+    parser.add_argument("--retry-failed", action="store_true",
+                        help="Retry images that failed in an earlier run and replace their error rows")
+    args = parser.parse_args(argv)
+    if not args.format:
+        extension = os.path.splitext(args.output.rstrip(os.sep))[1].lower().lstrip(".")
+        if extension in ("csv", "jsonl", "parquet"):
+            args.format = extension
+        elif args.output.endswith(os.sep) or os.path.isdir(args.output):
+            args.format = "parquet"
+        else:
+            parser.error(f"cannot infer the output format from {args.output!r}; "
+                         "use .csv, .jsonl, .parquet, a directory path or --format")
+    return args
+
+if __name__ == "__main__":
+    sys.exit(run(parse_args()))
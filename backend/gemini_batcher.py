@@ -0,0 +1,107 @@
+"""Micro-batching of Gemini Layer 2 requests.
+
+Low-confidence images that arrive within a short window are sent as one
+multi-image prompt. The batch callable maps the structured reply back to
+each image; when it cannot, or the batch call times out, the affected
+images fall back to single calls.
+"""
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+class BatchParseError(Exception):
+    """The batch reply could not be mapped to every image; partial holds the entries that could"""
+
+    def __init__(self, message: str, partial: Optional[Dict[int, dict]] = None):
+        super().__init__(message)
+        self.partial = partial or {}
+
+class GeminiBatcher:
+    """Collects images for up to window_seconds (or max_batch images) and dispatches them together
+
+    call_batch(images) returns one result (or None) per image and raises
+    BatchParseError when the reply cannot be attributed to the images.
+    call_single(image) handles a single image. A batch call running longer
+    than timeout_seconds is abandoned in favour of single calls.
+    """
+
+    def __init__(self, call_batch: Callable[[List], Awaitable[List[Optional[dict]]]],
+                 call_single: Callable[[object], Awaitable[Optional[dict]]],
+                 window_seconds: float = 0.25, max_batch: int = 8, timeout_seconds: Optional[float] = None):
+        self.call_batch = call_batch
+        self.call_single = call_single
+        self.window_seconds = window_seconds
+        self.max_batch = max_batch
+        self.timeout_seconds = timeout_seconds
+        self._pending: List[Tuple[object, asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._tasks = set()
+        self.batch_calls = 0
+        self.single_calls = 0
+        self.fallback_calls = 0
+        self.images_submitted = 0
+
+    async def submit(self, image) -> Optional[dict]:
+        """Queue an image for the next batch and wait for its result"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((image, future))
+        self.images_submitted += 1
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window_seconds, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            task = asyncio.create_task(self._dispatch(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _dispatch(self, batch: List[Tuple[object, asyncio.Future]]):
+        images = [image for image, _ in batch]
+        try:
+            if len(images) == 1:
+                self.single_calls += 1
+                results = [await self.call_single(images[0])]
+            else:
+                results = await self._call_batch(images)
+        except Exception as e:
+            logger.exception("Gemini batch of %d failed: %s", len(images), e)
+            results = [None] * len(images)
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+    async def _call_batch(self, images: List) -> List[Optional[dict]]:
+        self.batch_calls += 1
+        try:
+            return await asyncio.wait_for(self.call_batch(images), self.timeout_seconds)
+        except asyncio.TimeoutError:
+            error = BatchParseError(f"no reply within {self.timeout_seconds}s")
+        except BatchParseError as e:
+            error = e
+        missing = [i for i in range(len(images)) if i not in error.partial]
+        logger.warning("Batch reply unusable for %d/%d images (%s); falling back to single calls",
+                       len(missing), len(images), error)
+        self.fallback_calls += len(missing)
+        singles = await asyncio.gather(*(self.call_single(images[i]) for i in missing))
+        results = dict(error.partial)
+        results.update(zip(missing, singles))
+        return [results[i] for i in range(len(images))]
+
+    def stats(self) -> Dict:
+        return {
+            "images_submitted": self.images_submitted,
+            "batch_calls": self.batch_calls,
+            "single_calls": self.single_calls,
+            "fallback_calls": self.fallback_calls,
+            "pending": len(self._pending)
+        }
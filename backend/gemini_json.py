@@ -0,0 +1,202 @@
+"""Tolerant parsing of JSON replies from Gemini.
+
+Replies are scanned once: prose and code fences around the JSON are
+skipped, raw newlines in strings are escaped, trailing commas and Python
+literals are fixed and truncated output is closed at the last complete
+value. Parsed data is then conformed to the expected pydantic model so
+near-misses (a string where a list belongs, "Side Effects" for
+side_effects) are coerced and only genuinely missing fields are reported.
+"""
+import json
+import re
+from typing import Any, List, Optional, Tuple, Type, get_args, get_origin
+
+from pydantic import BaseModel
+
+PYTHON_LITERALS = {"True": "true", "False": "false", "None": "null"}
+
+class StructuredOutputError(ValueError):
+    """The reply could not be turned into the expected structure; problems lists what was wrong"""
+
+    def __init__(self, message: str, problems: Optional[List[str]] = None):
+        super().__init__(message)
+        self.problems = problems or [message]
+
+def _strip_trailing_comma(out: List[str]):
+    while out and out[-1].isspace():
+        out.pop()
+    if out and out[-1] == ",":
+        out.pop()
+
+def _close(out: List[str], stack: List[str]) -> str:
+    out = list(out)
+    while out and out[-1].isspace():
+        out.pop()
+    if out and out[-1] == ":":
+        out.append("null")
+    _strip_trailing_comma(out)
+    return "".join(out) + "".join(reversed(stack))
+
+def repair_json(text: str, opener: str = "{[") -> str:
+    """Return the first JSON value in text, repaired so json.loads can parse it"""
+    start = next((i for i, ch in enumerate(text) if ch in opener), -1)
+    if start < 0:
+        raise StructuredOutputError("no JSON object or array in reply")
+
+    out: List[str] = []
+    stack: List[str] = []
+    cuts: List[Tuple[int, List[str]]] = []  # (output length, open brackets) at each top-level-safe comma
+    in_string = False
+    escape = False
+    i = start
+    while i < len(text):
+        ch = text[i]
+        if in_string:
+            if escape:
+                escape = False
+                out.append(ch)
+            elif ch == "\\":
+                escape = True
+                out.append(ch)
+            elif ch == '"':
+                in_string = False
+                out.append(ch)
+            elif ch == "\n":
+                out.append("\\n")
+            elif ch in "\r\t":
+                out.append("\\t" if ch == "\t" else "")
+            else:
+                out.append(ch)
+        elif ch == '"':
+            in_string = True
+            out.append(ch)
+        elif ch in "{[":
+            stack.append("}" if ch == "{" else "]")
+            out.append(ch)
+        elif ch in "}]":
+            _strip_trailing_comma(out)
+            out.append(stack.pop())
+            if not stack:
+                return "".join(out)
+        elif ch == ",":
+            cuts.append((len(out), list(stack)))
+            out.append(ch)
+        elif ch == "`":
+            break  # Closing code fence of a truncated reply
+        else:
+            literal = next((word for word in PYTHON_LITERALS if text.startswith(word, i)), None)
+            if literal:
+                out.append(PYTHON_LITERALS[literal])
+                i += len(literal)
+                continue
+            out.append(ch)
+        i += 1
+
+    # Truncated reply: close what is open, backing off to earlier commas if the tail is incomplete
+    if in_string:
+        if escape:
+            out.pop()
+        out.append('"')
+    candidates = [_close(out, stack)] + [_close(out[:length], open_stack) for length, open_stack in reversed(cuts[-8:])]
+    for candidate in candidates:
+        try:
+            json.loads(candidate)
+            return candidate
+        except ValueError:
+            continue
+    raise StructuredOutputError("reply is truncated beyond repair")
+
+def extract_json(text: str, expect: Optional[type] = None) -> Any:
+    """Parse the first JSON value in a model reply; expect=list or dict selects the value type"""
+    if text is None:
+        raise StructuredOutputError("empty reply")
+    opener = {list: "[", dict: "{"}.get(expect, "{[")
+    try:
+        data = json.loads(repair_json(text, opener))
+    except ValueError as e:
+        if isinstance(e, StructuredOutputError):
+            raise
+        raise StructuredOutputError(f"invalid JSON: {e}")
+    if expect is list and isinstance(data, dict):
+        # Arrays are sometimes wrapped as {"results": [...]}
+        lists = [value for value in data.values() if isinstance(value, list)]
+        if len(lists) == 1:
+            data = lists[0]
+    if expect is not None and not isinstance(data, expect):
+        raise StructuredOutputError(f"expected a JSON {'array' if expect is list else 'object'}")
+    return data
+
+def _normalize_key(key: str) -> str:
+    return re.sub(r"[\s\-]+", "_", str(key).strip()).lower()
+
+def _empty(annotation) -> Any:
+    origin = get_origin(annotation)
+    if origin in (list, List):
+        return []
+    if origin is dict:
+        return {}
+    if isinstance(annotation, type) and issubclass(annotation, BaseModel):
+        return {name: _empty(field.annotation) for name, field in annotation.model_fields.items()}
+    return ""
+
+def _conform(value: Any, annotation, path: str, missing: List[str]) -> Any:
+    origin = get_origin(annotation)
+    if value is None:
+        missing.append(path)
+        return _empty(annotation)
+
+    if isinstance(annotation, type) and issubclass(annotation, BaseModel):
+        if not isinstance(value, dict):
+            missing.append(path)
+            return _empty(annotation)
+        return conform_to_model(value, annotation, path, missing)
+
+    if origin in (list, List):
+        (item_type,) = get_args(annotation) or (Any,)
+        if isinstance(value, (str, dict)):
+            value = [value]
+        elif not isinstance(value, list):
+            value = [value]
+        return [_conform(item, item_type, f"{path}[{i}]", missing) for i, item in enumerate(value)]
+
+    if origin is dict:
+        key_type, value_type = get_args(annotation) or (str, Any)
+        if not isinstance(value, dict):
+            missing.append(path)
+            return {}
+        return {_normalize_key(k): _conform(v, value_type, f"{path}.{k}", missing) for k, v in value.items()}
+
+    if annotation is str:
+        if isinstance(value, list):
+            return "; ".join(str(item) for item in value)
+        if isinstance(value, dict):
+            return "; ".join(f"{k}: {v}" for k, v in value.items())
+        return str(value)
+    return value
+
+def conform_to_model(data: dict, model: Type[BaseModel], path: str = "",
+                     missing: Optional[List[str]] = None) -> dict:
+    """Coerce data towards model's fields, appending the paths of fields that are absent to missing"""
+    missing = [] if missing is None else missing
+    normalized = {_normalize_key(key): value for key, value in data.items()}
+    result = {}
+    for name, field in model.model_fields.items():
+        field_path = f"{path}.{name}" if path else name
+        if name not in normalized:
+            if field.is_required():
+                missing.append(field_path)
+                result[name] = _empty(field.annotation)
+            continue
+        result[name] = _conform(normalized[name], field.annotation, field_path, missing)
+    return result
+
+def parse_model(text: str, model: Type[BaseModel]) -> BaseModel:
+    """Extract, repair and validate a reply as model; raises StructuredOutputError naming missing fields"""
+    missing: List[str] = []
+    data = conform_to_model(extract_json(text, dict), model, missing=missing)
+    if missing:
+        raise StructuredOutputError(f"missing fields: {', '.join(missing[:10])}", missing)
+    try:
+        return model(**data)
+    except ValueError as e:
+        raise StructuredOutputError(f"schema mismatch: {e}")
@@ -0,0 +1,116 @@
+"""Client-side Gemini quota tracking: per-minute token bucket, daily budget and 429 cooldown.
+
+Calls are only made when the budget allows them, so Layer 2 is skipped
+immediately instead of spending seconds on a request that will be rejected.
+Daily budgets roll over at midnight UTC.
+"""
+import re
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+DAY_SECONDS = 24 * 3600
+RETRY_DELAY_PATTERNS = (
+    re.compile(r"retry in ([\d.]+)\s*s", re.IGNORECASE),
+    re.compile(r"retry_delay\s*\{\s*seconds:\s*(\d+)", re.IGNORECASE),
+)
+
+def is_rate_limit_error(error: Exception) -> bool:
+    message = str(error).lower()
+    return "quota" in message or "429" in message or "resource_exhausted" in message or "rate limit" in message
+
+class GeminiRateLimiter:
+    """Admits Gemini calls within configured requests-per-minute and per-day budgets
+
+    A budget of 0 disables that limit.
+    """
+
+    def __init__(self, rpm: int = 15, rpd: int = 1500, cooldown_seconds: float = 60.0,
+                 clock: Callable[[], float] = time.time):
+        self.rpm = rpm
+        self.rpd = rpd
+        self.cooldown_seconds = cooldown_seconds
+        self._clock = clock
+        self._lock = threading.Lock()
+        now = clock()
+        self._tokens = float(rpm)
+        self._refilled_at = now
+        self._day = int(now // DAY_SECONDS)
+        self._day_count = 0
+        self._cooldown_until = 0.0
+        self.calls_admitted = 0
+        self.calls_skipped = 0
+        self.rate_limited = 0
+
+    def _refresh(self, now: float):
+        if self.rpm:
+            self._tokens = min(float(self.rpm), self._tokens + (now - self._refilled_at) * self.rpm / 60.0)
+        self._refilled_at = now
+        day = int(now // DAY_SECONDS)
+        if day != self._day:
+            self._day = day
+            self._day_count = 0
+
+    def _blocked_reason(self, now: float, cost: int) -> Optional[str]:
+        if now < self._cooldown_until:
+            return "cooldown"
+        if self.rpd and self._day_count + cost > self.rpd:
+            return "daily budget"
+        if self.rpm and self._tokens < cost:
+            return "minute budget"
+        return None
+
+    def available(self, cost: int = 1) -> bool:
+        """Whether a call of the given cost would be admitted now (does not consume budget)"""
+        with self._lock:
+            now = self._clock()
+            self._refresh(now)
+            return self._blocked_reason(now, cost) is None
+
+    def try_acquire(self, cost: int = 1) -> bool:
+        """Consume budget for a call; False means skip the call"""
+        with self._lock:
+            now = self._clock()
+            self._refresh(now)
+            if self._blocked_reason(now, cost):
+                self.calls_skipped += 1
+                return False
+            self._tokens -= cost
+            self._day_count += cost
+            self.calls_admitted += 1
+            return True
+
+    def record_rate_limited(self, error: Exception):
+        """Pause calls after a 429, using the server's retry hint when it gives one"""
+        message = str(error)
+        delay = self.cooldown_seconds
+        for pattern in RETRY_DELAY_PATTERNS:
+            match = pattern.search(message)
+            if match:
+                delay = float(match.group(1))
+                break
+        with self._lock:
+            now = self._clock()
+            if "perday" in message.lower().replace("_", "").replace(" ", ""):
+                # Daily quota exhausted upstream: wait for the rollover
+                delay = max(delay, (self._day + 1) * DAY_SECONDS - now)
+            self._cooldown_until = max(self._cooldown_until, now + delay)
+            self._tokens = 0.0
+            self.rate_limited += 1
+
+    def status(self) -> Dict:
+        with self._lock:
+            now = self._clock()
+            self._refresh(now)
+            return {
+                "available": self._blocked_reason(now, 1) is None,
+                "blocked_reason": self._blocked_reason(now, 1),
+                "rpm_limit": self.rpm,
+                "rpd_limit": self.rpd,
+                "minute_tokens": round(self._tokens, 2) if self.rpm else None,
+                "day_used": self._day_count,
+                "cooldown_remaining_seconds": round(max(0.0, self._cooldown_until - now), 1),
+                "calls_admitted": self.calls_admitted,
+                "calls_skipped": self.calls_skipped,
+                "rate_limited": self.rate_limited
+            }
@@ -0,0 +1,139 @@
+"""Persistent scan history with incrementally maintained aggregates (SQLite)"""
+import sqlite3
+import threading
+from datetime import datetime
+from typing import List, Optional, Dict
+
+ALL_USERS = "*"  # Aggregate rows covering every user
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS scans (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    created_at TEXT NOT NULL,
+    day TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    disease TEXT NOT NULL,
+    confidence REAL NOT NULL,
+    layer TEXT NOT NULL,
+    healthy INTEGER NOT NULL,
+    image_hash TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_scans_user_created ON scans (user_id, created_at);
+CREATE INDEX IF NOT EXISTS idx_scans_disease ON scans (disease);
+CREATE INDEX IF NOT EXISTS idx_scans_day ON scans (day);
+
+CREATE TABLE IF NOT EXISTS user_totals (
+    user_id TEXT PRIMARY KEY,
+    total INTEGER NOT NULL DEFAULT 0,
+    diseased INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS disease_counts (
+    user_id TEXT NOT NULL,
+    disease TEXT NOT NULL,
+    count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, disease)
+);
+CREATE TABLE IF NOT EXISTS daily_counts (
+    user_id TEXT NOT NULL,
+    day TEXT NOT NULL,
+    total INTEGER NOT NULL DEFAULT 0,
+    diseased INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, day)
+);
+"""
+
+class HistoryStore:
+    """Stores every prediction and keeps per-user and global counters up to date on write,
+    so dashboard reads are single-row or small indexed lookups instead of history scans."""
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def record_scan(self, user_id: str, disease: str, confidence: float, layer: str,
+                    healthy: bool, image_hash: Optional[str] = None,
+                    created_at: Optional[datetime] = None) -> int:
+        """Insert a scan and update aggregate counters in one transaction"""
+        if user_id == ALL_USERS:
+            raise ValueError(f"user_id {ALL_USERS!r} is reserved for the all-users aggregates")
+        created_at = created_at or datetime.now()
+        day = created_at.strftime("%Y-%m-%d")
+        diseased = 0 if healthy else 1
+
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                "INSERT INTO scans (created_at, day, user_id, disease, confidence, layer, healthy, image_hash) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (created_at.isoformat(), day, user_id, disease, confidence, layer, int(healthy), image_hash)
+            )
+            for scope in (user_id, ALL_USERS):
+                self._conn.execute(
+                    "INSERT INTO user_totals (user_id, total, diseased) VALUES (?, 1, ?) "
+                    "ON CONFLICT(user_id) DO UPDATE SET total = total + 1, diseased = diseased + excluded.diseased",
+                    (scope, diseased)
+                )
+                self._conn.execute(
+                    "INSERT INTO disease_counts (user_id, disease, count) VALUES (?, ?, 1) "
+                    "ON CONFLICT(user_id, disease) DO UPDATE SET count = count + 1",
+                    (scope, disease)
+                )
+                self._conn.execute(
+                    "INSERT INTO daily_counts (user_id, day, total, diseased) VALUES (?, ?, 1, ?) "
+                    "ON CONFLICT(user_id, day) DO UPDATE SET total = total + 1, diseased = diseased + excluded.diseased",
+                    (scope, day, diseased)
+                )
+            return cursor.lastrowid
+
+    def get_summary(self, user_id: str = ALL_USERS) -> Dict:
+        """Total scans and disease rate for a user (or all users)"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT total, diseased FROM user_totals WHERE user_id = ?", (user_id,)
+            ).fetchone()
+        total = row["total"] if row else 0
+        diseased = row["diseased"] if row else 0
+        return {
+            "user_id": user_id,
+            "total_scans": total,
+            "diseased_scans": diseased,
+            "healthy_scans": total - diseased,
+            "disease_rate": diseased / total if total else 0.0
+        }
+
+    def get_disease_counts(self, user_id: str = ALL_USERS) -> Dict[str, int]:
+        """Scan counts per disease, most frequent first"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT disease, count FROM disease_counts WHERE user_id = ? ORDER BY count DESC",
+                (user_id,)
+            ).fetchall()
+        return {row["disease"]: row["count"] for row in rows}
+
+    def get_daily_counts(self, user_id: str = ALL_USERS, days: int = 30) -> List[Dict]:
+        """Per-day totals for the most recent days that have scans"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT day, total, diseased FROM daily_counts WHERE user_id = ? ORDER BY day DESC LIMIT ?",
+                (user_id, days)
+            ).fetchall()
+        return [dict(row) for row in reversed(rows)]
+
+    def get_recent_scans(self, user_id: str, limit: int = 20) -> List[Dict]:
+        """Most recent scans for a user, newest first"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, created_at, disease, confidence, layer, healthy FROM scans "
+                "WHERE user_id = ? ORDER BY created_at DESC LIMIT ?",
+                (user_id, limit)
+            ).fetchall()
+        return [dict(row, healthy=bool(row["healthy"])) for row in rows]
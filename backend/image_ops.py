@@ -0,0 +1,177 @@
+"""Image transforms for inference: quality checks, leaf cropping, tiling and test-time augmentation views"""
+from typing import NamedTuple, Optional, Tuple
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from PIL import Image
+
+TTA_ROTATIONS = (-12, 12)
+
+QUALITY_THUMBNAIL_SIZE = 256
+LUMA_WEIGHTS = np.array([0.299, 0.587, 0.114], dtype=np.float32)
+
+class QualityReport(NamedTuple):
+    sharpness: float  # Variance of the Laplacian of the grayscale thumbnail
+    brightness: float  # Mean luminance, 0-255
+    clipped_fraction: float  # Share of pure black or pure white pixels
+    plant_fraction: float  # Share of saturated green, yellow or brown pixels
+
+def measure_quality(image: Image.Image) -> QualityReport:
+    """Cheap blur, exposure and plant-colour measurements on a nearest-neighbour thumbnail
+
+    Nearest-neighbour sampling keeps the pixel-level detail the Laplacian
+    needs, where a smoothing resize would hide blur.
+    """
+    scale = min(1.0, QUALITY_THUMBNAIL_SIZE / max(image.size))
+    size = (max(3, round(image.size[0] * scale)), max(3, round(image.size[1] * scale)))
+    thumbnail = image.resize(size, Image.Resampling.NEAREST).convert("RGB")
+
+    rgb = np.asarray(thumbnail, dtype=np.float32)
+    gray = rgb @ LUMA_WEIGHTS
+    laplacian = 4 * gray[1:-1, 1:-1] - gray[:-2, 1:-1] - gray[2:, 1:-1] - gray[1:-1, :-2] - gray[1:-1, 2:]
+
+    # Hue between ~25 and ~160 degrees (yellow-brown through green), without an HSV conversion:
+    # with blue lowest, hue >= 25 means green is at least 5/12 of the way from blue to red;
+    # with red lowest and green highest, hue <= 160 means blue is at most 2/3 of the way to green
+    r, g, b = rgb[..., 0], rgb[..., 1], rgb[..., 2]
+    maximum = np.maximum(np.maximum(r, g), b)
+    chroma = maximum - np.minimum(np.minimum(r, g), b)
+    warm = (b <= r) & (b <= g) & (g - b >= (5 / 12) * (r - b))
+    cool = (r < b) & (g >= b) & (b - r <= (2 / 3) * (g - r))
+    plant = (warm | cool) & (chroma > 0.2 * maximum) & (maximum > 38)
+
+    return QualityReport(
+        sharpness=float(laplacian.var()),
+        brightness=float(gray.mean()),
+        clipped_fraction=float(((gray < 8) | (gray > 247)).mean()),
+        plant_fraction=float(plant.mean())
+    )
+
+LEAF_THUMBNAIL_SIZE = 128
+LEAF_MIN_FRACTION = 0.02  # Below this share of vegetation pixels nothing is cropped
+LEAF_MAX_AREA = 0.6  # Boxes covering more of the photo than this are not worth cropping
+LEAF_MARGIN = 0.12  # Padding around the detected region, relative to its size
+
+def otsu_threshold(values: np.ndarray, bins: int = 64) -> float:
+    """Threshold maximizing between-class variance of a 1-D sample"""
+    hist, edges = np.histogram(values, bins=bins)
+    centers = (edges[:-1] + edges[1:]) / 2
+    weight = np.cumsum(hist)
+    total = weight[-1]
+    mean = np.cumsum(hist * centers)
+    between = (mean[-1] * weight / total - mean) ** 2 / np.maximum(weight * (total - weight), 1)
+    return float(centers[np.argmax(between[:-1])])
+
+def excess_green(rgb: np.ndarray) -> np.ndarray:
+    """Excess-green vegetation index (2g - r - b on chromaticity) of an (H, W, 3) array"""
+    # 2g - r - b on chromaticity simplifies to 3G / (R + G + B) - 1
+    return 3 * rgb[..., 1] / (rgb[..., 0] + rgb[..., 1] + rgb[..., 2] + 1e-6) - 1
+
+def locate_leaf(image: Image.Image) -> Optional[Tuple[int, int, int, int]]:
+    """Square box (left, top, right, bottom) around the dominant leaf region, or None
+
+    Works on a small thumbnail: vegetation is segmented with the excess-green
+    index (2g - r - b on chromaticity) thresholded by Otsu. The box spans the
+    2nd-98th percentile of mask coordinates, which ignores scattered
+    background specks without a connected-components pass, and is padded so
+    lesions at the leaf edge stay inside it.
+    """
+    scale = LEAF_THUMBNAIL_SIZE / max(image.size)
+    thumbnail_size = (max(1, round(image.size[0] * scale)), max(1, round(image.size[1] * scale)))
+    thumbnail = image.resize(thumbnail_size, Image.Resampling.NEAREST).convert("RGB")
+    rgb = np.asarray(thumbnail, dtype=np.float32)
+    index = excess_green(rgb)
+    mask = index > max(otsu_threshold(index), 0.05)
+    if mask.mean() < LEAF_MIN_FRACTION:
+        return None
+
+    rows, cols = np.nonzero(mask)
+    top, bottom = np.percentile(rows, (2, 98))
+    left, right = np.percentile(cols, (2, 98))
+
+    # Pad, square up (the model sees square inputs) and map back to full resolution
+    scale_x = image.size[0] / rgb.shape[1]
+    scale_y = image.size[1] / rgb.shape[0]
+    center_x = (left + right + 1) / 2 * scale_x
+    center_y = (top + bottom + 1) / 2 * scale_y
+    side = max((right - left + 1) * scale_x, (bottom - top + 1) * scale_y) * (1 + 2 * LEAF_MARGIN)
+    side = min(side, min(image.size))
+    if side * side > LEAF_MAX_AREA * image.size[0] * image.size[1]:
+        return None
+    left = int(min(max(center_x - side / 2, 0), image.size[0] - side))
+    top = int(min(max(center_y - side / 2, 0), image.size[1] - side))
+    return left, top, left + int(side), top + int(side)
+
+def crop_to_leaf(image: Image.Image) -> Image.Image:
+    """Crop to the detected leaf region, or return the image unchanged when none stands out"""
+    box = locate_leaf(image)
+    return image.crop(box) if box else image
+
+def tta_views(image: Image.Image, base: np.ndarray) -> np.ndarray:
+    """Augmented views for test-time augmentation as one (N, size, size, 3) float32 batch
+
+    base is the already preprocessed (size, size, 3) view of image; it is not
+    included, since its prediction is already known. Flips and the transpose
+    are strided views of base; zoomed and rotated views come from a single
+    slightly larger resize, so no view is resampled twice.
+    """
+    size = base.shape[0]
+    margin = size // 8
+    zoomed = image.resize((size + 2 * margin, size + 2 * margin), Image.Resampling.BILINEAR)
+    inner = (margin, margin, margin + size, margin + size)
+
+    views = np.empty((4 + 2 + len(TTA_ROTATIONS), size, size, 3), dtype=np.float32)
+    views[0] = base[:, ::-1]
+    views[1] = base[::-1]
+    views[2] = base.transpose(1, 0, 2)
+    views[3] = base[::-1, ::-1]
+    views[4] = np.asarray(zoomed.crop(inner), dtype=np.float32)
+    views[5] = views[4, :, ::-1]
+    for i, angle in enumerate(TTA_ROTATIONS):
+        views[6 + i] = np.asarray(zoomed.rotate(angle, resample=Image.Resampling.BILINEAR).crop(inner), dtype=np.float32)
+    views[4:] *= 1.0 / 255.0
+    return views
+
+def _axis_tiles(length: float, tile: int, overlap: float) -> Tuple[int, int]:
+    """Tile count and integer stride covering length with at least the given overlap"""
+    if length <= tile:
+        return 1, tile
+    count = int(np.ceil((length - tile) / (tile * (1 - overlap)))) + 1
+    return count, int(np.ceil((length - tile) / (count - 1)))
+
+def tile_layout(width: int, height: int, tile: int, overlap: float, max_tiles: int) -> Tuple[int, int, int, int, int, int]:
+    """Grid for tiling: (resized width, resized height, rows, cols, row stride, column stride)
+
+    Each axis gets its own integer stride so whole tiles cover the image
+    exactly after a resize of at most a few pixels; the image is shrunk
+    further while the grid would exceed max_tiles.
+    """
+    scale = max(1.0, tile / min(width, height))  # Upscale so at least one tile fits
+    while True:
+        rows, row_stride = _axis_tiles(height * scale, tile, overlap)
+        cols, col_stride = _axis_tiles(width * scale, tile, overlap)
+        if rows * cols <= max_tiles or (rows == 1 and cols == 1):
+            break
+        scale *= 0.9
+    return (tile + (cols - 1) * col_stride, tile + (rows - 1) * row_stride,
+            rows, cols, row_stride, col_stride)
+
+def tile_views(image: Image.Image, tile: int, overlap: float = 0.25, max_tiles: int = 16):
+    """Overlapping model-sized tiles of image as a strided view, plus each tile's vegetation share
+
+    Returns (grid, leaf_fraction, layout): grid is a (rows, cols, tile, tile, 3)
+    float32 view into one normalized copy of the resized image, so tiles are
+    not copied individually; leaf_fraction is a (rows, cols) array and layout
+    is the tile_layout tuple.
+    """
+    layout = tile_layout(*image.size, tile, overlap, max_tiles)
+    width, height, rows, cols, row_stride, col_stride = layout
+    resized = image.convert("RGB").resize((width, height), Image.Resampling.BILINEAR)
+    pixels = np.asarray(resized, dtype=np.float32)
+    index = excess_green(pixels)
+    vegetation = (index > max(otsu_threshold(index[::4, ::4]), 0.05)).astype(np.float32)
+    pixels *= 1.0 / 255.0
+
+    grid = sliding_window_view(pixels, (tile, tile, 3))[::row_stride, ::col_stride, 0]
+    leaf_fraction = sliding_window_view(vegetation, (tile, tile))[::row_stride, ::col_stride].mean(axis=(2, 3))
+    return grid, leaf_fraction, layout
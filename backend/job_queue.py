@@ -0,0 +1,273 @@
+"""Persistent priority job queue with a local asyncio worker pool (SQLite-backed).
+
+Jobs are stored in SQLite so their status survives restarts; dispatch order
+comes from an in-process priority queue rebuilt from the database on start.
+Lower priority numbers run first, so interactive jobs outrank bulk jobs.
+
+All database access runs on one database thread, in the order it was
+requested, so commits never block the event loop and a progress report
+cannot overwrite a job's final status. Job inputs (uploaded images) are
+files in inputs_dir rather than blobs in the table.
+"""
+import asyncio
+import itertools
+import json
+import logging
+import os
+import sqlite3
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Awaitable, Callable, Dict, List, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BULK = 10
+PRIORITIES = {"interactive": PRIORITY_INTERACTIVE, "bulk": PRIORITY_BULK}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    priority INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    progress REAL NOT NULL DEFAULT 0,
+    stage TEXT,
+    payload TEXT NOT NULL,
+    input BLOB,  -- Only set by versions that stored inputs in the table
+    result TEXT,
+    error TEXT,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_status_priority ON jobs (status, priority, created_at);
+CREATE INDEX IF NOT EXISTS idx_jobs_finished ON jobs (finished_at);
+"""
+
+# handler(payload, input_bytes, report_progress) -> result dict
+JobHandler = Callable[[dict, Optional[bytes], Callable[[float, str], None]], Awaitable[dict]]
+
+class JobQueue:
+    """Accepts jobs immediately and runs them on a bounded pool of asyncio workers"""
+
+    def __init__(self, db_path: str, workers: int = 2, retention_seconds: int = 24 * 3600,
+                 purge_interval_seconds: int = 600, inputs_dir: Optional[str] = None):
+        self.workers = workers
+        self.retention_seconds = retention_seconds
+        self.purge_interval_seconds = purge_interval_seconds
+        self.inputs_dir = inputs_dir or f"{db_path}.inputs"
+        os.makedirs(self.inputs_dir, exist_ok=True)
+        self._last_purge = 0.0
+        self._handlers: Dict[str, JobHandler] = {}
+        self._db = ThreadPoolExecutor(max_workers=1, thread_name_prefix="job-db")
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+        self._conn.commit()
+        self._queue: Optional[asyncio.PriorityQueue] = None
+        self._sequence = itertools.count()
+        self._tasks = []
+        self._watchers: Dict[str, Set[asyncio.Event]] = {}
+
+    def register(self, kind: str, handler: JobHandler):
+        self._handlers[kind] = handler
+
+    async def _call(self, function: Callable, *args):
+        """Run function on the database thread"""
+        return await asyncio.get_running_loop().run_in_executor(self._db, function, *args)
+
+    # The methods below run on the database thread
+
+    def _execute(self, sql: str, params: tuple = ()):
+        with self._conn:
+            self._conn.execute(sql, params)
+
+    def _fetchall(self, sql: str, params: tuple = ()) -> List[sqlite3.Row]:
+        return self._conn.execute(sql, params).fetchall()
+
+    def _input_path(self, job_id: str) -> str:
+        return os.path.join(self.inputs_dir, job_id)
+
+    def _insert(self, job_id: str, kind: str, priority: int, payload: str, input_bytes: Optional[bytes]):
+        if input_bytes is not None:
+            with open(self._input_path(job_id), "wb") as f:
+                f.write(input_bytes)
+        self._execute(
+            "INSERT INTO jobs (id, kind, priority, status, payload, created_at) VALUES (?, ?, ?, 'queued', ?, ?)",
+            (job_id, kind, priority, payload, time.time())
+        )
+
+    def _load(self, job_id: str) -> Optional[tuple]:
+        """(kind, payload, input bytes) for a queued job, marking it running"""
+        rows = self._fetchall("SELECT kind, payload, input, status FROM jobs WHERE id = ?", (job_id,))
+        if not rows or rows[0]["status"] != "queued":
+            return None
+        row = rows[0]
+        input_bytes = row["input"]
+        if input_bytes is None and os.path.exists(self._input_path(job_id)):
+            with open(self._input_path(job_id), "rb") as f:
+                input_bytes = f.read()
+        self._execute("UPDATE jobs SET status = 'running', started_at = ? WHERE id = ?", (time.time(), job_id))
+        return row["kind"], json.loads(row["payload"]), input_bytes
+
+    def _update_row(self, job_id: str, fields: dict):
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        self._execute(f"UPDATE jobs SET {assignments} WHERE id = ?", (*fields.values(), job_id))
+        if "finished_at" in fields:
+            self._remove_input(job_id)
+
+    def _remove_input(self, job_id: str):
+        try:
+            os.remove(self._input_path(job_id))
+        except FileNotFoundError:
+            pass
+
+    def _purge(self):
+        cutoff = time.time() - self.retention_seconds
+        self._execute("DELETE FROM jobs WHERE finished_at IS NOT NULL AND finished_at < ?", (cutoff,))
+        # Inputs of finished jobs are removed when they finish; this catches any left by a crash
+        active = {row["id"] for row in self._fetchall("SELECT id FROM jobs WHERE status IN ('queued', 'running')")}
+        for name in os.listdir(self.inputs_dir):
+            if name not in active:
+                self._remove_input(name)
+
+    def _recover(self) -> List[sqlite3.Row]:
+        self._execute("UPDATE jobs SET status = 'queued', stage = NULL WHERE status = 'running'")
+        self._purge()
+        return self._fetchall("SELECT id, priority FROM jobs WHERE status = 'queued' ORDER BY priority, created_at")
+
+    # Event loop side
+
+    async def start(self):
+        """Recover unfinished jobs, purge old ones and start the workers"""
+        self._queue = asyncio.PriorityQueue()
+        self._last_purge = time.time()
+        rows = await self._call(self._recover)
+        for row in rows:
+            self._queue.put_nowait((row["priority"], next(self._sequence), row["id"]))
+        if rows:
+            logger.info("Recovered %d queued job(s)", len(rows))
+        self._tasks = [asyncio.create_task(self._worker(i)) for i in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._db.shutdown(wait=True)  # Let queued progress writes finish
+        self._conn.close()
+
+    async def purge(self):
+        """Delete finished jobs older than the retention period"""
+        self._last_purge = time.time()
+        await self._call(self._purge)
+
+    async def _maybe_purge(self):
+        """Purge from the worker loop at most once per purge interval"""
+        if time.time() - self._last_purge >= self.purge_interval_seconds:
+            try:
+                await self.purge()
+            except Exception as e:
+                logger.warning("Job purge failed: %s", e)
+
+    async def submit(self, kind: str, payload: dict, input_bytes: Optional[bytes] = None,
+                     priority: int = PRIORITY_INTERACTIVE) -> str:
+        """Persist a job and queue it; returns the job id"""
+        if kind not in self._handlers:
+            raise ValueError(f"Unknown job kind: {kind}")
+        if self._queue is None:
+            raise RuntimeError("Job queue is not running")
+        job_id = uuid.uuid4().hex
+        await self._call(self._insert, job_id, kind, priority, json.dumps(payload), input_bytes)
+        self._queue.put_nowait((priority, next(self._sequence), job_id))
+        return job_id
+
+    async def get(self, job_id: str) -> Optional[dict]:
+        """Job status without its input"""
+        rows = await self._call(
+            self._fetchall,
+            "SELECT id, kind, priority, status, progress, stage, result, error, created_at, started_at, finished_at "
+            "FROM jobs WHERE id = ?", (job_id,)
+        )
+        if not rows:
+            return None
+        job = dict(rows[0])
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+
+    def queue_depth(self) -> int:
+        return self._queue.qsize() if self._queue else 0
+
+    @contextmanager
+    def watch(self, job_id: str):
+        """Change event for one watcher of a job
+        
+        Enter before reading the job's status: updates made between the read
+        and wait_for_change() then still wake the watcher.
+        """
+        event = asyncio.Event()
+        self._watchers.setdefault(job_id, set()).add(event)
+        try:
+            yield event
+        finally:
+            watchers = self._watchers.get(job_id)
+            if watchers is not None:
+                watchers.discard(event)
+                if not watchers:
+                    del self._watchers[job_id]
+
+    async def wait_for_change(self, event: asyncio.Event, timeout: float) -> bool:
+        """Wait on a watch() event until the job's status or progress changes; False on timeout"""
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            event.clear()
+
+    def _notify(self, job_id: str):
+        for event in self._watchers.get(job_id, ()):
+            event.set()
+
+    async def _update(self, job_id: str, **fields):
+        await self._call(self._update_row, job_id, fields)
+        self._notify(job_id)
+
+    async def _worker(self, worker_id: int):
+        while True:
+            priority, _, job_id = await self._queue.get()
+            try:
+                await self._run(job_id)
+            except Exception as e:
+                logger.exception("Job worker %d failed on %s: %s", worker_id, job_id, e)
+            finally:
+                self._queue.task_done()
+            await self._maybe_purge()
+
+    async def _run(self, job_id: str):
+        job = await self._call(self._load, job_id)
+        if job is None:
+            return
+        kind, payload, input_bytes = job
+        self._notify(job_id)
+        loop = asyncio.get_running_loop()
+
+        def report_progress(progress: float, stage: str):
+            # Called from handlers without awaiting; the database thread keeps writes in order
+            write = self._db.submit(self._update_row, job_id, {"progress": progress, "stage": stage})
+            write.add_done_callback(lambda _: loop.call_soon_threadsafe(self._notify, job_id))
+
+        try:
+            result = await self._handlers[kind](payload, input_bytes, report_progress)
+            await self._update(job_id, status="done", progress=1.0, result=json.dumps(result),
+                               input=None, finished_at=time.time())
+        except Exception as e:
+            detail = getattr(e, "detail", None) or str(e)
+            logger.error("Job %s failed: %s", job_id, detail, exc_info=not hasattr(e, "detail"),
+                         extra={"job_id": job_id, "job_kind": kind})
+            await self._update(job_id, status="failed", error=str(detail), input=None, finished_at=time.time())
@@ -0,0 +1,382 @@
+"""Unified disease knowledge base, compiled once from the scattered sources.
+
+Sources are the model labels, the flat solution table (web_app/data.json,
+mirrored by the Android solutions.json) and, optionally, Gemini enrichments
+exported from the Redis cache or a JSON file. They are compiled into a
+single gzip JSON file whose records are index-aligned with the model output
+(record id == label index; solution table entries that match no label
+follow) and whose name and alias indexes are prebuilt, so loading is one
+parse and every lookup is a dict access. A trigram index over names,
+aliases and solution text is built on load for ranked fuzzy search.
+
+Enrichments are bundled as record details only when they match a label or
+solution table entry and have every section the clients render; others are
+skipped with a warning. The compiled file keeps a digest of the labels and
+solution table it was built from, so the backend can tell when it is stale.
+
+Usage:
+    python knowledge_base.py --output ../web_app/knowledge_base.json.gz
+    python knowledge_base.py --redis-url redis://localhost:6379/0  # include cached enrichments
+"""
+import argparse
+import gzip
+import hashlib
+import json
+import logging
+import os
+import re
+import sys
+from collections import Counter
+from typing import Dict, Iterable, List, NamedTuple, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+FORMAT_VERSION = 1
+HIGH_SEVERITY_MARKERS = ("there is no cure", "this is serious", "destroy infected", "remove infected plants")
+FUZZY_CUTOFF = 0.6  # Trigram similarity a name must reach for find() to accept it
+FUZZY_MARGIN = 0.1  # ...and its lead over the runner-up ("late blight" fits potato and tomato)
+TEXT_MATCH_WEIGHT = 0.5  # Solution text matches rank below name matches
+UNIVERSAL_PREFIX = "[Universal] "  # Marks Layer 2 names that are not model classes
+# Keys the clients render from a details record (the backend's DiseaseDetail shape)
+DETAIL_SECTIONS = {
+    "causes": ("details",),
+    "prevention": ("measures",),
+    "treatment": ("stages",),
+    "emergency": ("action", "signs"),
+    "recovery": ("timeline", "success_rate"),
+}
+STAGE_KEYS = ("name", "description", "components", "medications")
+MEDICATION_KEYS = ("name", "dosage", "frequency", "side_effects")
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_ROOT = os.path.dirname(BASE_DIR)
+ANDROID_ASSETS_DIR = os.path.join(PROJECT_ROOT, "android_app", "app", "src", "main", "assets")
+DEFAULT_LABELS_PATH = os.path.join(ANDROID_ASSETS_DIR, "labels.txt")
+DEFAULT_SOLUTION_PATHS = (
+    os.path.join(PROJECT_ROOT, "web_app", "data.json"),
+    os.path.join(ANDROID_ASSETS_DIR, "solutions.json"),
+)
+DEFAULT_OUTPUT_PATH = os.path.join(PROJECT_ROOT, "web_app", "knowledge_base.json.gz")
+
+def normalize_name(text: str) -> str:
+    """Lowercase space-separated words; labels, data.json keys and Gemini names all normalize alike"""
+    if text.startswith(UNIVERSAL_PREFIX):
+        text = text[len(UNIVERSAL_PREFIX):]
+    return " ".join(re.sub(r"[^a-z0-9]+", " ", text.lower()).split())
+
+def resolve_solution_key(label: str, solution_keys: Dict[str, str]) -> Optional[str]:
+    """Find the data.json key for a label (exact match, then unique same-crop word subset)"""
+    normalized = normalize_name(label.replace("___", " "))
+    if normalized in solution_keys:
+        return solution_keys[normalized]
+
+    words = set(normalized.split())
+    crop = normalized.split(" ", 1)[0]
+    candidates = [
+        key for norm_key, key in solution_keys.items()
+        if norm_key.split(" ", 1)[0] == crop and words <= set(norm_key.split())
+    ]
+    return candidates[0] if len(candidates) == 1 else None
+
+def _name_variants(text: str) -> List[str]:
+    """Normalized variants of a name: as written, without and from parentheticals, and each
+    space-separated alternative ("Cercospora_leaf_spot Gray_leaf_spot")"""
+    variants = [text, re.sub(r"\([^)]*\)", " ", text)] + re.findall(r"\(([^)]*)\)", text)
+    if "_" in text and " " in text.strip():
+        variants += text.split()
+    return list(dict.fromkeys(filter(None, (normalize_name(variant) for variant in variants))))
+
+def label_aliases(label: str) -> List[str]:
+    """Alternative normalized names a label may be asked for by"""
+    crop, _, disease = label.partition("___")
+    if not disease:
+        return _name_variants(label)
+    aliases = []
+    for crop_name in _name_variants(crop):
+        for disease_name in _name_variants(disease):
+            aliases.append(f"{crop_name} {disease_name}")
+            if disease_name == "healthy":
+                aliases.append(f"healthy {crop_name}")
+    aliases += [name for name in _name_variants(disease) if name != "healthy"]  # Kept only if unambiguous
+    return list(dict.fromkeys(aliases))
+
+def severity_of(solution: str, healthy: bool) -> str:
+    if healthy:
+        return "none"
+    if any(marker in solution.lower() for marker in HIGH_SEVERITY_MARKERS):
+        return "high"
+    return "moderate"
+
+def renderable_details(details) -> bool:
+    """Whether a details record has every section and field the clients render"""
+    if not isinstance(details, dict) or not isinstance(details.get("medications"), list):
+        return False
+    for section, keys in DETAIL_SECTIONS.items():
+        if not isinstance(details.get(section), dict) or any(key not in details[section] for key in keys):
+            return False
+    stages = details["treatment"]["stages"]
+    return (isinstance(stages, list)
+            and all(isinstance(stage, dict) and all(key in stage for key in STAGE_KEYS) for stage in stages)
+            and all(isinstance(med, dict) and all(key in med for key in MEDICATION_KEYS)
+                    for med in details["medications"]))
+
+def source_digest(labels: List[str], solutions: Dict[str, str]) -> str:
+    """Digest of the labels and solution table a knowledge base is compiled from"""
+    sources = json.dumps({"labels": labels, "solutions": solutions}, sort_keys=True, ensure_ascii=False)
+    return hashlib.blake2b(sources.encode("utf-8"), digest_size=8).hexdigest()
+
+def compile_knowledge_base(labels: List[str], solutions: Dict[str, str],
+                           enrichments: Optional[Dict[str, dict]] = None) -> dict:
+    """Join the sources into the on-disk structure; fail if any label has no solution
+
+    enrichments maps disease names to DiseaseDetail dicts. Those that match
+    no label or solution key, or are not renderable, are skipped.
+    """
+    solution_keys = {normalize_name(key): key for key in solutions}
+    records = []
+    missing = []
+    for label_id, label in enumerate(labels):
+        key = resolve_solution_key(label, solution_keys)
+        if key is None:
+            missing.append(label)
+            continue
+        healthy = "healthy" in label.lower() or label == "background"
+        records.append({
+            "id": label_id,
+            "label": label,
+            "name": label.replace("___", " - ").replace("_", " "),
+            "solution_key": key,
+            "solution": solutions[key],
+            "healthy": healthy,
+            "severity": severity_of(solutions[key], healthy),
+            "details": None,
+            "aliases": label_aliases(label)
+        })
+    if missing:
+        raise ValueError(f"No solution mapping for {len(missing)} label(s): {', '.join(missing)}")
+    used_keys = {record["solution_key"] for record in records}
+    for key, solution in solutions.items():
+        if key not in used_keys:  # e.g. "background", served by the pre-filter
+            records.append({
+                "id": len(records),
+                "label": None,
+                "name": key.capitalize(),
+                "solution_key": key,
+                "solution": solution,
+                "healthy": key == "background",
+                "severity": severity_of(solution, key == "background"),
+                "details": None,
+                "aliases": []
+            })
+
+    names = {}
+    for record in records:
+        if record["label"]:
+            names.setdefault(normalize_name(record["label"].replace("___", " ")), record["id"])
+        names.setdefault(normalize_name(record["solution_key"]), record["id"])
+
+    def find(name: str) -> Optional[int]:
+        normalized = normalize_name(name)
+        if normalized in names:
+            return names[normalized]
+        key = resolve_solution_key(name, solution_keys)
+        return names.get(normalize_name(key)) if key else None
+
+    skipped = []
+    for name, details in (enrichments or {}).items():
+        target = find(name)
+        if target is None or not renderable_details(details):
+            skipped.append(name)
+        elif not records[target]["details"]:
+            records[target]["details"] = details
+    if skipped:
+        logger.warning("Skipped %d enrichment(s) with no model class or missing sections: %s",
+                       len(skipped), ", ".join(skipped))
+
+    # Aliases claimed by more than one record are ambiguous ("late blight") and dropped
+    claims: Dict[str, set] = {}
+    for record in records:
+        for alias in record["aliases"]:
+            claims.setdefault(alias, set()).add(record["id"])
+    aliases = {alias: ids.pop() for alias, ids in claims.items() if len(ids) == 1 and alias not in names}
+
+    body = {"format": FORMAT_VERSION, "sources": source_digest(labels, solutions),
+            "records": records, "names": names, "aliases": aliases}
+    body["version"] = hashlib.blake2b(json.dumps(body, sort_keys=True).encode("utf-8"), digest_size=6).hexdigest()
+    return body
+
+def trigrams(text: str) -> Set[str]:
+    """Word trigrams padded like pg_trgm ("  a", " ab", "abc", "bc ")"""
+    grams = set()
+    for word in normalize_name(text).split():
+        padded = f"  {word} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+class SearchMatch(NamedTuple):
+    record_id: int
+    score: float
+    matched: str  # The name, alias or text the score came from
+
+class SearchIndex:
+    """Trigram postings over record names, aliases and solution text
+
+    Names score by trigram Jaccard similarity with the query; solution text
+    by the share of query trigrams it contains, scaled by TEXT_MATCH_WEIGHT.
+    A record ranks by its best-scoring entry.
+    """
+
+    def __init__(self, records: List[dict]):
+        self._entries: List[tuple] = []  # (record id, text, trigram count, is solution text)
+        self._postings: Dict[str, List[int]] = {}
+        for record in records:
+            names = [record["name"], record["label"] or "", record["solution_key"] or ""] + record["aliases"]
+            for name in dict.fromkeys(filter(None, map(normalize_name, names))):
+                self._add(record["id"], name, False)
+            if record["solution"]:
+                self._add(record["id"], record["solution"], True)
+
+    def _add(self, record_id: int, text: str, is_text: bool):
+        grams = trigrams(text)
+        entry = len(self._entries)
+        self._entries.append((record_id, text, len(grams), is_text))
+        for gram in grams:
+            self._postings.setdefault(gram, []).append(entry)
+
+    def search(self, query: str, limit: int = 5, min_score: float = 0.2, names_only: bool = False) -> List[SearchMatch]:
+        grams = trigrams(query)
+        if not grams:
+            return []
+        shared = Counter()
+        for gram in grams:
+            shared.update(self._postings.get(gram, ()))
+
+        best: Dict[int, SearchMatch] = {}
+        for entry, count in shared.items():
+            record_id, text, size, is_text = self._entries[entry]
+            if is_text:
+                if names_only:
+                    continue
+                score = TEXT_MATCH_WEIGHT * count / len(grams)
+            else:
+                score = count / (len(grams) + size - count)
+            if score >= min_score and (record_id not in best or score > best[record_id].score):
+                best[record_id] = SearchMatch(record_id, round(score, 4), text)
+        return sorted(best.values(), key=lambda match: -match.score)[:limit]
+
+class KnowledgeBase:
+    """In-memory view of a compiled knowledge base"""
+
+    def __init__(self, data: dict):
+        if data.get("format") != FORMAT_VERSION:
+            raise ValueError(f"Unsupported knowledge base format: {data.get('format')}")
+        self.version: str = data["version"]
+        self.sources: Optional[str] = data.get("sources")  # Absent in files compiled before it was recorded
+        self.records: List[dict] = data["records"]
+        self.names: Dict[str, int] = data["names"]
+        self.aliases: Dict[str, int] = data["aliases"]
+        self.labels = [record["label"] for record in self.records if record["label"] is not None]
+        self.solutions = {
+            record["solution_key"]: record["solution"] for record in self.records if record["solution_key"]
+        }
+        self.search_index = SearchIndex(self.records)
+
+    @classmethod
+    def load(cls, path: str) -> "KnowledgeBase":
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            return cls(json.load(f))
+
+    def save(self, path: str):
+        data = {"format": FORMAT_VERSION, "version": self.version, "sources": self.sources,
+                "records": self.records, "names": self.names, "aliases": self.aliases}
+        payload = json.dumps(data, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+        with open(path, "wb") as f:
+            f.write(gzip.compress(payload, compresslevel=9, mtime=0))  # mtime=0 keeps rebuilds byte-identical
+
+    def record(self, record_id: int) -> dict:
+        return self.records[record_id]
+
+    def find(self, name: str, fuzzy: bool = True, min_score: float = FUZZY_CUTOFF) -> Optional[int]:
+        """Record id for a label, solution key, display or Gemini name, or a clearly closest name"""
+        normalized = normalize_name(name)
+        record_id = self.names.get(normalized, self.aliases.get(normalized))
+        if record_id is None and fuzzy:
+            matches = self.search_index.search(normalized, limit=2, min_score=min_score, names_only=True)
+            if matches and (len(matches) == 1 or matches[0].score - matches[1].score >= FUZZY_MARGIN):
+                record_id = matches[0].record_id
+        return record_id
+
+    def search(self, query: str, limit: int = 5, min_score: float = 0.2) -> List[SearchMatch]:
+        """Ranked fuzzy matches over names, aliases and solution text"""
+        return self.search_index.search(query, limit, min_score)
+
+    def details(self, name: str) -> Optional[dict]:
+        """Compiled enrichment details for a disease name"""
+        record_id = self.find(name)
+        return self.records[record_id]["details"] if record_id is not None else None
+
+    def enrichments(self) -> Dict[str, dict]:
+        """Bundled details keyed by record name, in the form compile_knowledge_base takes them"""
+        return {record["name"]: record["details"] for record in self.records if record["details"]}
+
+def read_json(path: str) -> dict:
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def read_labels(path: str) -> List[str]:
+    with open(path, "r", encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip()]
+
+def merge_solution_tables(paths: Iterable[str]) -> Dict[str, str]:
+    """Merge solution tables, first path winning; warns about entries the copies disagree on"""
+    merged: Dict[str, str] = {}
+    for path in paths:
+        if not os.path.exists(path):
+            continue
+        for key, solution in read_json(path).items():
+            if key in merged and merged[key] != solution:
+                logger.warning("Conflicting solution for '%s' in %s; keeping the first", key, path)
+            merged.setdefault(key, solution)
+    return merged
+
+def load_redis_enrichments(url: str) -> Dict[str, dict]:
+    """Cached Gemini enrichments keyed by normalized disease name"""
+    import redis
+    client = redis.Redis.from_url(url, decode_responses=True)
+    keys = client.zrange("knowledge:enrichment_versions", 0, -1)
+    values = client.mget(keys) if keys else []
+    return {key.split(":", 1)[1]: json.loads(value) for key, value in zip(keys, values) if value}
+
+def build(labels_path: str = DEFAULT_LABELS_PATH, solution_paths: Iterable[str] = DEFAULT_SOLUTION_PATHS,
+          enrichments: Optional[Dict[str, dict]] = None) -> KnowledgeBase:
+    """Compile a knowledge base from source files; missing solution tables are skipped"""
+    return KnowledgeBase(compile_knowledge_base(
+        read_labels(labels_path), merge_solution_tables(solution_paths), enrichments
+    ))
+
+def parse_args(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Compile the disease knowledge base")
+    parser.add_argument("--labels", default=DEFAULT_LABELS_PATH, help="Model labels file")
+    parser.add_argument("--solutions", nargs="+", default=list(DEFAULT_SOLUTION_PATHS),
+                        help="Flat solution tables (data.json / solutions.json)")
+    parser.add_argument("--enrichments", help="JSON file of disease name -> enrichment details")
+    parser.add_argument("--redis-url", help="Also include enrichments cached in this Redis instance")
+    parser.add_argument("--output", default=DEFAULT_OUTPUT_PATH, help="Compiled knowledge base path")
+    return parser.parse_args(argv)
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
+    enrichments = read_json(args.enrichments) if args.enrichments else {}
+    if args.redis_url:
+        enrichments.update(load_redis_enrichments(args.redis_url))
+    knowledge = build(args.labels, args.solutions, enrichments)
+    knowledge.save(args.output)
+    detailed = sum(1 for record in knowledge.records if record["details"])
+    print(f"Wrote {args.output}: version {knowledge.version}, {len(knowledge.records)} records "
+          f"({len(knowledge.labels)} labels, {detailed} detailed), {len(knowledge.aliases)} aliases, "
+          f"{os.path.getsize(args.output)} bytes")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
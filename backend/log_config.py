@@ -0,0 +1,115 @@
+"""Logging setup: text or JSON records, rotation, request sampling and a non-blocking queue.
+
+Handlers that touch the disk or the console run on a QueueListener thread;
+request handlers only enqueue records. Filters run before enqueueing, in
+the caller's context, so the request id is read from the right task and
+sampled-out records never reach the queue. INFO records logged during a
+request are kept or dropped per request (all lines of a kept request
+survive); warnings, errors and records outside requests are always kept.
+Tracebacks are formatted before enqueueing and travel as exc_text, so the
+JSON "exception" field survives the queue.
+"""
+import atexit
+import copy
+import json
+import logging
+import logging.handlers
+import queue
+import zlib
+from datetime import datetime, timezone
+from typing import Optional
+
+import tracing
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - [%(request_id)s] %(message)s'
+STANDARD_RECORD_FIELDS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "request_id"}
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line; extra= fields are included as top-level keys"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "request_id": None if getattr(record, "request_id", "-") == "-" else record.request_id,
+            "message": record.getMessage()
+        }
+        entry.update({key: value for key, value in vars(record).items() if key not in STANDARD_RECORD_FIELDS})
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exception"] = record.exc_text  # Formatted by StructuredQueueHandler before enqueueing
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+class StructuredQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that keeps the traceback apart from the message
+
+    The default prepare() formats the whole record into msg, which puts the
+    traceback inside the JSON "message" and drops exc_info. Here the message
+    is merged with its args and the traceback is formatted into exc_text;
+    the live traceback object is not enqueued.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = record.exc_text or logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+class RequestSamplingFilter(logging.Filter):
+    """Keeps INFO-and-below records for a stable sample_rate share of request ids
+
+    The id comes from the request context, which is set for every request
+    whether or not tracing is enabled.
+    """
+
+    def __init__(self, sample_rate: float):
+        super().__init__()
+        self.threshold = int(max(0.0, min(sample_rate, 1.0)) * 0xFFFFFFFF)
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > logging.INFO:
+            return True
+        request_id = tracing.current_request_id()
+        if not request_id:
+            return True
+        return zlib.crc32(request_id.encode()) <= self.threshold
+
+def configure_logging(level: str = "INFO", fmt: str = "text", path: Optional[str] = "backend.log",
+                      max_bytes: int = 10 * 1024 * 1024, backup_count: int = 5,
+                      info_sample_rate: float = 1.0, use_queue: bool = True) -> Optional[logging.handlers.QueueListener]:
+    """Configure the root logger; returns the queue listener (already started) when use_queue is set"""
+    formatter = JsonFormatter() if fmt == "json" else logging.Formatter(TEXT_FORMAT)
+    handlers = [logging.StreamHandler()]
+    if path:
+        handlers.append(logging.handlers.RotatingFileHandler(
+            path, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8"
+        ))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    filters = [tracing.RequestIdFilter()]
+    if info_sample_rate < 1.0:
+        filters.append(RequestSamplingFilter(info_sample_rate))
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.setLevel(level.upper())
+
+    listener = None
+    if use_queue:
+        entry = StructuredQueueHandler(queue.SimpleQueue())
+        listener = logging.handlers.QueueListener(entry.queue, *handlers, respect_handler_level=True)
+        listener.start()
+        atexit.register(listener.stop)  # Flush what is still queued on exit
+        handlers = [entry]
+    for handler in handlers:
+        for log_filter in filters:
+            handler.addFilter(log_filter)
+        root.addHandler(handler)
+    return listener
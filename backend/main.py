@@ -1,7 +1,8 @@
 # Deployment Trigger: Force Vercel to pick up Python 3.9 config
-from fastapi import FastAPI, File, UploadFile, HTTPException, status
+from fastapi import FastAPI, File, Form, Request, UploadFile, HTTPException, status
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from starlette.datastructures import Headers, MutableHeaders
 from pydantic import BaseModel, Field
 try:
     import tensorflow as tf
@@ -13,10 +14,15 @@ import numpy as np
 from PIL import Image
 import io
 import os
+import asyncio
+import contextlib
+from contextlib import asynccontextmanager
 import json
 import logging
-from typing import List, Optional, Dict
+from typing import Any, List, Optional, Dict, NamedTuple, Callable
 import time
+import re
+from collections import Counter
 from datetime import datetime
 import google.generativeai as genai
 from dotenv import load_dotenv
@@ -25,31 +31,75 @@ import hashlib
 import json as json_lib
 from slack_sdk import WebClient
 from slack_sdk.errors import SlackApiError
+from history_store import HistoryStore, ALL_USERS
+from outbreak_detector import OutbreakDetector, OutbreakAlert
+from job_queue import JobQueue, PRIORITIES
+from gemini_limiter import GeminiRateLimiter, is_rate_limit_error
+from gemini_batcher import GeminiBatcher, BatchParseError
+from gemini_json import StructuredOutputError, conform_to_model, extract_json, parse_model
+from batch_inference import BatchClassifier
+from image_ops import tta_views, crop_to_leaf, tile_views, measure_quality, QualityReport
+import response_codec
+from knowledge_base import KnowledgeBase, compile_knowledge_base, normalize_name, source_digest
+import tracing
+from tracing import span, traced
+from log_config import configure_logging
 
 # Load environment variables from .env file
 load_dotenv()
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('backend.log'),
-        logging.StreamHandler()
-    ]
-)
+# Configure logging (request ids correlate the lines of one request; disk and console writes happen off-thread),
+# unless the importing program already configured it, as the offline CLIs do
+if not logging.getLogger().handlers:
+    configure_logging(
+        level=os.getenv("LOG_LEVEL", "INFO"),
+        fmt=os.getenv("LOG_FORMAT", "text").lower(),
+        path=os.getenv("LOG_FILE", "backend.log") or None,
+        max_bytes=int(os.getenv("LOG_MAX_BYTES", 10 * 1024 * 1024)),
+        backup_count=int(os.getenv("LOG_BACKUP_COUNT", 5)),
+        info_sample_rate=float(os.getenv("LOG_INFO_SAMPLE_RATE", 1.0)),
+        use_queue=os.getenv("LOG_ASYNC", "true").lower() == "true"
+    )
 logger = logging.getLogger(__name__)
 
 # Global variables for model and data
 interpreter = None
+batch_classifier = None
+tile_classifier = None
 gemini_model = None
 labels = []
 solutions = {}
+knowledge_base: Optional[KnowledgeBase] = None
+solutions_version = ""  # Version of the compiled knowledge base, part of the /knowledge version
+label_records = []  # index-aligned with labels / model output
 start_time = time.time()
 
 # Redis connection
 redis_client = None
 slack_client = None
+history_store = None
+job_queue = None
+tracer = None
+
+# Streaming outbreak detection over fresh (non-cached) predictions
+outbreak_detector = OutbreakDetector(
+    window_seconds=int(os.getenv("OUTBREAK_WINDOW_SECONDS", 3600)),
+    bucket_seconds=int(os.getenv("OUTBREAK_BUCKET_SECONDS", 60)),
+    min_events=int(os.getenv("OUTBREAK_MIN_EVENTS", 10)),
+    z_threshold=float(os.getenv("OUTBREAK_Z_THRESHOLD", 4.0)),
+    cooldown_seconds=int(os.getenv("OUTBREAK_COOLDOWN_SECONDS", 3600))
+)
+# Per-prediction Slack alerts can be turned off in favour of aggregated outbreak alerts
+SLACK_PER_PREDICTION_ALERTS = os.getenv("SLACK_PER_PREDICTION_ALERTS", "true").lower() == "true"
+# /stats/* without a user_id reports counts across every user; turn off on shared deployments
+STATS_ALL_USERS_ENABLED = os.getenv("STATS_ALL_USERS_ENABLED", "true").lower() == "true"
+
+# Client-side Gemini budget shared by Layer 2 and enrichment; calls over budget are skipped
+gemini_limiter = GeminiRateLimiter(
+    rpm=int(os.getenv("GEMINI_RPM", 15)),
+    rpd=int(os.getenv("GEMINI_RPD", 1500)),
+    cooldown_seconds=float(os.getenv("GEMINI_COOLDOWN_SECONDS", 60))
+)
 
 def init_redis():
     """Initialize Redis connection"""
@@ -96,10 +146,82 @@ def init_slack():
         slack_client = None
         return False
 
+def init_history_store():
+    """Initialize persistent scan history (SQLite)"""
+    global history_store
+    try:
+        db_path = os.getenv("HISTORY_DB_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "history.db"))
+        history_store = HistoryStore(db_path)
+        logger.info("[OK] Scan history store ready: %s", db_path)
+        return True
+    except Exception as e:
+        logger.warning("[WARNING] Scan history store unavailable: %s", e)
+        history_store = None
+        return False
+
+@traced("history")
+def record_scan(result: dict, user_id: str, image_hash: str):
+    """Persist a prediction to the scan history"""
+    if not history_store:
+        return
+    
+    try:
+        history_store.record_scan(
+            user_id=user_id,
+            disease=result["disease"],
+            confidence=result["confidence"],
+            layer=result["layer"],
+            healthy=is_healthy(result["disease"]),
+            image_hash=image_hash
+        )
+    except Exception as e:
+        logger.exception("History write error: %s", e)
+
+# Request tracing: spans per stage, errors and slow requests always kept, the rest sampled
+TRACING_ENABLED = os.getenv("TRACING_ENABLED", "true").lower() == "true"
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", 0.05))
+TRACE_SLOW_MS = float(os.getenv("TRACE_SLOW_MS", 2000))
+TRACE_EXPORT_PATH = os.getenv("TRACE_EXPORT_PATH", "traces.jsonl")
+TRACE_FORMAT = os.getenv("TRACE_FORMAT", "json").lower()  # json or otlp
+TRACE_OTLP_ENDPOINT = os.getenv("TRACE_OTLP_ENDPOINT")  # e.g. http://localhost:4318/v1/traces
+
+def init_tracing():
+    """Initialize request tracing"""
+    global tracer
+    if not TRACING_ENABLED:
+        logger.info("Request tracing disabled")
+        return False
+    try:
+        exporter = tracing.TraceExporter(TRACE_EXPORT_PATH or None, TRACE_FORMAT, TRACE_OTLP_ENDPOINT)
+        tracer = tracing.Tracer(exporter, TRACE_SAMPLE_RATE, TRACE_SLOW_MS)
+        logger.info("[OK] Request tracing enabled (sample rate %s, slow >= %.0fms)", TRACE_SAMPLE_RATE, TRACE_SLOW_MS)
+        return True
+    except Exception as e:
+        logger.warning("[WARNING] Request tracing unavailable: %s", e)
+        tracer = None
+        return False
+
+async def init_job_queue():
+    """Initialize the background job queue and start its workers"""
+    global job_queue
+    try:
+        db_path = os.getenv("JOB_DB_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "jobs.db"))
+        job_queue = JobQueue(db_path, workers=int(os.getenv("JOB_WORKERS", 2)))
+        job_queue.register("predict", handle_predict_job)
+        job_queue.register("enrich", handle_enrich_job)
+        await job_queue.start()
+        logger.info("[OK] Job queue started with %d worker(s): %s", job_queue.workers, db_path)
+        return True
+    except Exception as e:
+        logger.warning("[WARNING] Job queue unavailable: %s", e)
+        job_queue = None
+        return False
+
 def get_image_hash(image_bytes: bytes) -> str:
     """Generate a hash for image caching"""
     return hashlib.md5(image_bytes).hexdigest()
 
+@traced("cache")
 def get_cached_prediction(image_hash: str) -> Optional[dict]:
     """Get cached prediction result"""
     if not redis_client:
@@ -108,13 +230,14 @@ def get_cached_prediction(image_hash: str) -> Optional[dict]:
     try:
         cached_result = redis_client.get(f"prediction:{image_hash}")
         if cached_result:
-            logger.info(f"🚀 Cache HIT for image hash: {image_hash[:8]}...")
+            logger.info("Cache hit for image %s", image_hash[:8], extra={"image_hash": image_hash})
             return json_lib.loads(cached_result)
     except Exception as e:
-        logger.error(f"Cache read error: {e}")
+        logger.error("Cache read error: %s", e)
     
     return None
 
+@traced("redis_write")
 def cache_prediction(image_hash: str, prediction_result: dict, ttl: int = 3600):
     """Cache prediction result (TTL in seconds, default 1 hour)"""
     if not redis_client:
@@ -126,13 +249,135 @@ def cache_prediction(image_hash: str, prediction_result: dict, ttl: int = 3600):
             ttl,
             json_lib.dumps(prediction_result)
         )
-        logger.info(f"💾 Cached prediction for hash: {image_hash[:8]}...")
+        logger.info("Cached prediction for image %s", image_hash[:8], extra={"image_hash": image_hash})
     except Exception as e:
-        logger.error(f"Cache write error: {e}")
+        logger.error("Cache write error: %s", e)
+
+ENRICHMENT_CACHE_TTL = 7 * 24 * 3600  # Enrichment changes rarely; keep for a week
+KNOWLEDGE_VERSION_KEY = "knowledge:version"
+ENRICHMENT_VERSIONS_KEY = "knowledge:enrichment_versions"  # Sorted set: enrichment key -> version written
+
+def enrichment_cache_key(disease_name: str) -> str:
+    """Redis key for a disease's enrichment, independent of label formatting
+    
+    Names that resolve to a model class ("Late blight of tomato") share the
+    class's entry, so Layer 2 spellings reuse enrichment already cached.
+    """
+    return f"enrichment:{normalize_name(known_label(disease_name) or disease_name)}"
 
+def known_label(disease_name: str) -> Optional[str]:
+    """Model class label a disease name clearly refers to, via the knowledge base index"""
+    record_id = knowledge_base.find(disease_name) if knowledge_base else None
+    return knowledge_base.record(record_id)["label"] if record_id is not None else None
+
+def is_healthy(disease_name: str) -> bool:
+    """Healthy or non-disease class (e.g. background) per the knowledge base; unknown names count as diseased"""
+    record_id = knowledge_base.find(disease_name) if knowledge_base else None
+    return bool(knowledge_base.record(record_id)["healthy"]) if record_id is not None else False
+
+def get_enrichment_versions(disease_names: List[str]) -> List[Optional[int]]:
+    """Knowledge versions of several cached enrichments in one round trip"""
+    if not redis_client or not disease_names:
+        return [None] * len(disease_names)
+    
+    try:
+        pipe = redis_client.pipeline()
+        for name in disease_names:
+            pipe.zscore(ENRICHMENT_VERSIONS_KEY, enrichment_cache_key(name))
+        return [int(version) if version is not None else None for version in pipe.execute()]
+    except Exception as e:
+        logger.error("Enrichment version read error: %s", e)
+        return [None] * len(disease_names)
+
+def get_cached_enrichment(disease_name: str) -> Optional[dict]:
+    """Get cached enrichment details for a disease, falling back to details bundled in the knowledge base"""
+    if not redis_client:
+        return get_bundled_enrichment(disease_name)
+    
+    try:
+        cached_details = redis_client.get(enrichment_cache_key(disease_name))
+        if cached_details:
+            return json_lib.loads(cached_details)
+    except Exception as e:
+        logger.error("Enrichment cache read error: %s", e)
+    
+    return get_bundled_enrichment(disease_name)
+
+def get_bundled_enrichment(disease_name: str) -> Optional[dict]:
+    """Details compiled into the knowledge base, conformed to the DiseaseDetail shape"""
+    details = knowledge_base.details(disease_name) if knowledge_base else None
+    if not details:
+        return None
+    return DiseaseDetail(**conform_to_model(details, DiseaseDetail)).dict()
+
+@traced("redis_write")
+def cache_enrichment(disease_name: str, details: dict, ttl: int = ENRICHMENT_CACHE_TTL):
+    """Cache enrichment details for a disease (TTL in seconds, default 1 week)
+    
+    Each write bumps the knowledge version and records it against the entry,
+    so clients can sync only the enrichments added since their last snapshot.
+    """
+    if not redis_client:
+        return
+    
+    try:
+        key = enrichment_cache_key(disease_name)
+        version = redis_client.incr(KNOWLEDGE_VERSION_KEY)
+        pipe = redis_client.pipeline()
+        pipe.setex(key, ttl, json_lib.dumps(details))
+        pipe.zadd(ENRICHMENT_VERSIONS_KEY, {key: version})
+        pipe.execute()
+        logger.info("Cached enrichment for %s (knowledge version %d)", disease_name,
+                    version, extra={"disease": disease_name, "knowledge_version": version})
+    except Exception as e:
+        logger.error("Enrichment cache write error: %s", e)
+
+def get_enrichment_version(disease_name: str) -> Optional[int]:
+    """Knowledge version at which a disease's cached enrichment was written"""
+    if not redis_client:
+        return None
+    
+    try:
+        version = redis_client.zscore(ENRICHMENT_VERSIONS_KEY, enrichment_cache_key(disease_name))
+        return int(version) if version is not None else None
+    except Exception as e:
+        logger.error("Enrichment version read error: %s", e)
+        return None
+
+def get_knowledge_version() -> int:
+    """Counter bumped by every enrichment cache write (0 without Redis)"""
+    if not redis_client:
+        return 0
+    
+    try:
+        return int(redis_client.get(KNOWLEDGE_VERSION_KEY) or 0)
+    except Exception as e:
+        logger.error("Knowledge version read error: %s", e)
+        return 0
+
+def get_enrichments_since(version: int) -> Dict[str, dict]:
+    """Cached enrichments written after version, keyed by normalized disease name"""
+    if not redis_client:
+        return {}
+    
+    try:
+        keys = redis_client.zrangebyscore(ENRICHMENT_VERSIONS_KEY, f"({version}", "+inf")
+        values = redis_client.mget(keys) if keys else []
+        expired = [key for key, value in zip(keys, values) if value is None]
+        if expired:
+            redis_client.zrem(ENRICHMENT_VERSIONS_KEY, *expired)
+        return {
+            key.split(":", 1)[1]: json_lib.loads(value)
+            for key, value in zip(keys, values) if value is not None
+        }
+    except Exception as e:
+        logger.error("Enrichment snapshot read error: %s", e)
+        return {}
+
+@traced("slack")
 def send_slack_alert(disease: str, confidence: float, layer: str, image_hash: str = None):
     """Send Slack notification for disease detection"""
-    if not slack_client:
+    if not slack_client or not SLACK_PER_PREDICTION_ALERTS:
         return
     
     try:
@@ -168,12 +413,59 @@ _Automated alert from FloraGuard AI_
             icon_emoji=":herb:"
         )
         
-        logger.info(f"📤 Slack alert sent for: {disease}")
+        logger.info("Slack alert sent for: %s", disease, extra={"disease": disease, "layer": layer})
         
     except SlackApiError as e:
-        logger.error(f"Slack API error: {e.response['error']}")
+        logger.error("Slack API error: %s", e.response['error'])
     except Exception as e:
-        logger.error(f"Slack notification error: {e}")
+        logger.exception("Slack notification error: %s", e)
+
+def send_slack_outbreak_alert(alert: OutbreakAlert):
+    """Send a single aggregated Slack notification for a detected outbreak"""
+    if not slack_client:
+        return
+    
+    try:
+        channel = os.getenv("SLACK_CHANNEL", "#plant-alerts")
+        
+        message = f"""
+🚨 *Possible Outbreak Detected*
+
+🦠 *Disease:* {alert.disease}
+📍 *Region:* {alert.region}
+📈 *Detections:* {alert.window_count} in the last {alert.window_seconds // 60} min (expected ~{alert.expected_count:.1f})
+👥 *Reporting Users:* {alert.users}
+⏰ *Time:* {datetime.fromtimestamp(alert.detected_at).strftime('%Y-%m-%d %H:%M:%S')}
+
+_Automated outbreak alert from FloraGuard AI_
+        """
+        
+        slack_client.chat_postMessage(
+            channel=channel,
+            text=message,
+            username="FloraGuard AI",
+            icon_emoji=":rotating_light:"
+        )
+        
+        logger.info("Slack outbreak alert sent for: %s (%s)", alert.disease, alert.region,
+                    extra={"disease": alert.disease, "region": alert.region})
+        
+    except SlackApiError as e:
+        logger.error("Slack API error: %s", e.response['error'])
+    except Exception as e:
+        logger.exception("Slack outbreak notification error: %s", e)
+
+def observe_prediction(result: dict, region: Optional[str], user_id: str):
+    """Feed a fresh diseased prediction into outbreak detection and alert on spikes"""
+    disease = result["disease"]
+    if is_healthy(disease):
+        return
+    
+    alert = outbreak_detector.observe(disease, region=region, user_id=user_id)
+    if alert:
+        logger.warning("Outbreak detected: %s in %s (%d detections)", alert.disease, alert.region, alert.window_count,
+                       extra={"disease": alert.disease, "region": alert.region, "window_count": alert.window_count})
+        send_slack_outbreak_alert(alert)
 
 def send_slack_reminder(medication: str, dosage: str, frequency: str, disease: str):
     """Send Slack reminder for medication"""
@@ -202,12 +494,12 @@ _Don't forget your plant treatment! 🌱_
             icon_emoji=":alarm_clock:"
         )
         
-        logger.info(f"📤 Slack reminder sent for: {medication}")
+        logger.info("Slack reminder sent for: %s", medication)
         
     except SlackApiError as e:
-        logger.error(f"Slack API error: {e.response['error']}")
+        logger.error("Slack API error: %s", e.response['error'])
     except Exception as e:
-        logger.error(f"Slack reminder error: {e}")
+        logger.exception("Slack reminder error: %s", e)
 
 class TreatmentStage(BaseModel):
     name: str
@@ -239,6 +531,30 @@ class DiseaseDetail(BaseModel):
     recovery: RecoveryInfo
 
 # Pydantic models for request/response validation
+class TileResult(BaseModel):
+    row: int
+    col: int
+    box: List[int] = Field(..., description="Tile bounds in the uploaded image: left, top, right, bottom")
+    disease: str
+    confidence: float
+    disease_score: float = Field(..., description="Probability mass on disease classes")
+    leaf: bool = Field(..., description="Whether the tile contains enough vegetation to count")
+
+class TilePredictionResponse(BaseModel):
+    disease: str = Field(..., description="Aggregated diagnosis across leaf tiles")
+    confidence: float
+    solution: str
+    healthy: bool
+    affected_tiles: int
+    leaf_tiles: int
+    affected_fraction: float
+    rows: int
+    cols: int
+    heatmap: List[List[Optional[float]]] = Field(..., description="Disease score per tile (null for non-leaf tiles)")
+    disease_counts: Dict[str, int]
+    tiles: List[TileResult]
+    processing_time_ms: float
+
 class PredictionResponse(BaseModel):
     disease: str = Field(..., description="Detected disease name")
     confidence: float = Field(..., ge=0.0, le=1.0, description="Confidence score")
@@ -249,6 +565,20 @@ class PredictionResponse(BaseModel):
     processing_time_ms: float = Field(..., description="Processing time in milliseconds")
     cached: bool = Field(default=False, description="Whether result was served from cache")
 
+class SearchMatchResponse(BaseModel):
+    id: int
+    label: Optional[str] = Field(None, description="Model class label; None for records the model cannot predict")
+    name: str
+    score: float
+    matched: str = Field(..., description="Name, alias or solution text the score came from")
+    solution: Optional[str] = None
+    has_details: bool = Field(..., description="Enrichment is bundled or cached, so /enrich answers locally")
+
+class SearchResponse(BaseModel):
+    query: str
+    matches: List[SearchMatchResponse]
+    took_ms: float
+
 class HealthResponse(BaseModel):
     status: str
     model_loaded: bool
@@ -280,8 +610,48 @@ app.add_middleware(
 
 # Configuration
 MAX_FILE_SIZE = 50 * 1024 * 1024  # 50MB
-ALLOWED_EXTENSIONS = {".jpg", ".jpeg", ".png", ".bmp", ".tiff"}
+ALLOWED_EXTENSIONS = {".jpg", ".jpeg", ".png", ".bmp", ".tiff", ".webp"}
+CONTENT_HASH_PATTERN = re.compile(r"^[0-9a-f]{32}$")  # MD5 hex digest sent by downscaling clients
 INPUT_SIZE = 224  # Updated to match model expectation
+LAYER2_CONFIDENCE_THRESHOLD = 0.7  # Below this, Gemini is asked for a second opinion
+
+# Test-time augmentation for borderline Layer 1 results, run as one batched invoke
+TTA_ENABLED = os.getenv("TTA_ENABLED", "true").lower() == "true"
+TTA_MIN_CONFIDENCE = float(os.getenv("TTA_MIN_CONFIDENCE", 0.5))
+BATCH_INFERENCE_SIZE = int(os.getenv("BATCH_INFERENCE_SIZE", 8))
+# Crop to the detected leaf before resizing (compare with benchmark_leaf_crop.py before enabling)
+LEAF_CROP_ENABLED = os.getenv("LEAF_CROP_ENABLED", "false").lower() == "true"
+# Whole-plant tiling: the tile interpreter is sized so a full grid runs in one invoke
+TILE_OVERLAP = float(os.getenv("TILE_OVERLAP", 0.25))
+TILE_MAX_TILES = int(os.getenv("TILE_MAX_TILES", 16))
+TILE_MIN_LEAF_FRACTION = float(os.getenv("TILE_MIN_LEAF_FRACTION", 0.15))  # Tiles with less vegetation are ignored
+
+# Pre-filter for junk uploads, measured on a thumbnail before any inference
+PREFILTER_ENABLED = os.getenv("PREFILTER_ENABLED", "true").lower() == "true"
+PREFILTER_MIN_SHARPNESS = float(os.getenv("PREFILTER_MIN_SHARPNESS", 20))  # Laplacian variance
+PREFILTER_MIN_BRIGHTNESS = float(os.getenv("PREFILTER_MIN_BRIGHTNESS", 25))
+PREFILTER_MAX_BRIGHTNESS = float(os.getenv("PREFILTER_MAX_BRIGHTNESS", 235))
+PREFILTER_MAX_CLIPPED = float(os.getenv("PREFILTER_MAX_CLIPPED", 0.5))  # Share of pure black/white pixels
+PREFILTER_MIN_PLANT_FRACTION = float(os.getenv("PREFILTER_MIN_PLANT_FRACTION", 0.03))
+prefilter_counts = Counter()
+
+# Response negotiation: binary encodings, compression and ETags for mobile clients
+BINARY_RESPONSES_ENABLED = os.getenv("BINARY_RESPONSES_ENABLED", "true").lower() == "true"
+RESPONSE_COMPRESSION_MIN_BYTES = int(os.getenv("RESPONSE_COMPRESSION_MIN_BYTES", 1024))
+ETAG_PATH_PREFIXES = ("/enrich/", "/knowledge")  # GET endpoints whose responses may be revalidated with If-None-Match
+KNOWLEDGE_MAX_AGE = int(os.getenv("KNOWLEDGE_MAX_AGE", 3600))
+KNOWLEDGE_CACHE_CONTROL = f"public, max-age={KNOWLEDGE_MAX_AGE}, stale-while-revalidate={24 * 3600}"
+
+# Upload streaming and memory limits
+UPLOAD_CHUNK_SIZE = 1024 * 1024  # 1MB
+MULTIPART_OVERHEAD = 64 * 1024  # Allowance for multipart boundaries and headers
+MAX_IMAGE_PIXELS = int(os.getenv("MAX_IMAGE_PIXELS", 40_000_000))  # ~40 megapixels
+DECODE_MAX_SIDE = int(os.getenv("DECODE_MAX_SIDE", 1024))  # Longest side kept after decoding
+UPLOAD_MEMORY_BUDGET = int(os.getenv("UPLOAD_MEMORY_BUDGET_MB", 256)) * 1024 * 1024
+UPLOAD_BUDGET_WAIT_SECONDS = 10.0
+
+# Let PIL raise DecompressionBombError instead of decoding oversized images
+Image.MAX_IMAGE_PIXELS = MAX_IMAGE_PIXELS
 
 # Paths
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -295,6 +665,7 @@ if os.path.exists(LOCAL_ASSETS_DIR) and os.path.exists(os.path.join(LOCAL_ASSETS
     MODEL_PATH = os.path.join(LOCAL_ASSETS_DIR, "model.tflite")
     LABELS_PATH = os.path.join(LOCAL_ASSETS_DIR, "labels.txt")
     DATA_PATH = os.path.join(LOCAL_ASSETS_DIR, "data.json")
+    KNOWLEDGE_BASE_PATH = os.path.join(LOCAL_ASSETS_DIR, "knowledge_base.json.gz")
 else:
     # Fallback to project structure (Local Development)
     logger.info("Using project structure paths")
@@ -302,22 +673,123 @@ else:
     MODEL_PATH = os.path.join(ASSETS_DIR, "model.tflite")
     LABELS_PATH = os.path.join(ASSETS_DIR, "labels.txt")
     DATA_PATH = os.path.join(PROJECT_ROOT, "web_app", "data.json")
+    KNOWLEDGE_BASE_PATH = os.path.join(PROJECT_ROOT, "web_app", "knowledge_base.json.gz")
 
-# Global variables for model and data
-interpreter = None
-labels = []
-solutions = {}
-start_time = time.time()
+class PrefilterRejection(NamedTuple):
+    reason: str
+    message: str
+    quality: QualityReport
+
+class LabelRecord(NamedTuple):
+    """Precomputed postprocessing data for one model output class"""
+    label: str
+    display_name: str
+    solution_key: str
+    solution: str
+    healthy: bool
+    severity: str
+
+def load_knowledge_base(model_labels: List[str]) -> KnowledgeBase:
+    """Compiled knowledge base for the model labels, compiled from data.json when missing or stale
+
+    The compiled file is stale when the digest of the labels and solution
+    table it was built from differs from the current ones. It is then
+    recompiled here, keeping its bundled enrichment details.
+    """
+    knowledge = KnowledgeBase.load(KNOWLEDGE_BASE_PATH) if os.path.exists(KNOWLEDGE_BASE_PATH) else None
+    if not os.path.exists(DATA_PATH):
+        if knowledge and knowledge.labels == model_labels:
+            logger.warning("Data file %s not found; using knowledge base %s unchecked", DATA_PATH, knowledge.version)
+            return knowledge
+        raise FileNotFoundError(f"Data file not found: {DATA_PATH}")
+    with open(DATA_PATH, "r", encoding="utf-8") as f:
+        solutions = json.load(f)
+
+    enrichments = {}
+    if knowledge:
+        if knowledge.sources == source_digest(model_labels, solutions):
+            logger.info("Loaded knowledge base %s (%d records)", knowledge.version, len(knowledge.records))
+            return knowledge
+        logger.warning("Knowledge base %s is stale (labels or %s changed); recompiling. "
+                       "Run knowledge_base.py to update %s", knowledge.version, DATA_PATH, KNOWLEDGE_BASE_PATH)
+        enrichments = knowledge.enrichments()
+    knowledge = KnowledgeBase(compile_knowledge_base(model_labels, solutions, enrichments))
+    logger.info("Compiled knowledge base %s from %s", knowledge.version, DATA_PATH)
+    return knowledge
+
+def build_label_index(knowledge: KnowledgeBase, num_labels: int) -> List[LabelRecord]:
+    """Index-aligned postprocessing records for the model output classes"""
+    return [
+        LabelRecord(
+            label=record["label"],
+            display_name=record["name"],
+            solution_key=record["solution_key"],
+            solution=record["solution"],
+            healthy=record["healthy"],
+            severity=record["severity"]
+        )
+        for record in knowledge.records[:num_labels]
+    ]
+
+def create_interpreter(num_threads: Optional[int] = None):
+    model = Interpreter(model_path=MODEL_PATH, num_threads=num_threads)
+    model.allocate_tensors()
+    return model
+
+def init_batch_classifier():
+    """Initialize a second interpreter with a batched input for augmented views"""
+    global batch_classifier
+    try:
+        batch_classifier = BatchClassifier(create_interpreter(), BATCH_INFERENCE_SIZE, INPUT_SIZE)
+        logger.info("[OK] Batched inference ready (batch size %d)", batch_classifier.batch_size)
+    except Exception as e:
+        logger.warning("[WARNING] Batched inference unavailable: %s. Test-time augmentation disabled.", e)
+        batch_classifier = None
+
+def load_classifier(num_threads: Optional[int] = None):
+    """Load the TFLite model, labels and knowledge base (shared by the API and offline tools)"""
+    # Validate file paths
+    if not os.path.exists(MODEL_PATH):
+        raise FileNotFoundError(f"Model file not found: {MODEL_PATH}")
+    if not os.path.exists(LABELS_PATH):
+        raise FileNotFoundError(f"Labels file not found: {LABELS_PATH}")
+    
+    # Load TFLite Model
+    model = create_interpreter(num_threads)
+    logger.info("TensorFlow Lite model loaded successfully")
+    
+    # Load Labels
+    with open(LABELS_PATH, "r", encoding="utf-8") as f:
+        model_labels = [line.strip() for line in f.readlines() if line.strip()]
+    logger.info("Loaded %d labels", len(model_labels))
+    
+    num_classes = int(model.get_output_details()[0]['shape'][-1])
+    if num_classes != len(model_labels):
+        raise ValueError(f"Model has {num_classes} outputs but {len(model_labels)} labels were loaded")
+        
+    # Load the knowledge base; its first records are index-aligned with the labels
+    knowledge = load_knowledge_base(model_labels)
+    records = build_label_index(knowledge, len(model_labels))
+    logger.info("Built label index for %d classes", len(records))
+    return model, model_labels, knowledge, records
+
+@app.on_event("shutdown")
+async def release_resources():
+    if job_queue:
+        await job_queue.stop()
 
 @app.on_event("startup")
 async def load_resources():
-    global interpreter, labels, solutions, gemini_model
+    global interpreter, labels, solutions, solutions_version, knowledge_base, label_records, gemini_model
     try:
         logger.info("Loading backend resources...")
         
-        # Initialize Redis and Slack
+        # Initialize tracing, Redis, Slack and scan history
+        init_tracing()
         init_redis()
         init_slack()
+        init_history_store()
+        await init_job_queue()
         
         # Configure Gemini
         GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
@@ -357,34 +829,34 @@ async def load_resources():
             logger.warning("GEMINI_API_KEY not found. Layer 2 fallback disabled.")
             gemini_model = None
         
-        # Validate file paths
-        if not os.path.exists(MODEL_PATH):
-            raise FileNotFoundError(f"Model file not found: {MODEL_PATH}")
-        if not os.path.exists(LABELS_PATH):
-            raise FileNotFoundError(f"Labels file not found: {LABELS_PATH}")
-        if not os.path.exists(DATA_PATH):
-            raise FileNotFoundError(f"Data file not found: {DATA_PATH}")
-        
-        # Load TFLite Model
-        interpreter = Interpreter(model_path=MODEL_PATH)
-        interpreter.allocate_tensors()
-        logger.info("TensorFlow Lite model loaded successfully")
-        
-        # Load Labels
-        with open(LABELS_PATH, "r", encoding="utf-8") as f:
-            labels = [line.strip() for line in f.readlines()]
-        logger.info(f"Loaded {len(labels)} labels")
-            
-        # Load Solutions
-        with open(DATA_PATH, "r", encoding="utf-8") as f:
-            solutions = json.load(f)
-        logger.info(f"Loaded {len(solutions)} disease solutions")
+        interpreter, labels, knowledge_base, label_records = load_classifier()
+        solutions = knowledge_base.solutions
+        solutions_version = knowledge_base.version
+        if TTA_ENABLED:
+            init_batch_classifier()
             
         logger.info("Backend resources loaded successfully")
     except Exception as e:
-        logger.error(f"Error loading resources: {e}")
+        logger.exception("Error loading resources: %s", e)
         raise RuntimeError(f"Failed to initialize backend: {e}")
 
+def validate_user_id(user_id: str) -> None:
+    """Reject the id reserved for the all-users aggregate rows"""
+    if user_id == ALL_USERS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"user_id '{ALL_USERS}' is reserved"
+        )
+
+def stats_scope(user_id: str) -> str:
+    """The user_id a /stats request may read; the all-users scope can be disabled"""
+    if user_id == ALL_USERS and not STATS_ALL_USERS_ENABLED:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="All-users statistics are disabled; pass a user_id"
+        )
+    return user_id
+
 def validate_image_file(file: UploadFile) -> None:
     """Validate uploaded image file"""
     if not file.filename:
@@ -408,6 +880,120 @@ def validate_image_file(file: UploadFile) -> None:
             detail=f"File too large. Maximum size: {MAX_FILE_SIZE // (1024*1024)}MB"
         )
 
+class UploadMemoryBudget:
+    """Global byte budget shared by all concurrent image decodes"""
+    
+    def __init__(self, limit_bytes: int):
+        self.limit_bytes = limit_bytes
+        self.in_use = 0
+        self._condition = asyncio.Condition()
+    
+    @asynccontextmanager
+    async def reserve(self, nbytes: int, timeout: float = UPLOAD_BUDGET_WAIT_SECONDS):
+        """Wait until nbytes fit in the budget, hold them for the block, then release"""
+        if nbytes > self.limit_bytes:
+            raise HTTPException(
+                status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                detail="Image too large to decode"
+            )
+        async with self._condition:
+            try:
+                await asyncio.wait_for(
+                    self._condition.wait_for(lambda: self.in_use + nbytes <= self.limit_bytes),
+                    timeout
+                )
+            except asyncio.TimeoutError:
+                raise HTTPException(
+                    status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                    detail="Server is busy processing other uploads. Please retry shortly."
+                )
+            self.in_use += nbytes
+        try:
+            yield
+        finally:
+            async with self._condition:
+                self.in_use -= nbytes
+                self._condition.notify_all()
+
+upload_budget = UploadMemoryBudget(UPLOAD_MEMORY_BUDGET)
+
+@traced("read")
+async def read_upload(file: UploadFile) -> str:
+    """Hash the spooled upload in chunks and check its exact size
+    
+    Oversized bodies are already cut off while being received by
+    RequestSizeLimit; this check applies the limit to the file part alone.
+    """
+    hasher = hashlib.md5()
+    total_bytes = 0
+    hash_seconds = 0.0
+    await file.seek(0)
+    while True:
+        chunk = await file.read(UPLOAD_CHUNK_SIZE)
+        if not chunk:
+            break
+        total_bytes += len(chunk)
+        if total_bytes > MAX_FILE_SIZE:
+            raise HTTPException(
+                status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                detail=f"File too large. Maximum size: {MAX_FILE_SIZE // (1024*1024)}MB"
+            )
+        hash_started = time.perf_counter()
+        hasher.update(chunk)
+        hash_seconds += time.perf_counter() - hash_started
+    await file.seek(0)
+    tracing.set_attributes(bytes=total_bytes, hash_ms=round(hash_seconds * 1000, 3))
+    return hasher.hexdigest()
+
+def open_image_header(file_obj) -> Image.Image:
+    """Open an image lazily (header only) and reject decompression bombs before decoding"""
+    try:
+        image = Image.open(file_obj)
+    except Image.DecompressionBombError:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"Image dimensions too large. Maximum: {MAX_IMAGE_PIXELS // 1_000_000} megapixels"
+        )
+    except Exception as e:
+        logger.warning("Failed to open image: %s", e)
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid image file"
+        )
+    
+    width, height = image.size
+    if width * height > MAX_IMAGE_PIXELS:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"Image dimensions too large. Maximum: {MAX_IMAGE_PIXELS // 1_000_000} megapixels"
+        )
+    
+    # JPEG can decode directly at a reduced scale; other formats ignore this
+    image.draft("RGB", (DECODE_MAX_SIDE, DECODE_MAX_SIDE))
+    return image
+
+@traced("decode")
+async def decode_image(image: Image.Image) -> Image.Image:
+    """Fully decode a lazily opened image within the upload memory budget"""
+    width, height = image.size
+    decoded_bytes = width * height * max(len(image.getbands()), 3)
+    if image.mode != 'RGB':
+        decoded_bytes += width * height * 3  # convert() allocates a second full-size buffer while the source is alive
+    async with upload_budget.reserve(decoded_bytes):
+        try:
+            image.load()
+            if image.mode != 'RGB':
+                image = image.convert('RGB')
+            image.thumbnail((DECODE_MAX_SIDE, DECODE_MAX_SIDE), Image.Resampling.BILINEAR)
+        except Exception as e:
+            logger.warning("Failed to decode image: %s", e)
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Invalid image file"
+            )
+    return image
+
+@traced("preprocess")
 def preprocess_image(image: Image.Image) -> np.ndarray:
     """Preprocess image for model inference - optimized for speed"""
     try:
@@ -427,12 +1013,103 @@ def preprocess_image(image: Image.Image) -> np.ndarray:
         
         return image_array
     except Exception as e:
-        logger.error(f"Error preprocessing image: {e}")
+        logger.exception("Error preprocessing image: %s", e)
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Failed to process image"
         )
 
+@traced("prefilter")
+def prefilter_image(image: Image.Image) -> Optional[PrefilterRejection]:
+    """Reject images that are too dark, overexposed, blurry or show no plant, before inference"""
+    quality = measure_quality(image)
+    if quality.brightness < PREFILTER_MIN_BRIGHTNESS or (quality.clipped_fraction > PREFILTER_MAX_CLIPPED and quality.brightness < 128):
+        return PrefilterRejection("too_dark", "Image is too dark. Retake the photo in daylight or with more light on the leaf.", quality)
+    if quality.brightness > PREFILTER_MAX_BRIGHTNESS or quality.clipped_fraction > PREFILTER_MAX_CLIPPED:
+        return PrefilterRejection("overexposed", "Image is overexposed. Avoid direct sunlight glare and retake the photo.", quality)
+    if quality.sharpness < PREFILTER_MIN_SHARPNESS:
+        return PrefilterRejection("blurry", "Image is too blurry. Hold the camera steady and tap to focus on the leaf.", quality)
+    if quality.plant_fraction < PREFILTER_MIN_PLANT_FRACTION:
+        return PrefilterRejection("no_plant", "No plant detected. Please try again with a clear image of a plant leaf.", quality)
+    return None
+
+def get_tile_classifier() -> BatchClassifier:
+    """Batched interpreter sized for a full tile grid, created on first use"""
+    global tile_classifier
+    if tile_classifier is None:
+        tile_classifier = BatchClassifier(create_interpreter(), TILE_MAX_TILES, INPUT_SIZE)
+    return tile_classifier
+
+@traced("tiles")
+def classify_tiles(image: Image.Image) -> dict:
+    """Classify overlapping tiles in one batch and aggregate them into a plant-level diagnosis"""
+    grid, leaf_fraction, layout = tile_views(image, INPUT_SIZE, TILE_OVERLAP, TILE_MAX_TILES)
+    width, height, rows, cols, row_stride, col_stride = layout
+    probabilities = get_tile_classifier().predict_grid(grid)
+    
+    healthy_classes = np.array([record.healthy for record in label_records])
+    disease_score = probabilities[..., ~healthy_classes].sum(axis=-1)
+    top = probabilities.argmax(axis=-1)
+    confidence = probabilities.max(axis=-1)
+    leaf = leaf_fraction >= TILE_MIN_LEAF_FRACTION
+    if not leaf.any():
+        leaf[...] = True  # No vegetation detected; judge every tile rather than none
+    affected = leaf & ~healthy_classes[top]
+    
+    if affected.any():
+        # Confidence-weighted vote among diseased tiles
+        votes = np.bincount(top[affected], weights=confidence[affected], minlength=len(label_records))
+        winner = int(np.argmax(votes))
+        winner_confidence = float(confidence[affected & (top == winner)].mean())
+    else:
+        mean_probabilities = probabilities[leaf].mean(axis=0)
+        winner = int(np.argmax(mean_probabilities))
+        winner_confidence = float(mean_probabilities[winner])
+    record = label_records[winner]
+    
+    scale_x = image.size[0] / width
+    scale_y = image.size[1] / height
+    tiles = []
+    counts: Dict[str, int] = {}
+    for row in range(rows):
+        for col in range(cols):
+            label = label_records[int(top[row, col])].label
+            if leaf[row, col]:
+                counts[label] = counts.get(label, 0) + 1
+            tiles.append(TileResult(
+                row=row,
+                col=col,
+                box=[round(col * col_stride * scale_x), round(row * row_stride * scale_y),
+                     round((col * col_stride + INPUT_SIZE) * scale_x), round((row * row_stride + INPUT_SIZE) * scale_y)],
+                disease=label,
+                confidence=float(confidence[row, col]),
+                disease_score=float(disease_score[row, col]),
+                leaf=bool(leaf[row, col])
+            ))
+    
+    heatmap = np.where(leaf, np.round(disease_score, 4), np.nan)
+    return {
+        "disease": record.label,
+        "confidence": winner_confidence,
+        "solution": record.solution,
+        "healthy": record.healthy,
+        "affected_tiles": int(affected.sum()),
+        "leaf_tiles": int(leaf.sum()),
+        "affected_fraction": float(affected.sum() / leaf.sum()),
+        "rows": rows,
+        "cols": cols,
+        "heatmap": [[None if np.isnan(value) else float(value) for value in row] for row in heatmap],
+        "disease_counts": dict(sorted(counts.items(), key=lambda item: item[1], reverse=True)),
+        "tiles": tiles
+    }
+
+@traced("tta")
+def predict_with_tta(image: Image.Image, base: np.ndarray, predictions: np.ndarray) -> np.ndarray:
+    """Average class probabilities over the base view and its augmented views"""
+    views = tta_views(image, base)
+    view_predictions = batch_classifier.predict(views)
+    return (predictions + view_predictions.sum(axis=0)) / (len(views) + 1)
+
 def check_gemini_availability() -> bool:
     """Check if Gemini is available without consuming quota"""
     try:
@@ -446,7 +1123,144 @@ def check_gemini_availability() -> bool:
     except Exception:
         return False
 
-async def get_gemini_prediction(image_bytes: bytes) -> Optional[dict]:
+# Ask for JSON output directly; older models that reject the option can turn it off
+GEMINI_JSON_MODE = os.getenv("GEMINI_JSON_MODE", "true").lower() == "true"
+GEMINI_GENERATION_CONFIG = {"response_mime_type": "application/json"} if GEMINI_JSON_MODE else None
+# Follow-up calls allowed to fix an unusable reply (each also draws from the quota budget)
+GEMINI_MAX_CORRECTIONS = int(os.getenv("GEMINI_MAX_CORRECTIONS", 1))
+
+CORRECTION_PROMPT = """
+Your previous reply could not be used: {problems}.
+The required format was:
+{schema_hint}
+Your previous reply was:
+{previous}
+Return ONLY the corrected JSON with every required field filled in.
+"""
+
+async def generate_structured(contents, parse: Callable[[str], Any], schema_hint: str):
+    """Call Gemini and parse the reply, asking for a corrected reply while the correction budget allows"""
+    response = await asyncio.to_thread(gemini_model.generate_content, contents, generation_config=GEMINI_GENERATION_CONFIG)
+    text = response.text
+    for attempt in range(GEMINI_MAX_CORRECTIONS + 1):
+        try:
+            return parse(text)
+        except StructuredOutputError as e:
+            if attempt == GEMINI_MAX_CORRECTIONS or not gemini_limiter.try_acquire():
+                raise
+            logger.info("Gemini reply unusable (%s); requesting a correction", e)
+            correction = CORRECTION_PROMPT.format(
+                problems="; ".join(e.problems[:10]),
+                schema_hint=schema_hint.strip(),
+                previous=text[:4000]
+            )
+            response = await asyncio.to_thread(gemini_model.generate_content, correction, generation_config=GEMINI_GENERATION_CONFIG)
+            text = response.text
+
+def parse_layer2_reply(text: str) -> dict:
+    data = extract_json(text, dict)
+    if not data.get("disease"):
+        raise StructuredOutputError("missing fields: disease", ["disease"])
+    return layer2_result(data)
+
+def layer2_result(data: dict) -> dict:
+    return {
+        "disease": data.get("disease", "Unknown Condition"),
+        "solution": data.get("solution", "Consult an expert."),
+        "confidence": 0.95 # Gemini is treated as high confidence
+    }
+
+def handle_gemini_error(e: Exception):
+    if is_rate_limit_error(e):
+        gemini_limiter.record_rate_limited(e)
+        logger.warning("Gemini quota exceeded: %s", e)
+        logger.info("Layer 2 paused until the quota cooldown ends.")
+    else:
+        logger.error("Gemini fallback failed: %s", e, exc_info=e)
+
+async def call_gemini_single(img: Image.Image) -> Optional[dict]:
+    """One Layer 2 call for one image"""
+    if not gemini_limiter.try_acquire():
+        logger.info("Gemini budget exhausted or cooling down. Skipping Layer 2.")
+        return None
+    
+    try:
+        logger.info("Triggering Layer 2: Gemini Universal Detection...")
+        
+        # Optimized prompt for faster processing
+        prompt = """
+        Analyze this plant image quickly. Identify the disease/condition and provide treatment.
+        Return JSON: {"disease": "specific disease name", "solution": "brief treatment (2 sentences max)"}
+        """
+        
+        return await generate_structured([prompt, img], parse_layer2_reply, prompt)
+    except Exception as e:
+        handle_gemini_error(e)
+        return None
+
+async def call_gemini_batch(images: List[Image.Image]) -> List[Optional[dict]]:
+    """One Layer 2 call for several images, with one JSON entry per image"""
+    if not gemini_limiter.try_acquire():
+        logger.info("Gemini budget exhausted or cooling down. Skipping Layer 2.")
+        return [None] * len(images)
+    
+    prompt = f"""
+        Analyze these {len(images)} plant images quickly. Each image is preceded by its label "Image N".
+        For each image identify the disease/condition and provide treatment.
+        Return ONLY a JSON array with exactly one object per image:
+        [{{"image": 1, "disease": "specific disease name", "solution": "brief treatment (2 sentences max)"}}, ...]
+        """
+    contents = [prompt]
+    for number, img in enumerate(images, start=1):
+        contents.extend([f"Image {number}", img])
+    
+    try:
+        logger.info("Triggering Layer 2: Gemini batch of %d images", len(images), extra={"batch_size": len(images)})
+        return await generate_structured(contents, lambda text: parse_layer2_batch(text, len(images)), prompt)
+    except StructuredOutputError as e:
+        # Still incomplete after corrections: the batcher retries the missing images alone
+        raise BatchParseError(str(e), partial=getattr(e, "partial", None))
+    except Exception as e:
+        handle_gemini_error(e)
+        return [None] * len(images)
+
+class PartialBatchReply(StructuredOutputError):
+    """A batch reply missing some images; partial maps image index to the usable results"""
+    
+    def __init__(self, message: str, problems: List[str], partial: Dict[int, dict]):
+        super().__init__(message, problems)
+        self.partial = partial
+
+def parse_layer2_batch(text: str, count: int) -> List[dict]:
+    """One Layer 2 result per image from a batch reply; raises PartialBatchReply listing unusable entries"""
+    entries = extract_json(text, list)
+    parsed = {}
+    for entry in entries:
+        if not isinstance(entry, dict) or not entry.get("disease"):
+            continue
+        index = entry.get("image")
+        if isinstance(index, int) and 1 <= index <= count:
+            parsed.setdefault(index - 1, layer2_result(entry))
+    if len(parsed) < count and len(entries) == count and all(isinstance(item, dict) for item in entries):
+        # Unnumbered but complete: fall back to positional order
+        parsed = {i: layer2_result(entry) for i, entry in enumerate(entries) if entry.get("disease")}
+    if len(parsed) < count:
+        problems = [f"image {i + 1}: entry missing or without a disease" for i in range(count) if i not in parsed]
+        raise PartialBatchReply(f"{count - len(parsed)} entries missing", problems, parsed)
+    return [parsed[i] for i in range(count)]
+
+# Groups concurrent low-confidence images into one Gemini call (opt-in)
+GEMINI_BATCHING = os.getenv("GEMINI_BATCHING", "false").lower() == "true"
+gemini_batcher = GeminiBatcher(
+    call_gemini_batch,
+    call_gemini_single,
+    window_seconds=int(os.getenv("GEMINI_BATCH_WINDOW_MS", 250)) / 1000,
+    max_batch=int(os.getenv("GEMINI_BATCH_SIZE", 8)),
+    timeout_seconds=float(os.getenv("GEMINI_BATCH_TIMEOUT_SECONDS", 30))
+)
+
+@traced("gemini")
+async def get_gemini_prediction(img: Image.Image) -> Optional[dict]:
     """Fallback to Gemini for universal detection with quota-aware error handling"""
     global gemini_model
     
@@ -465,47 +1279,25 @@ async def get_gemini_prediction(image_bytes: bytes) -> Optional[dict]:
     if not gemini_model:
         return None
     
-    try:
-        logger.info("Triggering Layer 2: Gemini Universal Detection...")
-        img = Image.open(io.BytesIO(image_bytes))
-        
-        # Optimized prompt for faster processing
-        prompt = """
-        Analyze this plant image quickly. Identify the disease/condition and provide treatment.
-        Return JSON: {"disease": "specific disease name", "solution": "brief treatment (2 sentences max)"}
-        """
-        
-        response = gemini_model.generate_content([prompt, img])
-        # Extract JSON from response
-        text = response.text.strip()
-        if "```json" in text:
-            text = text.split("```json")[1].split("```")[0].strip()
-        elif "```" in text:
-            text = text.split("```")[1].split("```")[0].strip()
-            
-        result = json.loads(text)
-        return {
-            "disease": result.get("disease", "Unknown Condition"),
-            "solution": result.get("solution", "Consult an expert."),
-            "confidence": 0.95 # Gemini is treated as high confidence
-        }
-    except Exception as e:
-        error_msg = str(e).lower()
-        if "quota" in error_msg or "429" in error_msg:
-            logger.warning(f"⚠️ Gemini quota exceeded: {e}")
-            logger.info("Layer 2 temporarily disabled due to quota. Will retry when quota resets.")
-            return None
-        else:
-            logger.error(f"Gemini fallback failed: {e}")
-            return None
+    if GEMINI_BATCHING:
+        return await gemini_batcher.submit(img)
+    return await call_gemini_single(img)
 
 async def get_enriched_disease_info(disease_name: str) -> Optional[DiseaseDetail]:
     """Fetch structured, enriched disease information from Gemini"""
+    cached_details = get_cached_enrichment(disease_name)
+    if cached_details:
+        return DiseaseDetail(**cached_details)
+    
     if not gemini_model:
         return None
     
+    if not gemini_limiter.try_acquire():
+        logger.info("Gemini budget exhausted or cooling down. Skipping enrichment for %s.", disease_name)
+        return None
+    
     try:
-        logger.info(f"Enriching data for: {disease_name}...")
+        logger.info("Enriching data for %s", disease_name, extra={"disease": disease_name})
         
         prompt = f"""
         Provide a detailed, professional medical-style report for the plant disease: '{disease_name}'.
@@ -559,30 +1351,141 @@ async def get_enriched_disease_info(disease_name: str) -> Optional[DiseaseDetail
         }}
         """
         
-        response = gemini_model.generate_content(prompt)
-        text = response.text.strip()
-        if "```json" in text:
-            text = text.split("```json")[1].split("```")[0].strip()
-        elif "```" in text:
-            text = text.split("```")[1].split("```")[0].strip()
-            
-        data = json.loads(text)
-        return DiseaseDetail(**data)
+        details = await generate_structured(prompt, lambda text: parse_model(text, DiseaseDetail), prompt)
+        cache_enrichment(disease_name, details.dict())
+        return details
     except Exception as e:
-        logger.error(f"Enrichment failed for {disease_name}: {e}")
+        if is_rate_limit_error(e):
+            gemini_limiter.record_rate_limited(e)
+        logger.error("Enrichment failed for %s: %s", disease_name, e, exc_info=not is_rate_limit_error(e),
+                     extra={"disease": disease_name})
         return None
 
+@traced("enrichment")
+async def attach_enrichment(result: dict, enrich: bool) -> dict:
+    """Inline enrichment details: from cache when available, or generated when enrich is requested"""
+    if result["disease"] == "background":
+        return result
+    if enrich:
+        details = await get_enriched_disease_info(result["disease"])
+        result["details"] = details.dict() if details else None
+    else:
+        result["details"] = get_cached_enrichment(result["disease"])
+    return result
+
+def knowledge_etag(*parts) -> str:
+    return f'W/"{".".join(str(part) for part in parts)}"'
+
+def not_modified(request: Request, etag: str) -> Optional[Response]:
+    """304 response when the client's If-None-Match already names etag"""
+    if response_codec.etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(
+            status_code=status.HTTP_304_NOT_MODIFIED,
+            headers={"etag": etag, "cache-control": KNOWLEDGE_CACHE_CONTROL}
+        )
+    return None
+
 @app.get("/enrich/{disease_name}", response_model=DiseaseDetail)
-async def enrich_disease(disease_name: str):
-    """Endpoint to fetch enriched disease information"""
+async def enrich_disease(disease_name: str, request: Request, response: Response):
+    """Endpoint to fetch enriched disease information (served from cache when available)
+    
+    Cached enrichments carry an ETag of the knowledge version they were
+    written at, so revalidation is answered without reading the entry.
+    """
+    version = get_enrichment_version(disease_name)
+    if version is not None:
+        cached = not_modified(request, knowledge_etag("enrich", version))
+        if cached:
+            return cached
+    
     details = await get_enriched_disease_info(disease_name)
     if not details:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Could not enrich disease information"
         )
+    
+    version = get_enrichment_version(disease_name)
+    if version is not None:
+        response.headers["etag"] = knowledge_etag("enrich", version)
+    response.headers["cache-control"] = KNOWLEDGE_CACHE_CONTROL
     return details
 
+class KnowledgeSnapshot(BaseModel):
+    version: str = Field(..., description="Pass back as since to receive only later changes")
+    solutions_version: str
+    enrichment_version: int
+    full: bool = Field(..., description="False when only enrichments added after since are included")
+    solutions: Optional[Dict[str, str]] = None
+    enrichments: Dict[str, Dict[str, Any]]
+
+def parse_knowledge_version(version: Optional[str]):
+    """Split a snapshot version "<solutions digest>.<enrichment version>"; None when malformed"""
+    digest, _, counter = (version or "").partition(".")
+    if not digest or not counter.isdigit():
+        return None
+    return digest, int(counter)
+
+@app.get("/knowledge", response_model=KnowledgeSnapshot)
+async def get_knowledge(request: Request, response: Response, since: Optional[str] = None):
+    """Solution table and cached enrichments as one versioned snapshot
+    
+    With since set to a previously returned version, the solution table is
+    omitted if unchanged and only enrichments cached after that version are
+    returned. Expired enrichments are not reported as removed; clients may
+    keep serving their copy.
+    """
+    enrichment_version = get_knowledge_version()
+    version = f"{solutions_version}.{enrichment_version}"
+    etag = knowledge_etag("knowledge", version, since or "full")
+    cached = not_modified(request, etag)
+    if cached:
+        return cached
+    
+    previous = parse_knowledge_version(since)
+    full = previous is None or previous[0] != solutions_version
+    response.headers["etag"] = etag
+    response.headers["cache-control"] = KNOWLEDGE_CACHE_CONTROL
+    return KnowledgeSnapshot(
+        version=version,
+        solutions_version=solutions_version,
+        enrichment_version=enrichment_version,
+        full=full,
+        solutions=solutions if full else None,
+        enrichments=get_enrichments_since(0 if full else previous[1])
+    )
+
+@app.get("/search", response_model=SearchResponse)
+async def search_knowledge(q: str, limit: int = 5):
+    """Ranked fuzzy matches for a disease name over labels, aliases and solution text"""
+    if not knowledge_base:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Knowledge base not loaded"
+        )
+    started = time.perf_counter()
+    matches = knowledge_base.search(q, limit=min(max(limit, 1), 20))
+    took_ms = (time.perf_counter() - started) * 1000
+    
+    records = [knowledge_base.record(match.record_id) for match in matches]
+    versions = get_enrichment_versions([record["label"] or record["name"] for record in records])
+    return SearchResponse(
+        query=q,
+        matches=[
+            SearchMatchResponse(
+                id=record["id"],
+                label=record["label"],
+                name=record["name"],
+                score=match.score,
+                matched=match.matched,
+                solution=record["solution"],
+                has_details=bool(record["details"]) or version is not None
+            )
+            for match, record, version in zip(matches, records, versions)
+        ],
+        took_ms=took_ms
+    )
+
 @app.get("/health", response_model=HealthResponse)
 async def health_check():
     """Health check endpoint with detailed status"""
@@ -595,11 +1498,226 @@ async def health_check():
         uptime_seconds=time.time() - start_time
     )
 
+async def serve_cached_prediction(image_hash: str, user_id: str, enrich: bool, started_at: float) -> Optional[dict]:
+    """Return a cached prediction (recorded and enriched) if one exists for the image hash"""
+    cached_result = get_cached_prediction(image_hash)
+    if not cached_result:
+        return None
+    
+    processing_time = (time.time() - started_at) * 1000
+    logger.info("Returning cached result in %.1fms", processing_time, extra={"processing_time_ms": processing_time})
+    
+    # Update timestamp and processing time for cached result
+    cached_result["timestamp"] = datetime.now().isoformat()
+    cached_result["processing_time_ms"] = processing_time
+    cached_result["cached"] = True
+    record_scan(cached_result, user_id, image_hash)
+    
+    return await attach_enrichment(cached_result, enrich)
+
+async def run_prediction(
+    image: Image.Image,
+    image_hash: str,
+    user_id: str = "default",
+    region: Optional[str] = None,
+    enrich: bool = False,
+    started_at: Optional[float] = None,
+    publish: Optional[Callable[[str, dict], None]] = None
+) -> dict:
+    """Layer 1 inference with Layer 2 fallback on a decoded image, then cache, record, alert and enrich
+    
+    publish, when given, receives intermediate results as they become available:
+    "layer1" right after local inference and "layer2" when Gemini overrides it.
+    """
+    started_at = started_at or time.time()
+    
+    # Short-circuit junk uploads before spending an invoke (or a Gemini call) on them
+    if PREFILTER_ENABLED:
+        rejection = prefilter_image(image)
+        prefilter_counts[rejection.reason if rejection else "passed"] += 1
+        if rejection and rejection.reason == "no_plant":
+            logger.info("Pre-filter: no plant detected (%.3f plant pixels)", rejection.quality.plant_fraction,
+                        extra={"prefilter": rejection.reason})
+            return {
+                "disease": "background",
+                "confidence": round(1.0 - rejection.quality.plant_fraction, 4),
+                "solution": solutions.get("background", rejection.message),
+                "layer": "Pre-filter",
+                "details": None,
+                "timestamp": datetime.now().isoformat(),
+                "processing_time_ms": (time.time() - started_at) * 1000,
+                "cached": False
+            }
+        if rejection:
+            logger.info("Pre-filter rejected image: %s %s", rejection.reason, rejection.quality,
+                        extra={"prefilter": rejection.reason})
+            raise HTTPException(
+                status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                detail=rejection.message
+            )
+    
+    if LEAF_CROP_ENABLED:
+        with span("leaf_crop"):
+            image = crop_to_leaf(image)
+    processed_image = preprocess_image(image)
+    
+    # Run TFLite Inference (Layer 1)
+    with span("invoke"):
+        input_details = interpreter.get_input_details()
+        output_details = interpreter.get_output_details()
+        interpreter.set_tensor(input_details[0]['index'], processed_image)
+        interpreter.invoke()
+        predictions = interpreter.get_tensor(output_details[0]['index'])[0]
+    
+    top_prediction_idx = int(np.argmax(predictions))
+    confidence = float(predictions[top_prediction_idx])
+    record = label_records[top_prediction_idx]
+    
+    logger.info("Layer 1 Result: %s | Confidence: %.4f", record.label, confidence,
+                extra={"layer": "layer1", "disease": record.label, "confidence": confidence})
+    
+    # Borderline result: try to settle it locally before paying for Layer 2
+    if batch_classifier and TTA_ENABLED and TTA_MIN_CONFIDENCE <= confidence < LAYER2_CONFIDENCE_THRESHOLD:
+        predictions = predict_with_tta(image, processed_image[0], predictions)
+        top_prediction_idx = int(np.argmax(predictions))
+        confidence = float(predictions[top_prediction_idx])
+        record = label_records[top_prediction_idx]
+        logger.info("TTA Result: %s | Confidence: %.4f", record.label, confidence,
+                    extra={"layer": "tta", "disease": record.label, "confidence": confidence})
+    
+    if publish:
+        publish("layer1", {
+            "disease": record.label,
+            "confidence": confidence,
+            "solution": record.solution,
+            "layer": "Standard Analysis",
+            "processing_time_ms": (time.time() - started_at) * 1000,
+            "refining": confidence < LAYER2_CONFIDENCE_THRESHOLD and check_gemini_availability() and gemini_limiter.available()
+        })
+    
+    # Layer 2 Fallback Logic: If confidence is low or unknown
+    if confidence < LAYER2_CONFIDENCE_THRESHOLD:
+        # Check if Gemini is available before attempting
+        if check_gemini_availability():
+            logger.info("Confidence < %s (%.3f). Triggering Gemini Fallback", LAYER2_CONFIDENCE_THRESHOLD, confidence)
+            gemini_res = await get_gemini_prediction(image)
+            if gemini_res:
+                processing_time = (time.time() - started_at) * 1000
+                logger.info("Layer 2 Result: %s | Time: %.1fms", gemini_res["disease"], processing_time,
+                            extra={"layer": "layer2", "disease": gemini_res["disease"]})
+                # Names that match a model class are reported as that class, so enrichment and stats line up
+                layer2_disease = known_label(gemini_res['disease']) or f"[Universal] {gemini_res['disease']}"
+                if publish:
+                    publish("layer2", {
+                        "disease": layer2_disease,
+                        "confidence": gemini_res['confidence'],
+                        "solution": gemini_res['solution'],
+                        "layer": "Advanced Analysis",
+                        "processing_time_ms": processing_time
+                    })
+                
+                result = {
+                    "disease": layer2_disease,
+                    "confidence": gemini_res['confidence'],
+                    "solution": gemini_res['solution'],
+                    "layer": "Advanced Analysis",
+                    "details": None,
+                    "timestamp": datetime.now().isoformat(),
+                    "processing_time_ms": processing_time,
+                    "cached": False
+                }
+                
+                # Cache and record the result
+                cache_prediction(image_hash, result)
+                record_scan(result, user_id, image_hash)
+                observe_prediction(result, region, user_id)
+                
+                # Send Slack alert
+                send_slack_alert(
+                    disease=layer2_disease,
+                    confidence=gemini_res['confidence'],
+                    layer="Advanced Analysis",
+                    image_hash=image_hash
+                )
+                
+                return await attach_enrichment(result, enrich)
+            else:
+                logger.info("Layer 2 failed or quota exceeded. Using Layer 1 result.")
+        else:
+            logger.warning("Confidence < %s (%.3f) but Gemini is not available", LAYER2_CONFIDENCE_THRESHOLD, confidence,
+                           extra={"confidence": confidence})
+    else:
+        logger.info("Confidence >= %s (%.3f). Staying with Layer 1.", LAYER2_CONFIDENCE_THRESHOLD, confidence)
+
+    # Standard TFLite Result
+    disease_name = record.label
+    solution = record.solution
+    
+    processing_time = (time.time() - started_at) * 1000
+    logger.info("Prediction: %s (confidence: %.3f, time: %.1fms)", disease_name, confidence, processing_time,
+                extra={"disease": disease_name, "confidence": confidence, "processing_time_ms": processing_time})
+    
+    result = {
+        "disease": disease_name,
+        "confidence": confidence,
+        "solution": solution,
+        "layer": "Standard Analysis",
+        "details": None,
+        "timestamp": datetime.now().isoformat(),
+        "processing_time_ms": processing_time,
+        "cached": False
+    }
+    
+    # Cache and record the result
+    cache_prediction(image_hash, result)
+    record_scan(result, user_id, image_hash)
+    observe_prediction(result, region, user_id)
+    
+    # Send Slack alert for high-confidence or concerning results
+    if confidence > 0.8 or "disease" in disease_name.lower():
+        send_slack_alert(
+            disease=disease_name,
+            confidence=confidence,
+            layer="Standard Analysis",
+            image_hash=image_hash
+        )
+    
+    return await attach_enrichment(result, enrich)
+
+async def read_prediction_upload(file: UploadFile, content_hash: Optional[str]) -> str:
+    """Validate and stream in an upload; returns the cache key (client content_hash when given)"""
+    validate_image_file(file)
+    
+    # Stream upload, enforcing size limit and hashing for caching
+    image_hash = await read_upload(file)
+    if content_hash:
+        content_hash = content_hash.strip().lower()
+        if not CONTENT_HASH_PATTERN.match(content_hash):
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="content_hash must be an MD5 hex digest"
+            )
+        image_hash = content_hash
+    return image_hash
+
 @app.post("/predict", response_model=PredictionResponse)
-async def predict_disease(file: UploadFile = File(...)):
-    """Predict plant disease from uploaded image with caching and Layer 2 fallback"""
-    logger.info(f"Incoming prediction request for file: {file.filename}")
+async def predict_disease(
+    file: UploadFile = File(...),
+    content_hash: Optional[str] = Form(None),
+    user_id: str = Form("default"),
+    region: Optional[str] = Form(None),
+    enrich: bool = False
+):
+    """Predict plant disease from uploaded image with caching and Layer 2 fallback
+    
+    Clients that downscale before uploading may send the MD5 of the original
+    file as content_hash so results stay cached by the original content.
+    Cached enrichment is always returned inline in details; with enrich=true
+    missing enrichment is generated before responding.
+    """
+    logger.info("Incoming prediction request for file: %s", file.filename)
     start_time_request = time.time()
+    validate_user_id(user_id)
     
     if not interpreter:
         logger.error("Model not loaded")
@@ -609,142 +1727,525 @@ async def predict_disease(file: UploadFile = File(...)):
         )
     
     try:
-        # Validate file
-        validate_image_file(file)
-        
-        # Read and validate file size
-        contents = await file.read()
-        if len(contents) > MAX_FILE_SIZE:
-            raise HTTPException(
-                status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
-                detail=f"File too large. Maximum size: {MAX_FILE_SIZE // (1024*1024)}MB"
-            )
-        
-        # Generate image hash for caching
-        image_hash = get_image_hash(contents)
+        image_hash = await read_prediction_upload(file, content_hash)
         
         # Check cache first
-        cached_result = get_cached_prediction(image_hash)
+        cached_result = await serve_cached_prediction(image_hash, user_id, enrich, start_time_request)
         if cached_result:
-            processing_time = (time.time() - start_time_request) * 1000
-            logger.info(f"🚀 Returning cached result in {processing_time:.1f}ms")
-            
-            # Update timestamp and processing time for cached result
-            cached_result["timestamp"] = datetime.now().isoformat()
-            cached_result["processing_time_ms"] = processing_time
-            cached_result["cached"] = True
-            
             return PredictionResponse(**cached_result)
         
-        # Open and preprocess image for TFLite
+        # Check dimensions from the header, then decode and preprocess image for TFLite
+        image = open_image_header(file.file)
+        image = await decode_image(image)
+        
+        result = await run_prediction(image, image_hash, user_id, region, enrich, start_time_request)
+        return PredictionResponse(**result)
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.exception("Unexpected error during prediction: %s", e)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Internal server error during prediction"
+        )
+
+@app.post("/predict/tiles", response_model=TilePredictionResponse)
+async def predict_tiles(file: UploadFile = File(...)):
+    """Whole-plant or tray photo: classify overlapping leaf-sized tiles and aggregate them
+    
+    Returns a per-tile disease heatmap (row-major, matching rows x cols) and a
+    diagnosis voted by the diseased leaf tiles. Like /predict, a photo with no
+    plant in it gets a "background" diagnosis (here with an empty grid) rather
+    than an error.
+    """
+    logger.info("Incoming tiled prediction request for file: %s", file.filename)
+    start_time_request = time.time()
+    
+    if not interpreter:
+        logger.error("Model not loaded")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Model not loaded"
+        )
+    
+    try:
+        await read_prediction_upload(file, None)
+        image = open_image_header(file.file)
+        image = await decode_image(image)
+        
+        if PREFILTER_ENABLED:
+            rejection = prefilter_image(image)
+            prefilter_counts[rejection.reason if rejection else "passed"] += 1
+            if rejection and rejection.reason == "no_plant":
+                # Same "background" diagnosis as /predict, with no tiles classified
+                logger.info("Pre-filter: no plant detected (%.3f plant pixels)", rejection.quality.plant_fraction,
+                            extra={"prefilter": rejection.reason})
+                return TilePredictionResponse(
+                    disease="background",
+                    confidence=round(1.0 - rejection.quality.plant_fraction, 4),
+                    solution=solutions.get("background", rejection.message),
+                    healthy=is_healthy("background"),
+                    affected_tiles=0,
+                    leaf_tiles=0,
+                    affected_fraction=0.0,
+                    rows=0,
+                    cols=0,
+                    heatmap=[],
+                    disease_counts={},
+                    tiles=[],
+                    processing_time_ms=(time.time() - start_time_request) * 1000
+                )
+            if rejection:
+                logger.info("Pre-filter rejected image: %s %s", rejection.reason, rejection.quality,
+                            extra={"prefilter": rejection.reason})
+                raise HTTPException(
+                    status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                    detail=rejection.message
+                )
+        
+        result = classify_tiles(image)
+        result["processing_time_ms"] = (time.time() - start_time_request) * 1000
+        logger.info("Tiled Result: %s | %d/%d leaf tiles affected | Time: %.1fms", result["disease"],
+                    result["affected_tiles"], result["leaf_tiles"], result["processing_time_ms"],
+                    extra={"disease": result["disease"], "processing_time_ms": result["processing_time_ms"]})
+        return TilePredictionResponse(**result)
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.exception("Unexpected error during tiled prediction: %s", e)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Internal server error during prediction"
+        )
+
+def sse_event(event: str, data) -> str:
+    return f"event: {event}\ndata: {json_lib.dumps(data)}\n\n"
+
+@app.post("/predict/stream")
+async def predict_disease_stream(
+    file: UploadFile = File(...),
+    content_hash: Optional[str] = Form(None),
+    user_id: str = Form("default"),
+    region: Optional[str] = Form(None),
+    enrich: bool = True
+):
+    """Progressive prediction as Server-Sent Events
+    
+    Emits "layer1" as soon as local inference finishes, "layer2" if Gemini
+    overrides a low-confidence result, "prediction" with the final result,
+    "enrichment" once details are generated (when not already inline) and
+    finally "done". Failures after the stream has started arrive as "error".
+    """
+    logger.info("Incoming streaming prediction request for file: %s", file.filename)
+    start_time_request = time.time()
+    validate_user_id(user_id)
+    
+    if not interpreter:
+        logger.error("Model not loaded")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Model not loaded"
+        )
+    
+    # Upload and decode errors are reported as regular HTTP errors before streaming starts
+    image_hash = await read_prediction_upload(file, content_hash)
+    cached_result = await serve_cached_prediction(image_hash, user_id, False, start_time_request)
+    image = None
+    if not cached_result:
+        image = open_image_header(file.file)
+        image = await decode_image(image)
+    
+    events = asyncio.Queue()
+    
+    def publish(event: str, data: dict):
+        events.put_nowait((event, data))
+    
+    async def pipeline():
         try:
-            image = Image.open(io.BytesIO(contents))
+            result = cached_result or await run_prediction(
+                image, image_hash, user_id, region, False, start_time_request, publish=publish
+            )
+            publish("prediction", PredictionResponse(**result).dict())
+            if enrich and not result["details"] and result["disease"] != "background":
+                details = await get_enriched_disease_info(result["disease"])
+                publish("enrichment", details.dict() if details else None)
+        except HTTPException as e:
+            publish("error", {"error": e.detail})
         except Exception as e:
-            logger.error(f"Failed to open image: {e}")
+            logger.exception("Unexpected error during streaming prediction: %s", e)
+            publish("error", {"error": "Internal server error during prediction"})
+        finally:
+            publish("done", {"processing_time_ms": (time.time() - start_time_request) * 1000})
+    
+    async def event_stream():
+        task = asyncio.create_task(pipeline())
+        while True:
+            event, data = await events.get()
+            yield sse_event(event, data)
+            if event == "done":
+                break
+        await task
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@contextlib.contextmanager
+def job_context(kind: str, payload: dict):
+    """Request id (and trace, when enabled) for a background job, correlated with the request that queued it"""
+    request_id = payload.get("request_id") or tracing.new_request_id()
+    with tracing.request_context(request_id):
+        if not tracer:
+            yield
+            return
+        with tracer.trace(request_id, f"job {kind}"):
+            yield
+
+async def handle_predict_job(payload: dict, input_bytes: Optional[bytes], report_progress) -> dict:
+    """Job handler: full prediction pipeline on an uploaded image"""
+    with job_context("predict", payload):
+        return await run_predict_job(payload, input_bytes, report_progress)
+
+async def run_predict_job(payload: dict, input_bytes: Optional[bytes], report_progress) -> dict:
+    started_at = time.time()
+    cached_result = await serve_cached_prediction(payload["image_hash"], payload["user_id"], payload["enrich"], started_at)
+    if cached_result:
+        return PredictionResponse(**cached_result).dict()
+    
+    report_progress(0.1, "decode")
+    image = open_image_header(io.BytesIO(input_bytes))
+    image = await decode_image(image)
+    
+    report_progress(0.3, "analyze")
+    result = await run_prediction(image, payload["image_hash"], payload["user_id"], payload["region"], payload["enrich"], started_at)
+    return PredictionResponse(**result).dict()
+
+async def handle_enrich_job(payload: dict, input_bytes: Optional[bytes], report_progress) -> dict:
+    """Job handler: Gemini enrichment for a disease name"""
+    report_progress(0.1, "enrich")
+    with job_context("enrich", payload):
+        details = await get_enriched_disease_info(payload["disease_name"])
+    if not details:
+        raise ValueError("Could not enrich disease information")
+    return details.dict()
+
+class JobSubmitResponse(BaseModel):
+    job_id: str
+    kind: str
+    status: str
+    priority: str
+    status_url: str
+    events_url: str
+
+class JobStatusResponse(BaseModel):
+    id: str
+    kind: str
+    priority: int
+    status: str = Field(..., description="queued, running, done or failed")
+    progress: float
+    stage: Optional[str] = None
+    result: Optional[dict] = None
+    error: Optional[str] = None
+    created_at: float
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+
+def require_job_queue() -> JobQueue:
+    """Return the job queue or raise 503 if it is unavailable"""
+    if not job_queue:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Job queue not available"
+        )
+    return job_queue
+
+@app.post("/jobs", response_model=JobSubmitResponse, status_code=status.HTTP_202_ACCEPTED)
+async def submit_job(
+    kind: str = Form("predict"),
+    file: Optional[UploadFile] = File(None),
+    disease_name: Optional[str] = Form(None),
+    priority: str = Form("interactive"),
+    content_hash: Optional[str] = Form(None),
+    user_id: str = Form("default"),
+    region: Optional[str] = Form(None),
+    enrich: bool = Form(False)
+):
+    """Queue a prediction or enrichment job and return immediately with its id"""
+    queue = require_job_queue()
+    if priority not in PRIORITIES:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Invalid priority. Allowed: {', '.join(PRIORITIES)}"
+        )
+    
+    if kind == "predict":
+        validate_user_id(user_id)
+        if not interpreter:
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail="Model not loaded"
+            )
+        if file is None:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
-                detail="Invalid image file"
+                detail="Prediction jobs require a file"
+            )
+        image_hash = await read_prediction_upload(file, content_hash)
+        payload = {"image_hash": image_hash, "user_id": user_id, "region": region, "enrich": enrich,
+                   "request_id": tracing.current_request_id()}
+        job_id = await queue.submit("predict", payload, await file.read(), PRIORITIES[priority])
+    elif kind == "enrich":
+        if not disease_name:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Enrichment jobs require disease_name"
             )
+        job_id = await queue.submit("enrich", {"disease_name": disease_name, "request_id": tracing.current_request_id()},
+                                    None, PRIORITIES[priority])
+    else:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid job kind. Allowed: predict, enrich"
+        )
+    
+    logger.info("Queued %s job %s (%s)", kind, job_id, priority, extra={"job_id": job_id})
+    return JobSubmitResponse(
+        job_id=job_id,
+        kind=kind,
+        status="queued",
+        priority=priority,
+        status_url=f"/jobs/{job_id}",
+        events_url=f"/jobs/{job_id}/events"
+    )
+
+@app.get("/jobs/{job_id}", response_model=JobStatusResponse)
+async def get_job(job_id: str):
+    """Poll a job's status, progress and result"""
+    job = await require_job_queue().get(job_id)
+    if not job:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Job not found"
+        )
+    return JobStatusResponse(**job)
+
+@app.get("/jobs/{job_id}/events")
+async def stream_job_events(job_id: str):
+    """Server-Sent Events stream of a job's progress until it finishes"""
+    queue = require_job_queue()
+    if not await queue.get(job_id):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Job not found"
+        )
+    
+    async def event_stream():
+        last_state = None
+        with queue.watch(job_id) as changed:  # Registered before each status read, so no update is missed
+            while True:
+                job = await queue.get(job_id)
+                if not job:
+                    return
+                state = (job["status"], job["progress"], job["stage"])
+                if state != last_state:
+                    last_state = state
+                    event = job["status"] if job["status"] in ("done", "failed") else "progress"
+                    yield sse_event(event, JobStatusResponse(**job).dict())
+                    if event != "progress":
+                        return
+                if not await queue.wait_for_change(changed, timeout=15.0):
+                    yield ": keepalive\n\n"
+    
+    return StreamingResponse(event_stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+class RequestSizeLimit:
+    """Reject request bodies over max_bytes while they are being received
+    
+    A pure ASGI middleware, so it sees the body before Starlette's multipart
+    parser spools it: a declared Content-Length over the limit is refused
+    unread, and chunked uploads are counted as they arrive and refused as
+    soon as the count passes the limit. After the 413 the app is told the
+    client disconnected and anything it still sends is dropped.
+    """
+    
+    def __init__(self, app, max_bytes: int):
+        self.app = app
+        self.max_bytes = max_bytes
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        content_length = dict(scope["headers"]).get(b"content-length", b"")
+        if content_length.isdigit() and int(content_length) > self.max_bytes:
+            await self.reject(send)
+            return
         
-        processed_image = preprocess_image(image)
+        received = 0
+        rejected = False
+        response_started = False
         
-        # Run TFLite Inference (Layer 1)
-        input_details = interpreter.get_input_details()
-        output_details = interpreter.get_output_details()
-        interpreter.set_tensor(input_details[0]['index'], processed_image)
-        interpreter.invoke()
-        predictions = interpreter.get_tensor(output_details[0]['index'])[0]
+        async def limited_receive():
+            nonlocal received, rejected
+            if rejected:
+                return {"type": "http.disconnect"}
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    rejected = True
+                    if not response_started:
+                        await self.reject(send)
+                    return {"type": "http.disconnect"}
+            return message
         
-        top_prediction_idx = np.argmax(predictions)
-        confidence = float(predictions[top_prediction_idx])
+        async def guarded_send(message):
+            nonlocal response_started
+            if rejected:
+                return
+            if message["type"] == "http.response.start":
+                response_started = True
+            await send(message)
         
-        logger.info(f"Layer 1 Result: {labels[top_prediction_idx] if top_prediction_idx < len(labels) else 'unknown'} | Confidence: {confidence:.4f}")
-        
-        # Layer 2 Fallback Logic: If confidence is low or unknown
-        if confidence < 0.7:
-            # Check if Gemini is available before attempting
-            if check_gemini_availability():
-                logger.info(f"Confidence < 0.7 ({confidence:.3f}). Triggering Gemini Fallback...")
-                gemini_res = await get_gemini_prediction(contents)
-                if gemini_res:
-                    processing_time = (time.time() - start_time_request) * 1000
-                    logger.info(f"Layer 2 Result: {gemini_res['disease']} | Time: {processing_time:.1f}ms")
-                    
-                    result = {
-                        "disease": f"[Universal] {gemini_res['disease']}",
-                        "confidence": gemini_res['confidence'],
-                        "solution": gemini_res['solution'],
-                        "layer": "Advanced Analysis",
-                        "details": None,
-                        "timestamp": datetime.now().isoformat(),
-                        "processing_time_ms": processing_time,
-                        "cached": False
-                    }
-                    
-                    # Cache the result
-                    cache_prediction(image_hash, result)
-                    
-                    # Send Slack alert
-                    send_slack_alert(
-                        disease=gemini_res['disease'],
-                        confidence=gemini_res['confidence'],
-                        layer="Advanced Analysis",
-                        image_hash=image_hash
-                    )
-                    
-                    return PredictionResponse(**result)
-                else:
-                    logger.info("Layer 2 failed or quota exceeded. Using Layer 1 result.")
-            else:
-                logger.warning(f"Confidence < 0.7 ({confidence:.3f}) but Gemini is not available!")
-        else:
-            logger.info(f"Confidence >= 0.7 ({confidence:.3f}). Staying with Layer 1.")
+        try:
+            await self.app(scope, limited_receive, guarded_send)
+        except Exception:
+            if not rejected:
+                raise
+    
+    async def reject(self, send):
+        body = json_lib.dumps(ErrorResponse(
+            error=f"File too large. Maximum size: {MAX_FILE_SIZE // (1024*1024)}MB",
+            detail=f"HTTP {status.HTTP_413_REQUEST_ENTITY_TOO_LARGE}"
+        ).dict()).encode("utf-8")
+        await send({
+            "type": "http.response.start",
+            "status": status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode()),
+                        (b"connection", b"close")]
+        })
+        await send({"type": "http.response.body", "body": body})
 
-        # Standard TFLite Result
-        if top_prediction_idx < len(labels):
-            disease_name = labels[top_prediction_idx]
-        else:
-            disease_name = "unknown"
+app.add_middleware(RequestSizeLimit, max_bytes=MAX_FILE_SIZE + MULTIPART_OVERHEAD)
+
+class ResponseNegotiation:
+    """Re-encode, compress and tag JSON responses according to the request's Accept headers
+    
+    A pure ASGI middleware. Requests that ask for neither a binary encoding
+    nor compression and are not on an ETag path pass straight through, with
+    only a Vary header added. Otherwise JSON responses are buffered and
+    negotiated; streaming responses (SSE) and anything that is not JSON are
+    forwarded as they are sent.
+    """
+    
+    def __init__(self, app):
+        self.app = app
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        request_headers = Headers(scope=scope)
+        media_type = response_codec.JSON_MEDIA_TYPE
+        if BINARY_RESPONSES_ENABLED:
+            media_type = response_codec.negotiate_media_type(request_headers.get("accept"))
+        encoding = response_codec.negotiate_encoding(request_headers.get("accept-encoding"))
+        if_none_match = None
+        if scope["method"] == "GET" and scope["path"].startswith(ETAG_PATH_PREFIXES):
+            if_none_match = request_headers.get("if-none-match", "")
+        negotiate = media_type != response_codec.JSON_MEDIA_TYPE or encoding or if_none_match is not None
         
-        solution_key = disease_name.replace("___", " ").replace("_", " ").lower().strip()
-        solution = solutions.get(solution_key, "No specific solution available. Please consult with a plant pathologist for proper diagnosis and treatment.")
+        start_message = None
+        body_parts = []
         
-        processing_time = (time.time() - start_time_request) * 1000
-        logger.info(f"Prediction: {disease_name} (confidence: {confidence:.3f}, time: {processing_time:.1f}ms)")
+        async def negotiating_send(message):
+            nonlocal start_message
+            if message["type"] == "http.response.start":
+                headers = MutableHeaders(raw=message["headers"])
+                content_type = headers.get("content-type", "").split(";")[0].strip()
+                if content_type != response_codec.JSON_MEDIA_TYPE or "content-encoding" in headers:
+                    await send(message)
+                    return
+                headers["vary"] = "Accept, Accept-Encoding"
+                if not negotiate:
+                    await send(message)
+                    return
+                start_message = message
+                return
+            if start_message is None:
+                await send(message)
+                return
+            body_parts.append(message.get("body", b""))
+            if not message.get("more_body", False):
+                await self.send_negotiated(send, start_message, b"".join(body_parts),
+                                           media_type, encoding, if_none_match)
         
-        result = {
-            "disease": disease_name,
-            "confidence": confidence,
-            "solution": solution,
-            "layer": "Standard Analysis",
-            "details": None,
-            "timestamp": datetime.now().isoformat(),
-            "processing_time_ms": processing_time,
-            "cached": False
-        }
+        await self.app(scope, receive, negotiating_send)
+    
+    async def send_negotiated(self, send, start_message, body: bytes, media_type: str,
+                              encoding: Optional[str], if_none_match: Optional[str]):
+        status_code = start_message["status"]
+        headers = MutableHeaders(raw=[
+            (key, value) for key, value in start_message["headers"] if key not in (b"content-length", b"content-type")
+        ])
         
-        # Cache the result
-        cache_prediction(image_hash, result)
+        if if_none_match is not None and status_code == 200:
+            if "etag" not in headers:  # Versioned ETags set by the endpoint win
+                headers["etag"] = response_codec.weak_etag(body)
+            if response_codec.etag_matches(if_none_match, headers["etag"]):
+                await send({"type": "http.response.start", "status": status.HTTP_304_NOT_MODIFIED, "headers": headers.raw})
+                await send({"type": "http.response.body", "body": b""})
+                return
         
-        # Send Slack alert for high-confidence or concerning results
-        if confidence > 0.8 or "disease" in disease_name.lower():
-            send_slack_alert(
-                disease=disease_name,
-                confidence=confidence,
-                layer="Standard Analysis",
-                image_hash=image_hash
-            )
-        
-        return PredictionResponse(**result)
+        if media_type != response_codec.JSON_MEDIA_TYPE:
+            body = response_codec.encode(json_lib.loads(body), media_type)
+        if encoding and len(body) >= RESPONSE_COMPRESSION_MIN_BYTES:
+            body = response_codec.compress(body, encoding)
+            headers["content-encoding"] = encoding
+        headers["content-type"] = media_type
+        headers["content-length"] = str(len(body))
+        await send({"type": "http.response.start", "status": status_code, "headers": headers.raw})
+        await send({"type": "http.response.body", "body": body})
+
+app.add_middleware(ResponseNegotiation)
+
+@app.middleware("http")
+async def trace_requests(request, call_next):
+    """Tag each request with an id (the client's X-Request-ID when valid) and trace its stages
+    
+    Registered last so it wraps the other middleware. Streaming bodies (SSE)
+    are produced after call_next returns, so the trace ends with the body.
+    """
+    request_id = tracing.new_request_id(request.headers.get("x-request-id"))
+    with tracing.request_context(request_id):  # Log lines and queued jobs carry the id even with tracing off
+        if not tracer:
+            response = await call_next(request)
+            response.headers["x-request-id"] = request_id
+            return response
         
-    except HTTPException:
-        raise
-    except Exception as e:
-        logger.error(f"Unexpected error during prediction: {e}")
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail="Internal server error during prediction"
-        )
+        trace = tracer.start(request_id, f"{request.method} {request.url.path}")
+        try:
+            response = await call_next(request)
+        except Exception as e:
+            tracer.finish(trace, 500, f"{type(e).__name__}: {e}"[:200])
+            raise
+        finally:
+            tracer.detach()
+    response.headers["x-request-id"] = request_id
+    
+    body_iterator = response.body_iterator
+    async def finish_with_body():
+        try:
+            async for chunk in body_iterator:
+                yield chunk
+        finally:
+            tracer.finish(trace, response.status_code)
+    response.body_iterator = finish_with_body()
+    return response
 
 @app.exception_handler(HTTPException)
 async def http_exception_handler(request, exc):
@@ -795,7 +2296,7 @@ async def create_reminder(reminder: ReminderRequest):
                 json_lib.dumps(reminder_data)
             )
             
-            logger.info(f"💾 Reminder stored in Redis: {reminder_id}")
+            logger.info("Reminder stored in Redis: %s", reminder_id)
         
         # Send immediate Slack notification
         send_slack_reminder(
@@ -812,7 +2313,7 @@ async def create_reminder(reminder: ReminderRequest):
         )
         
     except Exception as e:
-        logger.error(f"Failed to create reminder: {e}")
+        logger.exception("Failed to create reminder: %s", e)
         return ReminderResponse(
             success=False,
             message=f"Failed to create reminder: {str(e)}"
@@ -843,7 +2344,7 @@ async def get_user_reminders(user_id: str = "default"):
         return {"reminders": reminders, "count": len(reminders)}
         
     except Exception as e:
-        logger.error(f"Failed to get reminders: {e}")
+        logger.exception("Failed to get reminders: %s", e)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Failed to retrieve reminders"
@@ -868,7 +2369,7 @@ async def delete_reminder(reminder_id: str):
                 detail="Reminder not found"
             )
     except Exception as e:
-        logger.error(f"Failed to delete reminder: {e}")
+        logger.exception("Failed to delete reminder: %s", e)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Failed to delete reminder"
@@ -896,10 +2397,70 @@ async def get_cache_stats():
     except Exception as e:
         return {"redis_available": False, "error": str(e)}
 
+@app.get("/metrics")
+async def get_metrics():
+    """Pre-filter outcome and tracing counters"""
+    return {
+        "prefilter": {"enabled": PREFILTER_ENABLED, **prefilter_counts},
+        "tracing": tracer.stats() if tracer else {"enabled": False},
+        "uptime_seconds": time.time() - start_time
+    }
+
+@app.get("/gemini/quota")
+async def get_gemini_quota():
+    """Client-side Gemini budget, cooldown and batching state"""
+    return {**gemini_limiter.status(), "batching": GEMINI_BATCHING, "batcher": gemini_batcher.stats()}
+
+@app.get("/outbreaks")
+async def get_outbreaks(limit: int = 10):
+    """Recent outbreak alerts and the busiest disease/region windows"""
+    return {
+        "alerts": [alert._asdict() for alert in reversed(outbreak_detector.recent_alerts)],
+        "hotspots": outbreak_detector.hotspots(limit=min(max(limit, 1), 100)),
+        "events_observed": outbreak_detector.events_observed,
+        "events_dropped": outbreak_detector.events_dropped
+    }
+
+def require_history_store() -> HistoryStore:
+    """Return the history store or raise 503 if it is unavailable"""
+    if not history_store:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Scan history not available"
+        )
+    return history_store
+
+@app.get("/history/{user_id}")
+async def get_scan_history(user_id: str, limit: int = 20):
+    """Most recent persisted scans for a user"""
+    validate_user_id(user_id)
+    scans = require_history_store().get_recent_scans(user_id, limit=min(max(limit, 1), 500))
+    return {"scans": scans, "count": len(scans)}
+
+@app.get("/stats/summary")
+async def get_stats_summary(user_id: str = ALL_USERS):
+    """Total scans and disease rate (O(1) read of incrementally maintained counters)
+    
+    Without a user_id the counts cover every user (no per-user data is
+    returned); STATS_ALL_USERS_ENABLED=false restricts /stats/* to one user.
+    """
+    return require_history_store().get_summary(stats_scope(user_id))
+
+@app.get("/stats/diseases")
+async def get_stats_diseases(user_id: str = ALL_USERS):
+    """Scan counts per disease (all users unless user_id is given)"""
+    return {"user_id": user_id, "counts": require_history_store().get_disease_counts(stats_scope(user_id))}
+
+@app.get("/stats/daily")
+async def get_stats_daily(user_id: str = ALL_USERS, days: int = 30):
+    """Per-day scan totals for the most recent days (all users unless user_id is given)"""
+    days = min(max(days, 1), 366)
+    return {"user_id": user_id, "days": require_history_store().get_daily_counts(stats_scope(user_id), days=days)}
+
 @app.exception_handler(Exception)
 async def general_exception_handler(request, exc):
     """General exception handler"""
-    logger.error(f"Unhandled exception: {exc}")
+    logger.error("Unhandled exception: %s", exc, exc_info=exc)
     return JSONResponse(
         status_code=500,
         content=ErrorResponse(
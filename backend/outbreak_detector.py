@@ -0,0 +1,207 @@
+"""Streaming outbreak detection over the prediction stream.
+
+Each (disease, region) key keeps a ring of per-bucket counts covering the
+sliding window plus an exponentially weighted baseline of the per-bucket
+rate. Observing an event is O(1) amortized and memory is bounded by
+max_keys * window buckets.
+
+A key alerts only once its baseline covers warmup_buckets observed
+buckets. Buckets the detector ran through before a key's first event
+count as zeros; slots from before the detector started are never folded
+in, so after a restart nothing alerts until a real baseline exists.
+Events older than the window are dropped rather than written into a
+reused slot.
+"""
+import math
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Optional, List, Dict, NamedTuple
+
+GLOBAL_REGION = "global"
+
+class OutbreakAlert(NamedTuple):
+    disease: str
+    region: str
+    window_count: int
+    expected_count: float
+    window_seconds: int
+    users: int
+    detected_at: float
+
+class _KeyState:
+    __slots__ = ("ring", "window_count", "last_bucket", "baseline_mean", "baseline_var", "baseline_buckets",
+                 "last_alert_at", "users")
+
+    def __init__(self, buckets: int, bucket_id: int, baseline_buckets: int = 0):
+        self.ring = [0] * buckets
+        self.window_count = 0
+        self.last_bucket = bucket_id
+        self.baseline_mean = 0.0
+        self.baseline_var = 0.0
+        self.baseline_buckets = baseline_buckets  # Completed buckets the baseline has seen
+        self.last_alert_at = 0.0
+        self.users = OrderedDict()  # user_id -> last bucket seen, bounded
+
+class OutbreakDetector:
+    """Sliding-window counters per disease/region with spike detection against a baseline"""
+
+    def __init__(self, window_seconds: int = 3600, bucket_seconds: int = 60,
+                 min_events: int = 10, z_threshold: float = 4.0, min_ratio: float = 3.0,
+                 baseline_alpha: float = 0.01, cooldown_seconds: int = 3600,
+                 max_keys: int = 10000, max_users_per_key: int = 256, warmup_buckets: Optional[int] = None):
+        if window_seconds % bucket_seconds:
+            raise ValueError("window_seconds must be a multiple of bucket_seconds")
+        self.window_seconds = window_seconds
+        self.bucket_seconds = bucket_seconds
+        self.buckets = window_seconds // bucket_seconds
+        self.min_events = min_events
+        self.z_threshold = z_threshold
+        self.min_ratio = min_ratio
+        self.baseline_alpha = baseline_alpha
+        self.cooldown_seconds = cooldown_seconds
+        self.max_keys = max_keys
+        self.max_users_per_key = max_users_per_key
+        self.warmup_buckets = self.buckets if warmup_buckets is None else warmup_buckets
+        self._started_bucket: Optional[int] = None  # First bucket the detector saw
+        self._latest_bucket: Optional[int] = None
+        self._keys: "OrderedDict[tuple, _KeyState]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.recent_alerts = deque(maxlen=50)
+        self.events_observed = 0
+        self.events_dropped = 0
+
+    def _advance(self, state: _KeyState, bucket_id: int):
+        """Roll the window forward, folding buckets that leave it into the baseline
+
+        Slots for buckets before the detector started were never observed and
+        are not folded in.
+        """
+        gap = bucket_id - state.last_bucket
+        if gap <= 0:
+            return
+        first_expired = state.last_bucket - self.buckets + 1
+        if gap >= self.buckets:
+            # Everything in the window expired; fold in its buckets, then decay over the empty ones
+            for expired_bucket in range(first_expired, state.last_bucket + 1):
+                if expired_bucket >= self._started_bucket:
+                    self._update_baseline(state, state.ring[expired_bucket % self.buckets])
+            empty = gap - self.buckets
+            decay = (1 - self.baseline_alpha) ** empty
+            state.baseline_mean *= decay
+            state.baseline_var *= decay
+            state.baseline_buckets += empty
+            state.ring = [0] * self.buckets
+            state.window_count = 0
+        else:
+            for step in range(gap):
+                slot = (state.last_bucket + 1 + step) % self.buckets
+                expired = state.ring[slot]
+                if first_expired + step >= self._started_bucket:
+                    self._update_baseline(state, expired)
+                state.window_count -= expired
+                state.ring[slot] = 0
+        state.last_bucket = bucket_id
+
+    def _update_baseline(self, state: _KeyState, count: int):
+        """Exponentially weighted mean and variance of per-bucket counts"""
+        alpha = self.baseline_alpha
+        delta = count - state.baseline_mean
+        state.baseline_mean += alpha * delta
+        state.baseline_var = (1 - alpha) * (state.baseline_var + alpha * delta * delta)
+        state.baseline_buckets += 1
+
+    def _baseline(self, state: _KeyState):
+        """Per-bucket mean and variance, corrected for the EWMA's start at zero"""
+        if not state.baseline_buckets:
+            return 0.0, 0.0
+        correction = 1 - (1 - self.baseline_alpha) ** state.baseline_buckets
+        return state.baseline_mean / correction, state.baseline_var / correction
+
+    def _get_state(self, key: tuple, bucket_id: int) -> _KeyState:
+        state = self._keys.get(key)
+        if state is None:
+            # Buckets the detector ran through before the key's window held no events for it
+            state = _KeyState(self.buckets, bucket_id, max(0, bucket_id - self.buckets + 1 - self._started_bucket))
+            self._keys[key] = state
+            if len(self._keys) > self.max_keys:
+                self._keys.popitem(last=False)  # Evict least recently seen key
+        else:
+            self._keys.move_to_end(key)
+        return state
+
+    def observe(self, disease: str, region: Optional[str] = None, user_id: Optional[str] = None,
+                timestamp: Optional[float] = None) -> Optional[OutbreakAlert]:
+        """Count one detection; returns an alert the first time a key spikes above its baseline"""
+        timestamp = time.time() if timestamp is None else timestamp
+        bucket_id = int(timestamp // self.bucket_seconds)
+        key = (disease, region or GLOBAL_REGION)
+
+        with self._lock:
+            self.events_observed += 1
+            if self._started_bucket is None:
+                self._started_bucket = self._latest_bucket = bucket_id
+            known = self._keys.get(key)
+            newest_bucket = max(self._latest_bucket, known.last_bucket if known else bucket_id)
+            if bucket_id <= newest_bucket - self.buckets:
+                self.events_dropped += 1  # Older than the window; its ring slot already holds a newer bucket
+                return None
+            self._latest_bucket = max(self._latest_bucket, bucket_id)
+            state = self._get_state(key, bucket_id)
+            self._advance(state, bucket_id)
+            state.ring[bucket_id % self.buckets] += 1
+            state.window_count += 1
+            if user_id:
+                state.users[user_id] = bucket_id
+                state.users.move_to_end(user_id)
+                if len(state.users) > self.max_users_per_key:
+                    state.users.popitem(last=False)
+
+            mean, variance = self._baseline(state)
+            expected = mean * self.buckets
+            spread = math.sqrt(variance * self.buckets + max(expected, 1.0))
+            is_spike = (
+                state.baseline_buckets >= self.warmup_buckets
+                and state.window_count >= self.min_events
+                and state.window_count >= self.min_ratio * expected
+                and state.window_count > expected + self.z_threshold * spread
+            )
+            if not is_spike or timestamp - state.last_alert_at < self.cooldown_seconds:
+                return None
+
+            state.last_alert_at = timestamp
+            oldest_bucket = bucket_id - self.buckets + 1
+            active_users = sum(1 for seen in state.users.values() if seen >= oldest_bucket)
+            alert = OutbreakAlert(
+                disease=disease,
+                region=key[1],
+                window_count=state.window_count,
+                expected_count=round(expected, 2),
+                window_seconds=self.window_seconds,
+                users=active_users,
+                detected_at=timestamp
+            )
+            self.recent_alerts.append(alert)
+            return alert
+
+    def hotspots(self, limit: int = 10, now: Optional[float] = None) -> List[Dict]:
+        """Keys with the most detections in the current window"""
+        now = time.time() if now is None else now
+        bucket_id = int(now // self.bucket_seconds)
+        with self._lock:
+            for state in self._keys.values():
+                self._advance(state, bucket_id)
+            ranked = sorted(
+                ((key, state) for key, state in self._keys.items() if state.window_count),
+                key=lambda item: item[1].window_count,
+                reverse=True
+            )[:limit]
+            return [
+                {
+                    "disease": key[0],
+                    "region": key[1],
+                    "window_count": state.window_count,
+                    "expected_count": round(self._baseline(state)[0] * self.buckets, 2)
+                }
+                for key, state in ranked
+            ]
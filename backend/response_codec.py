@@ -0,0 +1,114 @@
+"""Response negotiation for bandwidth-constrained clients.
+
+JSON bodies can be re-encoded as MessagePack or CBOR when the client lists
+one of them in Accept, compressed with brotli or gzip above a size
+threshold, and tagged with a weak ETag so unchanged resources are answered
+with 304 Not Modified. msgpack, cbor2 and brotli are optional: without them
+responses stay JSON and compression falls back to gzip.
+"""
+import gzip
+import hashlib
+import json
+from typing import Any, List, Optional, Tuple
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+try:
+    import cbor2
+except ImportError:
+    cbor2 = None
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+JSON_MEDIA_TYPE = "application/json"
+MSGPACK_MEDIA_TYPES = ("application/msgpack", "application/x-msgpack", "application/vnd.msgpack")
+CBOR_MEDIA_TYPE = "application/cbor"
+
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5  # Close to gzip -9 in size at a fraction of brotli's default cost
+
+def binary_media_types() -> List[str]:
+    """Binary media types whose encoder is installed"""
+    types = list(MSGPACK_MEDIA_TYPES) if msgpack else []
+    if cbor2:
+        types.append(CBOR_MEDIA_TYPE)
+    return types
+
+def parse_quality_list(header: Optional[str]) -> List[Tuple[str, float]]:
+    """Tokens of an Accept or Accept-Encoding header with their q-values, best first"""
+    entries = []
+    for position, part in enumerate((header or "").split(",")):
+        token, *params = [piece.strip() for piece in part.split(";")]
+        if not token:
+            continue
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        entries.append((quality, position, token.lower()))
+    entries.sort(key=lambda entry: (-entry[0], entry[1]))
+    return [(token, quality) for quality, _, token in entries]
+
+def negotiate_media_type(accept: Optional[str]) -> str:
+    """Binary media type the client prefers over JSON, or JSON
+
+    Wildcards resolve to JSON so existing clients are unaffected.
+    """
+    available = binary_media_types()
+    for token, quality in parse_quality_list(accept):
+        if quality <= 0:
+            continue
+        if token in available:
+            return token
+        if token in (JSON_MEDIA_TYPE, "application/*", "*/*"):
+            return JSON_MEDIA_TYPE
+    return JSON_MEDIA_TYPE
+
+def negotiate_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    """Preferred supported content coding ("br" or "gzip"), or None for identity"""
+    supported = ["br", "gzip"] if brotli else ["gzip"]
+    for token, quality in parse_quality_list(accept_encoding):
+        if quality <= 0:
+            continue
+        if token in supported:
+            return token
+        if token == "*":
+            return supported[0]
+    return None
+
+def encode(data: Any, media_type: str) -> bytes:
+    if media_type in MSGPACK_MEDIA_TYPES:
+        return msgpack.packb(data, use_bin_type=True)
+    if media_type == CBOR_MEDIA_TYPE:
+        return cbor2.dumps(data)
+    return json.dumps(data, separators=(",", ":")).encode("utf-8")
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL)
+
+def weak_etag(body: bytes) -> str:
+    """Weak validator for a JSON body, shared by its binary and compressed representations"""
+    return f'W/"{hashlib.blake2b(body, digest_size=12).hexdigest()}"'
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """If-None-Match comparison; weak comparison as RFC 9110 requires for GET"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    opaque = etag[2:] if etag.startswith("W/") else etag
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if (candidate[2:] if candidate.startswith("W/") else candidate) == opaque:
+            return True
+    return False
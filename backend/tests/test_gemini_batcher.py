@@ -0,0 +1,87 @@
+import asyncio
+from typing import List, Optional
+
+from gemini_batcher import BatchParseError, GeminiBatcher
+
+class FakeModel:
+    """Stands in for Gemini: batch replies leave out the images in drop and take delay seconds"""
+
+    def __init__(self, drop=(), delay: float = 0.0):
+        self.batches: List[List[str]] = []
+        self.singles: List[str] = []
+        self.drop = set(drop)
+        self.delay = delay
+
+    async def call_batch(self, images: List[str]) -> List[Optional[dict]]:
+        self.batches.append(list(images))
+        await asyncio.sleep(self.delay)
+        partial = {i: {"disease": f"batch:{image}"} for i, image in enumerate(images) if image not in self.drop}
+        if len(partial) < len(images):
+            raise BatchParseError(f"{len(images) - len(partial)} entries missing", partial=partial)
+        return [partial[i] for i in range(len(images))]
+
+    async def call_single(self, image: str) -> Optional[dict]:
+        self.singles.append(image)
+        return {"disease": f"single:{image}"}
+
+def run_batch(model: FakeModel, images: List[str], **options) -> List[Optional[dict]]:
+    """Submit images concurrently to a fresh batcher and return their results in order"""
+    options.setdefault("window_seconds", 0.05)
+
+    async def submit_all():
+        batcher = GeminiBatcher(model.call_batch, model.call_single, **options)
+        return await asyncio.gather(*(batcher.submit(image) for image in images))
+    return asyncio.run(submit_all())
+
+def diseases(results: List[Optional[dict]]) -> List[str]:
+    return [result["disease"] for result in results]
+
+def test_full_batch_is_one_call_and_maps_back_in_order():
+    model = FakeModel()
+    results = run_batch(model, [f"img{i}" for i in range(4)], max_batch=4)
+    assert model.batches == [["img0", "img1", "img2", "img3"]]
+    assert model.singles == []
+    assert diseases(results) == [f"batch:img{i}" for i in range(4)]
+
+def test_window_flush_dispatches_a_partial_batch():
+    model = FakeModel()
+    results = run_batch(model, ["a", "b", "c"], max_batch=8)
+    assert model.batches == [["a", "b", "c"]]
+    assert diseases(results) == ["batch:a", "batch:b", "batch:c"]
+
+def test_lone_image_uses_a_single_call():
+    model = FakeModel()
+    assert run_batch(model, ["alone"]) == [{"disease": "single:alone"}]
+    assert model.batches == []
+    assert model.singles == ["alone"]
+
+def test_partial_reply_retries_only_missing_images():
+    model = FakeModel(drop={"b1"})
+    results = run_batch(model, ["b0", "b1", "b2"], max_batch=3)
+    assert model.singles == ["b1"]
+    assert diseases(results) == ["batch:b0", "single:b1", "batch:b2"]
+
+def test_unattributable_reply_falls_back_for_every_image():
+    model = FakeModel(drop={"c0", "c1"})
+    results = run_batch(model, ["c0", "c1"], max_batch=2)
+    assert model.singles == ["c0", "c1"]
+    assert diseases(results) == ["single:c0", "single:c1"]
+
+def test_timed_out_batch_falls_back_to_single_calls():
+    model = FakeModel(delay=1.0)
+    results = run_batch(model, ["slow0", "slow1"], max_batch=2, timeout_seconds=0.1)
+    assert model.singles == ["slow0", "slow1"]
+    assert diseases(results) == ["single:slow0", "single:slow1"]
+
+def test_failing_batch_resolves_every_image_to_none():
+    async def broken_batch(images):
+        raise RuntimeError("upstream error")
+
+    async def submit_all():
+        batcher = GeminiBatcher(broken_batch, FakeModel().call_single, window_seconds=0.05, max_batch=2)
+        return await asyncio.gather(batcher.submit("x"), batcher.submit("y")), batcher.stats()
+
+    results, stats = asyncio.run(submit_all())
+    assert results == [None, None]
+    assert stats["batch_calls"] == 1
+    assert stats["fallback_calls"] == 0
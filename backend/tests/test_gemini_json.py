@@ -0,0 +1,90 @@
+import json
+from typing import List
+
+import pytest
+from pydantic import BaseModel
+
+from gemini_json import StructuredOutputError, extract_json, parse_model, repair_json
+
+def repaired(text: str, opener: str = "{["):
+    return json.loads(repair_json(text, opener))
+
+def test_valid_json_is_returned_unchanged():
+    text = '{"disease": "Leaf Mold", "confidence": 0.8}'
+    assert repair_json(text) == text
+
+def test_prose_and_code_fences_are_skipped():
+    text = 'Here is the result:\n```json\n{"disease": "Leaf Mold"}\n```\nHope this helps.'
+    assert repaired(text) == {"disease": "Leaf Mold"}
+
+def test_raw_newlines_and_tabs_in_strings_are_escaped():
+    assert repaired('{"notes": "line one\nline two\tend"}') == {"notes": "line one\nline two\tend"}
+
+def test_trailing_commas_are_dropped():
+    assert repaired('{"items": [1, 2, 3,], "name": "x",}') == {"items": [1, 2, 3], "name": "x"}
+
+def test_python_literals_are_converted():
+    assert repaired('{"a": True, "b": False, "c": None}') == {"a": True, "b": False, "c": None}
+
+def test_literal_words_inside_strings_are_kept():
+    assert repaired('{"note": "None of the leaves; True rot"}') == {"note": "None of the leaves; True rot"}
+
+def test_escaped_quotes_do_not_end_the_string():
+    assert repaired(r'{"quote": "the \"white\" spots", "n": 1}') == {"quote": 'the "white" spots', "n": 1}
+
+def test_text_after_the_first_value_is_ignored():
+    assert repaired('{"a": 1} {"b": 2}') == {"a": 1}
+
+def test_truncated_string_is_closed():
+    assert repaired('{"disease": "Leaf Mold", "notes": "spreads in hum') == {
+        "disease": "Leaf Mold", "notes": "spreads in hum"
+    }
+
+def test_truncated_key_backs_off_to_the_last_complete_value():
+    assert repaired('{"disease": "Leaf Mold", "confidence": 0.8, "treat') == {
+        "disease": "Leaf Mold", "confidence": 0.8
+    }
+
+def test_dangling_colon_becomes_null():
+    assert repaired('{"disease": "Leaf Mold", "notes":') == {"disease": "Leaf Mold", "notes": None}
+
+def test_truncated_nested_array_is_closed():
+    assert repaired('[{"index": 0, "disease": "A"}, {"index": 1, "disease": "B"}, {"index": 2, "dis') == [
+        {"index": 0, "disease": "A"}, {"index": 1, "disease": "B"}, {"index": 2}
+    ]
+
+def test_truncated_reply_ending_in_a_code_fence_is_closed():
+    assert repaired('```json\n{"symptoms": ["spots", "wilting"\n```') == {"symptoms": ["spots", "wilting"]}
+
+def test_opener_selects_an_array_over_a_leading_object():
+    assert repaired('{"meta": 1} [1, 2]', opener="[") == [1, 2]
+
+def test_reply_without_json_is_rejected():
+    with pytest.raises(StructuredOutputError):
+        repair_json("Sorry, I cannot identify this plant.")
+
+def test_extract_json_unwraps_a_single_wrapped_array():
+    assert extract_json('{"results": [{"index": 0}]}', list) == [{"index": 0}]
+
+def test_extract_json_rejects_the_wrong_type():
+    with pytest.raises(StructuredOutputError):
+        extract_json('"just a string" {"a": 1}', list)
+
+class Treatment(BaseModel):
+    name: str
+    side_effects: List[str]
+
+class Diagnosis(BaseModel):
+    disease: str
+    treatments: List[Treatment]
+
+def test_parse_model_coerces_near_misses():
+    reply = '{"Disease": "Leaf Mold", "treatments": {"name": "Copper", "Side Effects": "leaf burn"}}'
+    diagnosis = parse_model(reply, Diagnosis)
+    assert diagnosis.disease == "Leaf Mold"
+    assert diagnosis.treatments[0].side_effects == ["leaf burn"]
+
+def test_parse_model_names_missing_fields():
+    with pytest.raises(StructuredOutputError) as error:
+        parse_model('{"treatments": [{"name": "Copper"}]}', Diagnosis)
+    assert error.value.problems == ["disease", "treatments[0].side_effects"]
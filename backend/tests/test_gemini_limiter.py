@@ -0,0 +1,74 @@
+from gemini_limiter import DAY_SECONDS, GeminiRateLimiter, is_rate_limit_error
+
+class FakeClock:
+    def __init__(self, now: float):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+def make_limiter(now: float = 10 * DAY_SECONDS + 3600, **options):
+    clock = FakeClock(now)
+    return GeminiRateLimiter(clock=clock, **options), clock
+
+def test_minute_budget_refills_over_time():
+    limiter, clock = make_limiter(rpm=2, rpd=0)
+    assert limiter.try_acquire() and limiter.try_acquire()
+    assert not limiter.try_acquire()
+    assert limiter.status()["blocked_reason"] == "minute budget"
+    clock.now += 30  # Half a minute refills one of two tokens
+    assert limiter.try_acquire()
+    assert not limiter.try_acquire()
+
+def test_daily_budget_rolls_over_at_midnight_utc():
+    limiter, clock = make_limiter(rpm=0, rpd=2)
+    assert limiter.try_acquire(2)
+    assert not limiter.available()
+    assert limiter.status()["blocked_reason"] == "daily budget"
+    clock.now = 11 * DAY_SECONDS
+    assert limiter.try_acquire()
+    assert limiter.status()["day_used"] == 1
+
+def test_retry_hint_sets_the_cooldown():
+    limiter, clock = make_limiter(rpm=0, rpd=0, cooldown_seconds=60)
+    limiter.record_rate_limited(Exception("429 Resource exhausted. Please retry in 12.5s"))
+    assert not limiter.try_acquire()
+    assert limiter.status()["blocked_reason"] == "cooldown"
+    clock.now += 12
+    assert not limiter.available()
+    clock.now += 1
+    assert limiter.try_acquire()
+
+def test_default_cooldown_without_a_hint():
+    limiter, clock = make_limiter(rpm=0, rpd=0, cooldown_seconds=60)
+    limiter.record_rate_limited(Exception("429 rate limit"))
+    clock.now += 59
+    assert not limiter.available()
+    clock.now += 1
+    assert limiter.available()
+
+def test_per_day_quota_cools_down_until_the_utc_rollover():
+    limiter, clock = make_limiter(now=10 * DAY_SECONDS + 3600, rpm=15, rpd=1500, cooldown_seconds=60)
+    limiter.record_rate_limited(Exception(
+        "429 Quota exceeded for metric: generate_content_free_tier_requests, "
+        "quotaId: GenerateRequestsPerDayPerProjectPerModel-FreeTier. retry_delay { seconds: 20 }"
+    ))
+    assert limiter.status()["cooldown_remaining_seconds"] == DAY_SECONDS - 3600
+    clock.now += 60
+    assert not limiter.try_acquire()
+    clock.now = 11 * DAY_SECONDS - 1
+    assert not limiter.available()
+    clock.now = 11 * DAY_SECONDS
+    assert limiter.try_acquire()
+
+def test_per_day_quota_keeps_a_longer_cooldown():
+    limiter, clock = make_limiter(rpm=0, rpd=0)
+    limiter.record_rate_limited(Exception("quota PerDay exceeded"))
+    limiter.record_rate_limited(Exception("429 retry in 5s"))
+    clock.now += 60
+    assert limiter.status()["blocked_reason"] == "cooldown"
+
+def test_rate_limit_errors_are_recognised():
+    assert is_rate_limit_error(Exception("429 Too Many Requests"))
+    assert is_rate_limit_error(Exception("RESOURCE_EXHAUSTED"))
+    assert not is_rate_limit_error(Exception("500 Internal error"))
@@ -0,0 +1,54 @@
+from datetime import datetime
+
+import pytest
+
+from history_store import ALL_USERS, HistoryStore
+
+@pytest.fixture
+def store(tmp_path):
+    store = HistoryStore(str(tmp_path / "history.db"))
+    yield store
+    store.close()
+
+def record(store: HistoryStore, user_id: str, disease: str, healthy: bool = False, day: int = 1):
+    return store.record_scan(user_id, disease, 0.9, "layer1", healthy, created_at=datetime(2024, 5, day, 12))
+
+def test_each_scan_counts_once_per_user_and_once_overall(store):
+    record(store, "alice", "Leaf Mold")
+    record(store, "alice", "Tomato Healthy", healthy=True)
+    record(store, "bob", "Leaf Mold", day=2)
+
+    assert store.get_summary("alice")["total_scans"] == 2
+    assert store.get_summary("bob")["total_scans"] == 1
+    overall = store.get_summary()
+    assert overall["total_scans"] == 3
+    assert overall["diseased_scans"] == 2
+    assert overall["healthy_scans"] == 1
+    assert store.get_disease_counts() == {"Leaf Mold": 2, "Tomato Healthy": 1}
+    assert store.get_daily_counts() == [
+        {"day": "2024-05-01", "total": 2, "diseased": 1},
+        {"day": "2024-05-02", "total": 1, "diseased": 1}
+    ]
+
+def test_all_users_id_is_rejected_for_writes(store):
+    record(store, "alice", "Leaf Mold")
+    with pytest.raises(ValueError):
+        record(store, ALL_USERS, "Leaf Mold")
+    # Nothing was written, so the overall aggregates are not counted twice
+    assert store.get_summary()["total_scans"] == 1
+    assert store.get_disease_counts() == {"Leaf Mold": 1}
+    assert store.get_recent_scans(ALL_USERS) == []
+
+def test_recent_scans_are_per_user_newest_first(store):
+    record(store, "alice", "Leaf Mold", day=1)
+    record(store, "alice", "Early Blight", day=3)
+    record(store, "bob", "Late Blight", day=2)
+    scans = store.get_recent_scans("alice")
+    assert [scan["disease"] for scan in scans] == ["Early Blight", "Leaf Mold"]
+    assert scans[0]["healthy"] is False
+
+def test_unknown_user_has_empty_aggregates(store):
+    assert store.get_summary("nobody") == {
+        "user_id": "nobody", "total_scans": 0, "diseased_scans": 0, "healthy_scans": 0, "disease_rate": 0.0
+    }
+    assert store.get_disease_counts("nobody") == {}
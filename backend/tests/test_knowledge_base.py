@@ -0,0 +1,73 @@
+import pytest
+
+from knowledge_base import KnowledgeBase, compile_knowledge_base, source_digest
+
+LABELS = ["Tomato___Leaf_Mold", "Tomato___Late_blight", "Potato___Late_blight", "Tomato___healthy"]
+SOLUTIONS = {
+    "Tomato leaf mold": "Improve air circulation and apply a fungicide.",
+    "Tomato late blight": "Remove infected plants; there is no cure.",
+    "Potato late blight": "Destroy infected tubers and spray copper.",
+    "Tomato healthy": "No action needed.",
+    "background": "No plant detected."
+}
+DETAILS = {
+    "causes": {"details": "Fungus"},
+    "prevention": {"measures": ["Ventilate"]},
+    "treatment": {"stages": [{"name": "Early", "description": "Spray", "components": [], "medications": []}]},
+    "emergency": {"action": "Isolate", "signs": []},
+    "recovery": {"timeline": "2 weeks", "success_rate": "High"},
+    "medications": [{"name": "Copper", "dosage": "2 g/l", "frequency": "Weekly", "side_effects": []}]
+}
+
+def compile_kb(solutions=SOLUTIONS, enrichments=None) -> KnowledgeBase:
+    return KnowledgeBase(compile_knowledge_base(LABELS, solutions, enrichments))
+
+def test_records_are_index_aligned_with_the_labels():
+    knowledge = compile_kb()
+    assert knowledge.labels == LABELS
+    assert [record["id"] for record in knowledge.records] == list(range(5))
+    assert knowledge.records[4]["solution_key"] == "background"
+    assert knowledge.records[1]["severity"] == "high"
+    assert knowledge.records[3]["healthy"]
+
+def test_label_without_a_solution_fails():
+    with pytest.raises(ValueError):
+        KnowledgeBase(compile_knowledge_base(LABELS + ["Corn___rust"], SOLUTIONS))
+
+def test_only_renderable_enrichments_for_known_classes_are_bundled():
+    knowledge = compile_kb(enrichments={
+        "Tomato Leaf Mold": DETAILS,
+        "COVID-19": DETAILS,
+        "Tomato late blight": {"causes": {"details": "incomplete"}}
+    })
+    assert knowledge.enrichments() == {"Tomato - Leaf Mold": DETAILS}
+    assert knowledge.details("leaf mold") == DETAILS
+
+def test_source_digest_tracks_labels_and_solutions():
+    knowledge = compile_kb()
+    assert knowledge.sources == source_digest(LABELS, SOLUTIONS)
+    edited = dict(SOLUTIONS, background="Nothing to classify.")
+    assert source_digest(LABELS, edited) != knowledge.sources
+    assert source_digest(LABELS[::-1], SOLUTIONS) != knowledge.sources
+
+def test_save_and_load_round_trip(tmp_path):
+    knowledge = compile_kb(enrichments={"Tomato Leaf Mold": DETAILS})
+    path = str(tmp_path / "knowledge_base.json.gz")
+    knowledge.save(path)
+    loaded = KnowledgeBase.load(path)
+    assert (loaded.version, loaded.sources) == (knowledge.version, knowledge.sources)
+    assert loaded.enrichments() == knowledge.enrichments()
+
+def test_ambiguous_aliases_are_not_resolved():
+    knowledge = compile_kb()
+    assert knowledge.find("leaf mold") == 0
+    assert knowledge.find("late blight", fuzzy=False) is None  # Tomato or potato
+    assert knowledge.find("[Universal] Tomato Late Blight") == 1
+
+def test_fuzzy_find_and_search_rank_by_trigram_similarity():
+    knowledge = compile_kb()
+    assert knowledge.find("tomato leaf mould") == 0
+    assert knowledge.find("something else entirely") is None
+    matches = knowledge.search("potato blight")
+    assert matches[0].record_id == 2
+    assert knowledge.search("copper")[0].record_id == 2  # Solution text matches count too
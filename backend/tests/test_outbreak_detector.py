@@ -0,0 +1,85 @@
+import pytest
+
+from outbreak_detector import GLOBAL_REGION, OutbreakDetector
+
+BUCKET = 60
+START = 1_000_000 * BUCKET
+
+def make_detector(**options) -> OutbreakDetector:
+    # 10 one-minute buckets per window; no cooldown so every spiking event would alert
+    options.setdefault("min_events", 10)
+    options.setdefault("cooldown_seconds", 0)
+    return OutbreakDetector(window_seconds=10 * BUCKET, bucket_seconds=BUCKET, baseline_alpha=0.1, **options)
+
+def observe_steady(detector: OutbreakDetector, minutes: int, per_minute: int = 1, start: float = START,
+                   disease: str = "Leaf Mold", region: str = "north"):
+    """Feed per_minute events into each of the given minutes; returns the alerts raised"""
+    alerts = []
+    for minute in range(minutes):
+        for i in range(per_minute):
+            alert = detector.observe(disease, region, f"user{i}", start + minute * BUCKET + i)
+            if alert:
+                alerts.append(alert)
+    return alerts
+
+def observe_burst(detector: OutbreakDetector, count: int, timestamp: float,
+                  disease: str = "Leaf Mold", region: str = "north"):
+    alerts = (detector.observe(disease, region, f"burst{i}", timestamp) for i in range(count))
+    return [alert for alert in alerts if alert]
+
+def test_cold_start_burst_does_not_alert():
+    detector = make_detector()
+    assert observe_burst(detector, 50, START) == []
+
+def test_burst_before_warmup_completes_does_not_alert():
+    detector = make_detector()
+    observe_steady(detector, 15)  # Only 5 buckets have left the window so far
+    assert observe_burst(detector, 50, START + 15 * BUCKET) == []
+
+def test_steady_traffic_never_alerts():
+    detector = make_detector()
+    assert observe_steady(detector, 120, per_minute=3) == []
+
+def test_spike_after_warmup_alerts_once_per_cooldown():
+    detector = make_detector(cooldown_seconds=3600)
+    observe_steady(detector, 40)
+    alerts = observe_burst(detector, 40, START + 40 * BUCKET)
+    assert len(alerts) == 1
+    alert = alerts[0]
+    assert (alert.disease, alert.region) == ("Leaf Mold", "north")
+    assert alert.window_count >= 10
+    assert alert.expected_count == pytest.approx(10, rel=0.2)  # One event per minute over ten minutes
+    assert alert.users >= 2
+
+def test_key_first_seen_late_inherits_the_detector_history():
+    detector = make_detector()
+    observe_steady(detector, 40, disease="Early Blight")
+    # The detector has run for 40 buckets; zeros for the new key count towards its warm-up
+    alerts = observe_burst(detector, 30, START + 40 * BUCKET, disease="Late Blight")
+    assert alerts[0].window_count == 10  # Alerts as soon as min_events is reached
+    assert alerts[0].expected_count == pytest.approx(0.0, abs=0.5)
+
+def test_events_older_than_the_window_are_dropped():
+    detector = make_detector()
+    observe_steady(detector, 20)
+    assert detector.observe("Leaf Mold", "north", timestamp=START + 5 * BUCKET) is None
+    assert detector.observe("Leaf Mold", "south", timestamp=START + 5 * BUCKET) is None
+    assert detector.events_dropped == 2
+    hotspot = detector.hotspots(now=START + 19 * BUCKET)[0]
+    assert hotspot["window_count"] == 10  # The stale events did not land in reused slots
+
+def test_late_events_inside_the_window_are_counted():
+    detector = make_detector()
+    observe_steady(detector, 20)
+    detector.observe("Leaf Mold", "north", timestamp=START + 15 * BUCKET)
+    assert detector.events_dropped == 0
+    assert detector.hotspots(now=START + 19 * BUCKET)[0]["window_count"] == 11
+
+def test_events_without_region_use_the_global_key():
+    detector = make_detector()
+    detector.observe("Leaf Mold", timestamp=START)
+    assert detector.hotspots(now=START)[0]["region"] == GLOBAL_REGION
+
+def test_window_must_be_a_whole_number_of_buckets():
+    with pytest.raises(ValueError):
+        OutbreakDetector(window_seconds=100, bucket_seconds=60)
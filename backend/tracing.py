@@ -0,0 +1,316 @@
+"""Lightweight request tracing: per-stage spans, tail-based sampling and export.
+
+Every request gets an id (its X-Request-ID when valid) held in a context
+variable of its own, so log lines and queued jobs carry it whether or not
+tracing is enabled. A trace is opened per request (keyed by that id) and stages wrap
+themselves in span(); spans opened outside a trace are no-ops, so the same
+code runs untraced in the offline tools. The keep-or-drop decision is made
+when the trace finishes: errors and requests slower than slow_ms are always
+kept, the rest are sampled. Kept traces are written by a background thread
+as JSON lines (one trace per line) or as OTLP/JSON, to a file or an OTLP
+HTTP collector, so exporting never blocks a request.
+"""
+import functools
+import inspect
+import json
+import logging
+import queue
+import random
+import re
+import threading
+import time
+import urllib.request
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+REQUEST_ID_PATTERN = re.compile(r"^[A-Za-z0-9._\-]{1,64}$")
+EXPORT_QUEUE_SIZE = 1000  # Traces waiting for export; further traces are dropped, not queued
+
+class Span:
+    __slots__ = ("name", "span_id", "parent_id", "start", "end", "attributes")
+
+    def __init__(self, name: str, parent_id: Optional[str], attributes: Dict):
+        self.name = name
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.start = time.time()
+        self.end: Optional[float] = None
+        self.attributes = attributes
+
+    @property
+    def duration_ms(self) -> float:
+        return ((self.end or time.time()) - self.start) * 1000
+
+class Trace:
+    def __init__(self, request_id: str, name: str):
+        self.request_id = request_id
+        self.trace_id = request_id if re.fullmatch(r"[0-9a-f]{32}", request_id) else uuid.uuid4().hex
+        self.root = Span(name, None, {})
+        self.spans: List[Span] = []
+        self.status_code: Optional[int] = None
+        self.error: Optional[str] = None
+
+    @property
+    def duration_ms(self) -> float:
+        return self.root.duration_ms
+
+    def to_dict(self) -> Dict:
+        return {
+            "request_id": self.request_id,
+            "trace_id": self.trace_id,
+            "name": self.root.name,
+            "start": self.root.start,
+            "duration_ms": round(self.duration_ms, 3),
+            "status_code": self.status_code,
+            "error": self.error,
+            "attributes": self.root.attributes,
+            "spans": [
+                {
+                    "name": span.name,
+                    "span_id": span.span_id,
+                    "parent_id": span.parent_id or self.root.span_id,
+                    "offset_ms": round((span.start - self.root.start) * 1000, 3),
+                    "duration_ms": round(span.duration_ms, 3),
+                    "attributes": span.attributes
+                }
+                for span in self.spans
+            ]
+        }
+
+_request_id: ContextVar[Optional[str]] = ContextVar("request_id", default=None)
+_current_trace: ContextVar[Optional[Trace]] = ContextVar("current_trace", default=None)
+_current_span: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+
+def current_request_id() -> Optional[str]:
+    return _request_id.get()
+
+@contextmanager
+def request_context(request_id: str):
+    """Make request_id current for the block, independently of any trace"""
+    token = _request_id.set(request_id)
+    try:
+        yield request_id
+    finally:
+        _request_id.reset(token)
+
+def new_request_id(candidate: Optional[str] = None) -> str:
+    """The client's request id when it is well formed, otherwise a fresh one"""
+    if candidate and REQUEST_ID_PATTERN.match(candidate):
+        return candidate
+    return uuid.uuid4().hex
+
+@contextmanager
+def span(name: str, **attributes):
+    """Time a stage of the current trace; does nothing outside a trace"""
+    trace = _current_trace.get()
+    if trace is None:
+        yield None
+        return
+    parent = _current_span.get()
+    current = Span(name, parent.span_id if parent else None, attributes)
+    token = _current_span.set(current)
+    try:
+        yield current
+    except Exception as e:
+        current.attributes["error"] = f"{type(e).__name__}: {e}"[:200]
+        raise
+    finally:
+        current.end = time.time()
+        _current_span.reset(token)
+        trace.spans.append(current)
+
+def traced(name: str):
+    """Decorator form of span() for sync and async functions"""
+    def decorate(func):
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with span(name):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+def set_attributes(**attributes):
+    """Attach attributes to the innermost open span (or the trace root)"""
+    current = _current_span.get()
+    trace = _current_trace.get()
+    if current is not None:
+        current.attributes.update(attributes)
+    elif trace is not None:
+        trace.root.attributes.update(attributes)
+
+class RequestIdFilter(logging.Filter):
+    """Adds request_id to every log record ("-" outside a request)"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = current_request_id() or "-"
+        return True
+
+def _otlp_value(value) -> Dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+def _otlp_attributes(attributes: Dict) -> List[Dict]:
+    return [{"key": key, "value": _otlp_value(value)} for key, value in attributes.items()]
+
+def _otlp_span(trace: Trace, span_: Span, parent_id: Optional[str]) -> Dict:
+    return {
+        "traceId": trace.trace_id,
+        "spanId": span_.span_id,
+        "parentSpanId": parent_id or "",
+        "name": span_.name,
+        "kind": 2 if parent_id is None else 1,  # SERVER for the root, INTERNAL for stages
+        "startTimeUnixNano": str(int(span_.start * 1e9)),
+        "endTimeUnixNano": str(int((span_.end or span_.start) * 1e9)),
+        "attributes": _otlp_attributes(span_.attributes),
+        "status": {"code": 2 if "error" in span_.attributes else 0}
+    }
+
+def to_otlp(traces: List[Trace], service_name: str) -> Dict:
+    """OTLP/JSON ExportTraceServiceRequest for a batch of traces"""
+    spans = []
+    for trace in traces:
+        root_attributes = dict(trace.root.attributes, **{"http.request_id": trace.request_id})
+        if trace.status_code is not None:
+            root_attributes["http.response.status_code"] = trace.status_code
+        root = Span(trace.root.name, None, root_attributes)
+        root.span_id, root.start, root.end = trace.root.span_id, trace.root.start, trace.root.end
+        if trace.error:
+            root.attributes["error"] = trace.error
+        spans.append(_otlp_span(trace, root, None))
+        spans.extend(_otlp_span(trace, span_, span_.parent_id or trace.root.span_id) for span_ in trace.spans)
+    return {
+        "resourceSpans": [{
+            "resource": {"attributes": _otlp_attributes({"service.name": service_name})},
+            "scopeSpans": [{"scope": {"name": "floraguard.tracing"}, "spans": spans}]
+        }]
+    }
+
+class TraceExporter:
+    """Writes kept traces from a background thread to a file and/or an OTLP HTTP endpoint
+
+    fmt "json" writes one trace per line; "otlp" writes one OTLP/JSON
+    request per line (the collector file exporter's layout).
+    """
+
+    def __init__(self, path: Optional[str] = None, fmt: str = "json", endpoint: Optional[str] = None,
+                 service_name: str = "floraguard-backend", batch_size: int = 32):
+        self.path = path
+        self.fmt = fmt
+        self.endpoint = endpoint
+        self.service_name = service_name
+        self.batch_size = batch_size
+        self.dropped = 0
+        self._queue: "queue.Queue[Trace]" = queue.Queue(maxsize=EXPORT_QUEUE_SIZE)
+        self._thread = threading.Thread(target=self._run, name="trace-exporter", daemon=True)
+        self._thread.start()
+
+    def submit(self, trace: Trace):
+        try:
+            self._queue.put_nowait(trace)
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._export(batch)
+            except Exception as e:
+                logger.warning("Trace export failed for %d trace(s): %s", len(batch), e)
+
+    def _export(self, batch: List[Trace]):
+        if self.path:
+            with open(self.path, "a", encoding="utf-8") as f:
+                if self.fmt == "otlp":
+                    f.write(json.dumps(to_otlp(batch, self.service_name)) + "\n")
+                else:
+                    f.writelines(json.dumps(trace.to_dict()) + "\n" for trace in batch)
+        if self.endpoint:
+            request = urllib.request.Request(
+                self.endpoint,
+                data=json.dumps(to_otlp(batch, self.service_name)).encode("utf-8"),
+                headers={"Content-Type": "application/json"},
+                method="POST"
+            )
+            urllib.request.urlopen(request, timeout=5).close()
+
+class Tracer:
+    """Starts traces and decides at the end which to keep (tail-based sampling)"""
+
+    def __init__(self, exporter: TraceExporter, sample_rate: float = 0.05, slow_ms: float = 2000.0):
+        self.exporter = exporter
+        self.sample_rate = sample_rate
+        self.slow_ms = slow_ms
+        self.started = 0
+        self.kept = 0
+
+    def start(self, request_id: str, name: str) -> Trace:
+        """Open a trace and make it current for this context"""
+        self.started += 1
+        trace = Trace(request_id, name)
+        _current_trace.set(trace)
+        _current_span.set(None)
+        return trace
+
+    def detach(self):
+        """Clear the current trace once its response has been handed off"""
+        _current_trace.set(None)
+        _current_span.set(None)
+
+    def finish(self, trace: Trace, status_code: Optional[int] = None, error: Optional[str] = None):
+        if trace.root.end is not None:
+            return
+        trace.root.end = time.time()
+        trace.status_code = status_code
+        trace.error = error
+        keep = (error is not None or (status_code or 0) >= 500 or trace.duration_ms >= self.slow_ms
+                or random.random() < self.sample_rate)
+        if keep:
+            self.kept += 1
+            self.exporter.submit(trace)
+
+    @contextmanager
+    def trace(self, request_id: str, name: str):
+        """Trace a unit of work outside the HTTP middleware (e.g. a background job)"""
+        previous = (_current_trace.get(), _current_span.get())
+        trace = self.start(request_id, name)
+        try:
+            yield trace
+        except Exception as e:
+            self.finish(trace, error=f"{type(e).__name__}: {e}"[:200])
+            raise
+        else:
+            self.finish(trace)
+        finally:
+            _current_trace.set(previous[0])
+            _current_span.set(previous[1])
+
+    def stats(self) -> Dict:
+        return {
+            "started": self.started,
+            "kept": self.kept,
+            "dropped": self.exporter.dropped,
+            "sample_rate": self.sample_rate,
+            "slow_ms": self.slow_ms
+        }
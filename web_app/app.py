@@ -1,5 +1,7 @@
 import streamlit as st
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import json
 import io
 from PIL import Image
@@ -7,8 +9,17 @@ import time
 from typing import Optional, Dict, Any
 from fpdf import FPDF
 import base64
+import gzip
+import hashlib
 from datetime import datetime
 import os
+import re
+import random
+import tempfile
+import uuid
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
 
 # Set page config
 st.set_page_config(
@@ -21,13 +32,61 @@ st.set_page_config(
 # Configuration
 API_BASE_URL = os.getenv("API_BASE_URL", "http://localhost:8001")
 API_PREDICT_URL = f"{API_BASE_URL}/predict"
+API_PREDICT_STREAM_URL = f"{API_BASE_URL}/predict/stream"
 API_ENRICH_URL = f"{API_BASE_URL}/enrich"
 API_HEALTH_URL = f"{API_BASE_URL}/health"
 API_REMINDER_URL = f"{API_BASE_URL}/reminder"
 API_REMINDERS_URL = f"{API_BASE_URL}/reminders"
 API_CACHE_STATS_URL = f"{API_BASE_URL}/cache/stats"
+API_STATS_SUMMARY_URL = f"{API_BASE_URL}/stats/summary"
+API_STATS_DISEASES_URL = f"{API_BASE_URL}/stats/diseases"
 REQUEST_TIMEOUT = 30  # seconds
 
+# Per-endpoint (connect, read) timeouts in seconds
+CONNECT_TIMEOUT = 3.05
+TIMEOUTS = {
+    "predict": (CONNECT_TIMEOUT, REQUEST_TIMEOUT),
+    "predict_stream": (CONNECT_TIMEOUT, 60),  # read timeout applies between events
+    "enrich": (CONNECT_TIMEOUT, 60),
+    "health": (CONNECT_TIMEOUT, 5),
+    "cache_stats": (CONNECT_TIMEOUT, 5),
+    "reminder": (CONNECT_TIMEOUT, 10),
+    "reminders": (CONNECT_TIMEOUT, 5),
+    "stats": (CONNECT_TIMEOUT, 5),
+}
+HTTP_POOL_SIZE = 10
+STATUS_CACHE_TTL = 10  # seconds to reuse health/stats responses across reruns
+REMINDERS_CACHE_TTL = 10  # seconds to reuse reminder lists across reruns
+
+# Upload encoding: the model only needs 224x224, so send a small image
+UPLOAD_TARGET_SIZE = int(os.getenv("UPLOAD_TARGET_SIZE", 448))  # Longest side, 2x model input
+UPLOAD_FORMAT = os.getenv("UPLOAD_FORMAT", "JPEG").upper()  # JPEG or WEBP
+UPLOAD_QUALITY = int(os.getenv("UPLOAD_QUALITY", 85))
+
+# Show the fast local result first and refine it as the backend streams updates
+PREDICT_STREAMING = os.getenv("PREDICT_STREAMING", "true").lower() == "true"
+
+@st.cache_resource
+def get_http_session() -> requests.Session:
+    """Shared keep-alive session with connection pooling and jittered retries for idempotent calls"""
+    session = requests.Session()
+    retry = Retry(
+        total=3,
+        backoff_factor=0.5,
+        backoff_jitter=0.25,
+        status_forcelist=(502, 503, 504),
+        allowed_methods=frozenset({"GET", "DELETE"}),
+        raise_on_status=False
+    )
+    adapter = HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE, max_retries=retry)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+def retry_delay(attempt: int, base: float = 1.0) -> float:
+    """Linear backoff with random jitter so concurrent clients don't retry in lockstep"""
+    return base * (attempt + 1) * random.uniform(0.5, 1.5)
+
 # Initialize Session State for History and Reminders
 if 'history' not in st.session_state:
     st.session_state.history = []
@@ -47,9 +106,10 @@ def create_reminder_via_api(medication: str, dosage: str, frequency: str, diseas
             "user_id": st.session_state.user_id
         }
         
-        response = requests.post(API_REMINDER_URL, json=payload, timeout=10)
+        response = get_http_session().post(API_REMINDER_URL, json=payload, timeout=TIMEOUTS["reminder"])
         
         if response.status_code == 200:
+            fetch_reminders.clear()
             result = response.json()
             if result.get("success"):
                 st.success(f"✅ {result.get('message', 'Reminder created successfully!')}")
@@ -67,17 +127,21 @@ def create_reminder_via_api(medication: str, dosage: str, frequency: str, diseas
         add_reminder(medication, dosage, frequency, disease)
         return False
 
+@st.cache_data(ttl=REMINDERS_CACHE_TTL, show_spinner=False)
+def fetch_reminders(user_id: str) -> list:
+    """Fetch reminders for a user from the backend (cached briefly across reruns)"""
+    response = get_http_session().get(f"{API_REMINDERS_URL}/{user_id}", timeout=TIMEOUTS["reminders"])
+    
+    if response.status_code == 200:
+        data = response.json()
+        return data.get("reminders", [])
+    else:
+        return []
+
 def get_reminders_via_api() -> list:
     """Get reminders from backend API (Redis)"""
     try:
-        response = requests.get(f"{API_REMINDERS_URL}/{st.session_state.user_id}", timeout=5)
-        
-        if response.status_code == 200:
-            data = response.json()
-            return data.get("reminders", [])
-        else:
-            return []
-            
+        return fetch_reminders(st.session_state.user_id)
     except Exception as e:
         # Fallback to session state
         return st.session_state.get('reminders', [])
@@ -85,15 +149,17 @@ def get_reminders_via_api() -> list:
 def delete_reminder_via_api(reminder_id: str) -> bool:
     """Delete reminder via backend API"""
     try:
-        response = requests.delete(f"{API_REMINDER_URL}/{reminder_id}", timeout=5)
+        response = get_http_session().delete(f"{API_REMINDER_URL}/{reminder_id}", timeout=TIMEOUTS["reminder"])
+        fetch_reminders.clear()
         return response.status_code == 200
     except:
         return False
 
+@st.cache_data(ttl=STATUS_CACHE_TTL, show_spinner=False)
 def get_cache_stats() -> dict:
     """Get Redis cache statistics"""
     try:
-        response = requests.get(API_CACHE_STATS_URL, timeout=5)
+        response = get_http_session().get(API_CACHE_STATS_URL, timeout=TIMEOUTS["cache_stats"])
         if response.status_code == 200:
             return response.json()
         else:
@@ -257,69 +323,82 @@ if st.sidebar.button("🗑️ Clear All Reminders"):
     st.sidebar.success("All reminders cleared!")
     st.rerun()
 
-# Load Disease Database
-@st.cache_data
-def load_disease_database():
+# Compiled disease knowledge base (built by backend/knowledge_base.py)
+KNOWLEDGE_BASE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "knowledge_base.json.gz")
+
+@st.cache_resource
+def load_knowledge_base() -> Dict[str, Any]:
+    """Records plus prebuilt name and alias indexes, parsed once per process"""
     try:
-        base_dir = os.path.dirname(os.path.abspath(__file__))
-        # Assuming docs is at the same level as web_app
-        db_path = os.path.join(os.path.dirname(base_dir), "docs", "DISEASE_DATABASE.json")
-        with open(db_path, 'r') as f:
+        with gzip.open(KNOWLEDGE_BASE_PATH, "rt", encoding="utf-8") as f:
             return json.load(f)
-    except Exception as e:
+    except Exception:
         return {}
 
-disease_db = load_disease_database()
+def knowledge_details(disease: str) -> Optional[Dict[str, Any]]:
+    """Detailed record bundled in the knowledge base for a disease name, if any"""
+    knowledge = load_knowledge_base()
+    key = " ".join(re.sub(r"[^a-z0-9]+", " ", disease.replace("[Universal] ", "").lower()).split())
+    record_id = knowledge.get("names", {}).get(key, knowledge.get("aliases", {}).get(key))
+    return knowledge["records"][record_id].get("details") if record_id is not None else None
+
+# Single-pass translation table for characters the core PDF fonts can't encode
+PDF_TRANSLATION_TABLE = str.maketrans({
+    '\u2013': '-',  # en-dash to hyphen
+    '\u2014': '-',  # em-dash to hyphen
+    '\u2018': "'",  # smart quote to regular quote
+    '\u2019': "'",  # smart quote to regular quote
+    '\u201c': '"',  # smart quote to regular quote
+    '\u201d': '"',  # smart quote to regular quote
+    '\u2026': '...',  # ellipsis to three dots
+    '\u00b0': ' degrees',  # degree symbol
+    '\u00d7': 'x',  # multiplication sign
+    '\u2022': '-',  # bullet point to hyphen
+    '*': '-',  # asterisk to hyphen for lists
+    '\u00ae': '(R)',  # registered trademark
+    '\u2122': '(TM)',  # trademark
+    '\u00a9': '(C)',  # copyright
+    '\u00b1': '+/-',  # plus-minus
+    '\u2264': '<=',  # less than or equal
+    '\u2265': '>=',  # greater than or equal
+    '\u2260': '!=',  # not equal
+    '\u2192': '->',  # right arrow
+    '\u2190': '<-',  # left arrow
+    '\u2191': '^',   # up arrow
+    '\u2193': 'v',   # down arrow
+})
+PDF_CACHE_MAX_ENTRIES = 32
+PDF_CACHE_TTL = 3600  # seconds
+BULK_EXPORT_WORKERS = 4
+BULK_EXPORT_WINDOW = 16  # Max PDFs rendered but not yet zipped
+BULK_EXPORT_SPOOL_BYTES = 8 * 1024 * 1024  # Archives past this are built on disk
+BULK_EXPORT_MAX_BYTES = int(os.getenv("BULK_EXPORT_MAX_MB", 100)) * 1024 * 1024  # Downloads are held in memory
 
 def sanitize_text_for_pdf(text: str) -> str:
     """Sanitize text for PDF generation by replacing problematic Unicode characters"""
     if not text:
         return ""
     
-    # Convert to string if not already
-    text = str(text)
-    
-    # Replace common problematic Unicode characters
-    replacements = {
-        '–': '-',  # em-dash to hyphen
-        '—': '-',  # en-dash to hyphen
-        ''': "'",  # smart quote to regular quote
-        ''': "'",  # smart quote to regular quote
-        '"': '"',  # smart quote to regular quote
-        '"': '"',  # smart quote to regular quote
-        '…': '...',  # ellipsis to three dots
-        '°': ' degrees',  # degree symbol
-        '×': 'x',  # multiplication sign
-        '•': '-',  # bullet point to hyphen
-        '*': '-',  # asterisk to hyphen for lists
-        '®': '(R)',  # registered trademark
-        '™': '(TM)',  # trademark
-        '©': '(C)',  # copyright
-        '±': '+/-',  # plus-minus
-        '≤': '<=',  # less than or equal
-        '≥': '>=',  # greater than or equal
-        '≠': '!=',  # not equal
-        '→': '->',  # right arrow
-        '←': '<-',  # left arrow
-        '↑': '^',   # up arrow
-        '↓': 'v',   # down arrow
-    }
-    
-    for unicode_char, replacement in replacements.items():
-        text = text.replace(unicode_char, replacement)
-    
-    # Remove any remaining non-ASCII characters
-    try:
-        text = text.encode('ascii', 'ignore').decode('ascii')
-    except:
-        # Fallback: remove all non-printable characters
-        text = ''.join(char for char in text if ord(char) < 128 and char.isprintable() or char.isspace())
-    
-    return text
+    # Translate known characters, then drop any remaining non-ASCII characters
+    return str(text).translate(PDF_TRANSLATION_TABLE).encode('ascii', 'ignore').decode('ascii')
 
-def create_pdf(disease, confidence, solution, image, disease_info):
-    # Use fpdf2 which handles UTF-8 better
-    pdf = FPDF()
+def report_content_hash(disease: str, confidence: float, solution: str, disease_info: Dict[str, Any]) -> str:
+    """Content hash identifying a report, used as the PDF cache key"""
+    payload = json.dumps(
+        {"disease": disease, "confidence": round(confidence, 4), "solution": solution, "details": disease_info},
+        sort_keys=True,
+        default=str
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+@st.cache_data(max_entries=PDF_CACHE_MAX_ENTRIES, ttl=PDF_CACHE_TTL, show_spinner=False)
+def get_report_pdf(report_hash: str, _disease: str, _confidence: float, _solution: str, _disease_info: Dict[str, Any]) -> bytes:
+    """Build the PDF report once per content hash (underscore args are not hashed by Streamlit)"""
+    return create_pdf(_disease, _confidence, _solution, None, _disease_info)
+
+def add_report_page(pdf: FPDF, disease: str, confidence: float, solution: str, disease_info: Dict[str, Any], subtitle: str = "") -> None:
+    """Render one scan's medical report onto a new page of an existing document"""
+    disease_info = disease_info or {}
     pdf.add_page()
     
     # Colors
@@ -330,7 +409,7 @@ def create_pdf(disease, confidence, solution, image, disease_info):
     pdf.cell(0, 20, "Plantify - Medical Report", 0, 1, 'C')
     
     pdf.set_font("helvetica", 'I', 10)
-    pdf.cell(0, 10, f"Generated on: {datetime.now().strftime('%Y-%m-%d %H:%M')}", 0, 1, 'R')
+    pdf.cell(0, 10, sanitize_text_for_pdf(f"{subtitle}Generated on: {datetime.now().strftime('%Y-%m-%d %H:%M')}"), 0, 1, 'R')
     pdf.line(10, 35, 200, 35)
     pdf.ln(10)
     
@@ -350,6 +429,14 @@ def create_pdf(disease, confidence, solution, image, disease_info):
     pdf.set_font("helvetica", '', 12)
     pdf.cell(0, 8, f"{confidence:.1%}", 0, 1)
     pdf.ln(5)
+    
+    # Scans without enrichment still get the basic solution
+    if not disease_info.get('causes') and solution:
+        pdf.set_font("helvetica", 'B', 12)
+        pdf.cell(40, 8, "Basic Solution:", 0, 1)
+        pdf.set_font("helvetica", '', 11)
+        pdf.multi_cell(0, 6, sanitize_text_for_pdf(solution))
+        pdf.ln(5)
 
     # 2. Root Causes
     if disease_info.get('causes'):
@@ -429,36 +516,93 @@ def create_pdf(disease, confidence, solution, image, disease_info):
     pdf.set_font("helvetica", 'I', 8)
     pdf.set_text_color(100, 100, 100)
     pdf.multi_cell(0, 4, "Disclaimer: This report is generated by an AI model. Consult an agricultural expert for professional advice.")
-    
-    # fpdf2 returns bytearray, convert to bytes for Streamlit
+
+def pdf_to_bytes(pdf: FPDF) -> bytes:
+    """Serialize a document; fpdf2 returns bytearray, convert to bytes for Streamlit"""
     output = pdf.output()
     if isinstance(output, bytearray):
         return bytes(output)
     else:
         return output
 
+def create_pdf(disease, confidence, solution, image, disease_info):
+    # Use fpdf2 which handles UTF-8 better
+    pdf = FPDF()
+    add_report_page(pdf, disease, confidence, solution, disease_info)
+    return pdf_to_bytes(pdf)
+
+def scan_report_name(index: int, scan: Dict[str, Any]) -> str:
+    """File name for one scan inside a session export"""
+    slug = re.sub(r"[^A-Za-z0-9]+", "_", scan["disease"].replace("[Universal] ", "")).strip("_")
+    return f"{index:03d}_{slug or 'scan'}.pdf"
+
+def render_scan_pdf(scan: Dict[str, Any]) -> bytes:
+    """Render a single history entry to PDF (safe to call from worker threads)"""
+    return create_pdf(scan["disease"], scan["confidence"], scan["solution"], None, scan.get("details"))
+
+def create_session_pdf(scans: list) -> bytes:
+    """Render all scans into one multi-page PDF, sharing a single document's fonts and layout"""
+    pdf = FPDF()
+    for index, scan in enumerate(scans, 1):
+        add_report_page(
+            pdf, scan["disease"], scan["confidence"], scan["solution"], scan.get("details"),
+            subtitle=f"Scan {index} of {len(scans)} at {scan['time']} | "
+        )
+    return pdf_to_bytes(pdf)
+
+def create_session_zip(scans: list) -> bytes:
+    """Render each scan to its own PDF in a worker pool and pack them into a zip
+    
+    Scans are rendered in windows of BULK_EXPORT_WINDOW and the archive is
+    written to a spooled temporary file, so rendering holds one window of PDFs
+    in memory. st.download_button keeps the finished archive in memory, so it
+    is read back once and limited to BULK_EXPORT_MAX_BYTES; larger exports
+    raise ValueError.
+    """
+    with tempfile.SpooledTemporaryFile(max_size=BULK_EXPORT_SPOOL_BYTES) as spool:
+        with zipfile.ZipFile(spool, "w", zipfile.ZIP_DEFLATED) as archive, \
+                ThreadPoolExecutor(max_workers=BULK_EXPORT_WORKERS, thread_name_prefix="plantify-pdf") as pool:
+            for start in range(0, len(scans), BULK_EXPORT_WINDOW):
+                window = scans[start:start + BULK_EXPORT_WINDOW]
+                for offset, pdf_bytes in enumerate(pool.map(render_scan_pdf, window)):
+                    archive.writestr(scan_report_name(start + offset + 1, window[offset]), pdf_bytes)
+                if spool.tell() > BULK_EXPORT_MAX_BYTES:
+                    raise ValueError(f"The export is larger than {BULK_EXPORT_MAX_BYTES // (1024 * 1024)} MB "
+                                     f"after {start + len(window)} of {len(scans)} scans")
+        spool.seek(0)
+        return spool.read()
+
+@st.cache_resource
+def get_executor() -> ThreadPoolExecutor:
+    """Shared worker pool for background API calls"""
+    return ThreadPoolExecutor(max_workers=4, thread_name_prefix="plantify-api")
+
+def fetch_enrichment(disease_name: str, request_id: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """Fetch enriched disease information from backend (thread-safe, no Streamlit calls)"""
+    # Clean name for URL
+    clean_name = disease_name.replace("[Universal] ", "").strip()
+    url = f"{API_ENRICH_URL}/{quote(clean_name, safe='')}"
+    
+    response = get_http_session().get(url, headers={"X-Request-ID": request_id or new_request_id()}, timeout=TIMEOUTS["enrich"])
+    
+    if response.status_code == 200:
+        return response.json()
+    else:
+        return None
+
 def enrich_via_api(disease_name: str) -> Optional[Dict[str, Any]]:
     """Fetch enriched disease information from backend"""
     try:
-        # Clean name for URL
-        clean_name = disease_name.replace("[Universal] ", "").strip()
-        url = f"{API_ENRICH_URL}/{clean_name}"
-        
-        response = requests.get(url, timeout=60)
-        
-        if response.status_code == 200:
-            data = response.json()
-            return data
-        else:
-            return None
+        return fetch_enrichment(disease_name)
     except Exception as e:
         st.error(f"Failed to enrich data: {e}")
         return None
 
+@st.cache_data(ttl=STATUS_CACHE_TTL, show_spinner=False)
 def check_backend_health() -> Dict[str, Any]:
     """Check if backend API is healthy"""
     try:
-        response = requests.get(API_HEALTH_URL, timeout=5)
+        response = get_http_session().get(API_HEALTH_URL, timeout=TIMEOUTS["health"])
         if response.status_code == 200:
             return response.json()
         else:
@@ -466,43 +610,83 @@ def check_backend_health() -> Dict[str, Any]:
     except requests.exceptions.RequestException as e:
         return {"status": "unreachable", "error": str(e)}
 
-def predict_via_api(image: Image.Image, retries: int = 3) -> Optional[Dict[str, Any]]:
-    """Send image to backend API for prediction with retry logic"""
+def prediction_card_html(disease: str, confidence: float, processing_time: float, note: str = "") -> str:
+    """Result card markup; note is shown under the metrics while a result is still being refined"""
+    note_html = f'<div style="margin-top: 0.5rem; color: #888; font-size: 0.8rem;">⏳ {note}</div>' if note else ""
+    return f"""
+                    <div class="prediction-card">
+                        <div style="color: #888; font-size: 0.8rem; margin-bottom: 1rem; text-transform: uppercase; letter-spacing: 2px;">🔬 Detected Condition</div>
+                        <div class="prediction-label">{disease.replace("___", " - ").replace("_", " ").replace("[Universal] ", "").title()}</div>
+                        <div class="confidence-bar">
+                            <div class="confidence-fill" style="width: {confidence * 100}%;"></div>
+                        </div>
+                        <div style="margin-top: 1rem; color: #666; font-size: 0.8rem; font-family: monospace;">
+                            CONFIDENCE: {confidence:.1%} | PROCESSING: {processing_time:.1f}ms
+                        </div>
+                        {note_html}
+                    </div>
+                """
+
+def encode_for_upload(image: Image.Image) -> tuple:
+    """Downscale image to UPLOAD_TARGET_SIZE and encode it compactly for upload"""
+    upload_image = image.copy()
+    upload_image.thumbnail((UPLOAD_TARGET_SIZE, UPLOAD_TARGET_SIZE), Image.Resampling.LANCZOS)
+    
+    img_byte_arr = io.BytesIO()
+    if UPLOAD_FORMAT == "WEBP":
+        upload_image.save(img_byte_arr, format='WEBP', quality=UPLOAD_QUALITY, method=4)
+        return img_byte_arr.getvalue(), "image.webp", "image/webp"
+    upload_image.save(img_byte_arr, format='JPEG', quality=UPLOAD_QUALITY, optimize=True)
+    return img_byte_arr.getvalue(), "image.jpg", "image/jpeg"
+
+def new_request_id() -> str:
+    """Id sent as X-Request-ID so backend logs and traces can be matched to a scan"""
+    return uuid.uuid4().hex
+
+def predict_via_api(image: Image.Image, retries: int = 3, source_hash: Optional[str] = None,
+                    request_id: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """Send a downscaled image to backend API for prediction with retry logic
+    
+    source_hash is the MD5 of the original upload, so the backend caches by
+    the original content rather than the re-encoded bytes.
+    """
+    request_id = request_id or new_request_id()
     try:
-        # Convert PIL image to bytes
-        img_byte_arr = io.BytesIO()
-        image.save(img_byte_arr, format='JPEG', quality=95)
-        img_byte_arr.seek(0)
+        upload_bytes, upload_name, upload_mime = encode_for_upload(image)
+        data = {"user_id": st.session_state.user_id}
+        if source_hash:
+            data["content_hash"] = source_hash
         
         with st.spinner("🔍 Analyzing image..."):
             for attempt in range(retries):
                 try:
-                    img_byte_arr.seek(0)
-                    files = {"file": ("image.jpg", img_byte_arr, "image/jpeg")}
+                    files = {"file": (upload_name, upload_bytes, upload_mime)}
                     
-                    response = requests.post(
+                    response = get_http_session().post(
                         API_PREDICT_URL, 
                         files=files, 
-                        timeout=REQUEST_TIMEOUT
+                        data=data,
+                        headers={"X-Request-ID": request_id},
+                        timeout=TIMEOUTS["predict"]
                     )
                     
                     if response.status_code == 200:
                         return response.json()
                     elif response.status_code >= 500:
                         if attempt < retries - 1:
-                            time.sleep(1 * (attempt + 1))
+                            time.sleep(retry_delay(attempt))
                             continue
                         else:
-                            st.error(f"❌ Server Error ({response.status_code}): {response.text}")
+                            st.error(f"❌ Server Error ({response.status_code}): {response.text} (request {request_id})")
                             return None
                     else:
-                        error_detail = response.json().get('detail', 'Unknown error') if response.headers.get('content-type') == 'application/json' else response.text
-                        st.error(f"❌ API Error ({response.status_code}): {error_detail}")
+                        error_detail = (response.json().get('error') or response.json().get('detail', 'Unknown error')) if response.headers.get('content-type') == 'application/json' else response.text
+                        st.error(f"❌ API Error ({response.status_code}): {error_detail} (request {request_id})")
                         return None
                         
                 except (requests.exceptions.Timeout, requests.exceptions.ConnectionError) as e:
                     if attempt < retries - 1:
-                        time.sleep(1 * (attempt + 1))
+                        time.sleep(retry_delay(attempt))
                         continue
                     else:
                         if isinstance(e, requests.exceptions.Timeout):
@@ -515,6 +699,105 @@ def predict_via_api(image: Image.Image, retries: int = 3) -> Optional[Dict[str,
         st.error(f"❌ Unexpected error: {str(e)}")
         return None
 
+def iter_sse_events(response: requests.Response):
+    """Yield (event, data) pairs from a Server-Sent Events response"""
+    event, data_lines = "message", []
+    for line in response.iter_lines(decode_unicode=True):
+        if line is None:
+            continue
+        if not line:
+            if data_lines:
+                yield event, json.loads("\n".join(data_lines))
+            event, data_lines = "message", []
+        elif line.startswith("event:"):
+            event = line[6:].strip()
+        elif line.startswith("data:"):
+            data_lines.append(line[5:].strip())
+
+def predict_stream_via_api(image: Image.Image, placeholder, source_hash: Optional[str] = None,
+                           request_id: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """Stream a prediction, rendering the Layer 1 result into placeholder as soon as it arrives
+    
+    Later events replace it with the Layer 2 override and attach enrichment.
+    Falls back to the regular endpoint when streaming is unavailable.
+    """
+    request_id = request_id or new_request_id()
+    upload_bytes, upload_name, upload_mime = encode_for_upload(image)
+    data = {"user_id": st.session_state.user_id}
+    if source_hash:
+        data["content_hash"] = source_hash
+    
+    result = None
+    try:
+        with st.spinner("🔍 Analyzing image..."):
+            response = get_http_session().post(
+                API_PREDICT_STREAM_URL,
+                files={"file": (upload_name, upload_bytes, upload_mime)},
+                data=data,
+                headers={"X-Request-ID": request_id},
+                stream=True,
+                timeout=TIMEOUTS["predict_stream"]
+            )
+        with response:
+            if response.status_code == 404:
+                return predict_via_api(image, source_hash=source_hash, request_id=request_id)
+            if response.status_code != 200:
+                error_detail = (response.json().get('error') or response.json().get('detail', 'Unknown error')) if response.headers.get('content-type') == 'application/json' else response.text
+                st.error(f"❌ API Error ({response.status_code}): {error_detail} (request {request_id})")
+                return None
+            
+            for event, payload in iter_sse_events(response):
+                if event in ("layer1", "layer2"):
+                    note = "Refining with advanced analysis..." if payload.get("refining") else ""
+                    placeholder.markdown(prediction_card_html(
+                        payload["disease"], payload["confidence"], payload["processing_time_ms"], note
+                    ), unsafe_allow_html=True)
+                elif event == "prediction":
+                    result = payload
+                    pending = "Loading detailed analysis..." if not result.get("details") and result["disease"] != "background" else ""
+                    placeholder.markdown(prediction_card_html(
+                        result["disease"], result["confidence"], result["processing_time_ms"], pending
+                    ), unsafe_allow_html=True)
+                elif event == "enrichment" and result is not None:
+                    result["details"] = payload
+                elif event == "error":
+                    st.error(f"❌ {payload.get('error', 'Prediction failed')}")
+                    return None
+        return result
+    except (requests.exceptions.Timeout, requests.exceptions.ConnectionError,
+            requests.exceptions.ChunkedEncodingError, ValueError):
+        # Keep what already arrived (a dropped stream included); otherwise retry without streaming
+        return result or predict_via_api(image, source_hash=source_hash, request_id=request_id)
+
+@st.cache_data(ttl=STATUS_CACHE_TTL, show_spinner=False)
+def get_dashboard_stats(user_id: str, session_scans: int) -> Optional[Dict[str, Any]]:
+    """Fetch persisted dashboard aggregates from the backend
+    
+    session_scans is only part of the cache key, so a new scan refreshes the stats.
+    """
+    try:
+        session = get_http_session()
+        summary = session.get(API_STATS_SUMMARY_URL, params={"user_id": user_id}, timeout=TIMEOUTS["stats"])
+        diseases = session.get(API_STATS_DISEASES_URL, params={"user_id": user_id}, timeout=TIMEOUTS["stats"])
+        if summary.status_code != 200 or diseases.status_code != 200:
+            return None
+        stats = summary.json()
+        stats["counts"] = diseases.json().get("counts", {})
+        return stats
+    except requests.exceptions.RequestException:
+        return None
+
+def dashboard_from_session_history(history: list) -> Dict[str, Any]:
+    """Compute dashboard stats from this session's history when the backend store is unavailable"""
+    counts = {}
+    diseased = 0
+    for item in history:
+        counts[item["disease"]] = counts.get(item["disease"], 0) + 1
+        if "healthy" not in item["disease"].lower():
+            diseased += 1
+    total = len(history)
+    return {"total_scans": total, "disease_rate": diseased / total if total else 0.0, "counts": counts}
+
 def validate_image(image: Image.Image) -> bool:
     """Validate uploaded image"""
     if image.size[0] * image.size[1] > 50 * 1024 * 1024:
@@ -582,22 +865,22 @@ with st.sidebar:
     st.markdown("---")
     st.markdown("### 📊 Live Dashboard")
     
-    if st.session_state.history:
-        total_scans = len(st.session_state.history)
-        healthy_count = sum(1 for item in st.session_state.history if "healthy" in item["disease"].lower())
-        diseased_count = total_scans - healthy_count
-        
+    dashboard = get_dashboard_stats(st.session_state.user_id, len(st.session_state.history))
+    if dashboard is None:
+        dashboard = dashboard_from_session_history(st.session_state.history)
+    
+    if dashboard["total_scans"]:
         col_d1, col_d2 = st.columns(2)
         with col_d1:
-            st.metric("Total Scans", total_scans)
+            st.metric("Total Scans", dashboard["total_scans"])
         with col_d2:
-            st.metric("Disease Rate", f"{(diseased_count/total_scans)*100:.0f}%")
+            st.metric("Disease Rate", f"{dashboard['disease_rate']*100:.0f}%")
             
         # Disease Distribution Chart
         disease_counts = {}
-        for item in st.session_state.history:
-            d_name = item["disease"].split("___")[-1].replace("_", " ")
-            disease_counts[d_name] = disease_counts.get(d_name, 0) + 1
+        for disease_name, count in dashboard["counts"].items():
+            d_name = disease_name.split("___")[-1].replace("_", " ")
+            disease_counts[d_name] = disease_counts.get(d_name, 0) + count
             
         st.caption("Disease Distribution")
         st.bar_chart(disease_counts, color="#4CAF50")
@@ -612,6 +895,31 @@ with st.sidebar:
             with st.expander(f"{item['time']} - {item['disease']}"):
                 st.write(f"**Confidence:** {item['confidence']:.1%}")
                 st.write(f"**Solution:** {item['solution'][:50]}...")
+        
+        # Bulk export of every scan in this session
+        with st.expander("📦 Export Session Reports"):
+            export_format = st.radio("Format", ["Single PDF", "ZIP of PDFs"], horizontal=True)
+            if st.button("📄 Prepare Export", use_container_width=True):
+                scans = list(st.session_state.history)
+                export_data = None
+                with st.spinner(f"Rendering {len(scans)} report(s)..."):
+                    if export_format == "Single PDF":
+                        export_data = create_session_pdf(scans)
+                        export_name, export_mime = "Plantify_Session_Report.pdf", "application/pdf"
+                    else:
+                        try:
+                            export_data = create_session_zip(scans)
+                        except ValueError as e:
+                            st.warning(f"{e}. Export fewer scans or raise BULK_EXPORT_MAX_MB.")
+                        export_name, export_mime = "Plantify_Session_Reports.zip", "application/zip"
+                if export_data is not None:
+                    st.download_button(
+                        label=f"📥 Download {export_format}",
+                        data=export_data,
+                        file_name=export_name,
+                        mime=export_mime,
+                        use_container_width=True
+                    )
     else:
         st.info("No scans yet.")
 
@@ -648,156 +956,190 @@ if health_status.get("status") == "healthy":
                 st.write(f"**Mode:** {image.mode}")
             
             # Prediction button
+            source_hash = hashlib.md5(uploaded_file.getvalue()).hexdigest()
             if st.button("🔍 Analyze Plant", type="primary", use_container_width=True):
                 start_time = time.time()
-                result = predict_via_api(image)
+                request_id = new_request_id()
+                if PREDICT_STREAMING:
+                    progress_card = st.empty()
+                    result = predict_stream_via_api(image, progress_card, source_hash=source_hash, request_id=request_id)
+                    progress_card.empty()
+                else:
+                    result = predict_via_api(image, source_hash=source_hash, request_id=request_id)
                 
                 if result:
-                    disease = result.get("disease", "Unknown")
-                    confidence = result.get("confidence", 0.0)
-                    solution = result.get("solution", "No solution available")
-                    processing_time = result.get("processing_time_ms", 0)
-                    
                     # Save to History
-                    st.session_state.history.append({
+                    history_entry = {
                         "time": datetime.now().strftime("%H:%M"),
-                        "disease": disease,
-                        "confidence": confidence,
-                        "solution": solution
-                    })
-                    
-                    st.markdown(f"""
-                        <div class="prediction-card">
-                            <div style="color: #888; font-size: 0.8rem; margin-bottom: 1rem; text-transform: uppercase; letter-spacing: 2px;">🔬 Detected Condition</div>
-                            <div class="prediction-label">{disease.replace("___", " - ").replace("_", " ").replace("[Universal] ", "").title()}</div>
-                            <div class="confidence-bar">
-                                <div class="confidence-fill" style="width: {confidence * 100}%;"></div>
-                            </div>
-                            <div style="margin-top: 1rem; color: #666; font-size: 0.8rem; font-family: monospace;">
-                                CONFIDENCE: {confidence:.1%} | PROCESSING: {processing_time:.1f}ms
-                            </div>
-                        </div>
-                    """, unsafe_allow_html=True)
+                        "disease": result.get("disease", "Unknown"),
+                        "confidence": result.get("confidence", 0.0),
+                        "solution": result.get("solution", "No solution available"),
+                        "details": result.get("details")
+                    }
+                    st.session_state.history.append(history_entry)
                     
-                    # --- NEW: PROGRESSIVE LOADING ---
-                    st.write("") # Spacer
+                    # Keep the scan so widget interactions re-render it without re-analyzing
+                    st.session_state.current_scan = {
+                        "source_hash": source_hash,
+                        "request_id": request_id,
+                        "result": result,
+                        "disease_info": result.get("details"),
+                        "history_entry": history_entry,
+                        "total_time_ms": (time.time() - start_time) * 1000
+                    }
+            
+            current_scan = st.session_state.get("current_scan")
+            if current_scan and current_scan["source_hash"] == source_hash:
+                result = current_scan["result"]
+                disease = result.get("disease", "Unknown")
+                confidence = result.get("confidence", 0.0)
+                solution = result.get("solution", "No solution available")
+                processing_time = result.get("processing_time_ms", 0)
+                
+                st.markdown(prediction_card_html(disease, confidence, processing_time), unsafe_allow_html=True)
+                
+                # --- NEW: PROGRESSIVE LOADING ---
+                st.write("") # Spacer
+                
+                # Enrichment arrives inline when the backend has it cached;
+                # otherwise fetch it in the background while the rest renders
+                disease_info = current_scan["disease_info"] or knowledge_details(disease)
+                enrichment_future = None
+                if not disease_info and disease != "background":
+                    enrichment_future = get_executor().submit(fetch_enrichment, disease, current_scan.get("request_id"))
+
+                # Elaborate / Search Buttons
+                col_search_1, col_search_2 = st.columns(2)
+                
+                with col_search_1:
+                    search_query = f"{disease} plant disease details symptoms"
+                    st.link_button("🔍 Learn More About Disease", f"https://www.google.com/search?q={search_query}", use_container_width=True)
                     
-                    # Show a placeholder for the enrichment
-                    enrichment_container = st.container()
+                with col_search_2:
+                    cure_query = f"{disease} plant disease treatment and organic cure"
+                    st.link_button("💊 Find Detailed Cures", f"https://www.google.com/search?q={cure_query}", use_container_width=True)
+
+                # Detailed Analysis Expander
+                with st.expander("ℹ️ View Detailed Analysis"):
+                    st.markdown(f"""
+                    **Diagnostic Report:**
+                    - **Condition:** `{disease}`
+                    - **Confidence:** `{confidence:.4f}`
+                    - **Analysis Time:** `{processing_time:.1f}ms`
                     
-                    with enrichment_container:
+                    The AI system has analyzed the visual patterns on the leaf (texture, color, and lesions) and matched them with known disease signatures. 
+                    The confidence score indicates the model's certainty. A score above 80% is generally reliable.
+                    """)
+                
+                if enrichment_future is not None:
+                    # Layer 1 is fully rendered above; the basic solution holds this slot until enrichment arrives
+                    enrichment_slot = st.empty()
+                    enrichment_error = None
+                    with enrichment_slot.container():
+                        st.info(f"**Basic Solution:** {solution}")
                         with st.spinner("🧬 Fetching detailed medical analysis..."):
-                            disease_info = enrich_via_api(disease)
+                            try:
+                                disease_info = enrichment_future.result()
+                            except Exception as e:
+                                enrichment_error = e
+                                disease_info = None
+                    enrichment_slot.empty()
+                    if enrichment_error is not None:
+                        st.error(f"Failed to enrich data: {enrichment_error}")
+                    current_scan["disease_info"] = disease_info
+                    current_scan["history_entry"]["details"] = disease_info
+                
+                if not disease_info and disease != "background":
+                    st.warning("⚠️ Could not fetch detailed medical information for this condition.")
+                    st.info(f"**Basic Solution:** {solution}")
+                    st.stop()
+                
+                if disease != "background":
+                    # --- LAYER 3: ENHANCED DISPLAY ---
                     
-                    if not disease_info:
-                        st.warning("⚠️ Could not fetch detailed medical information for this condition.")
-                        st.info(f"**Basic Solution:** {solution}")
-                        st.stop()
-
-                    # Elaborate / Search Buttons
-                    col_search_1, col_search_2 = st.columns(2)
+                    # 1. Root Causes
+                    st.markdown(f"### 🔬 Root Causes")
+                    st.write(disease_info["causes"]["details"])
                     
-                    with col_search_1:
-                        search_query = f"{disease} plant disease details symptoms"
-                        st.link_button("🔍 Learn More About Disease", f"https://www.google.com/search?q={search_query}", use_container_width=True)
-                        
-                    with col_search_2:
-                        cure_query = f"{disease} plant disease treatment and organic cure"
-                        st.link_button("💊 Find Detailed Cures", f"https://www.google.com/search?q={cure_query}", use_container_width=True)
-
-                    # Detailed Analysis Expander
-                    with st.expander("ℹ️ View Detailed Analysis"):
-                        st.markdown(f"""
-                        **Diagnostic Report:**
-                        - **Condition:** `{disease}`
-                        - **Confidence:** `{confidence:.4f}`
-                        - **Analysis Time:** `{processing_time:.1f}ms`
-                        
-                        The AI system has analyzed the visual patterns on the leaf (texture, color, and lesions) and matched them with known disease signatures. 
-                        The confidence score indicates the model's certainty. A score above 80% is generally reliable.
-                        """)
+                    # 2. Prevention Strategies
+                    with st.expander("🛡️ Prevention Strategies", expanded=False):
+                        for measure in disease_info["prevention"]["measures"]:
+                             st.info(f"• {measure}")
+
+                    # 3. Treatment Plan (Tabs for Stages)
+                    st.markdown("### 🩺 Treatment Plan")
+                    t_tabs = st.tabs([s["name"].split(":")[0] for s in disease_info["treatment"]["stages"]])
                     
-                    if disease != "background":
-                        # --- LAYER 3: ENHANCED DISPLAY ---
-                        
-                        # 1. Root Causes
-                        st.markdown(f"### 🔬 Root Causes")
-                        st.write(disease_info["causes"]["details"])
-                        
-                        # 2. Prevention Strategies
-                        with st.expander("🛡️ Prevention Strategies", expanded=False):
-                            for measure in disease_info["prevention"]["measures"]:
-                                 st.info(f"• {measure}")
-
-                        # 3. Treatment Plan (Tabs for Stages)
-                        st.markdown("### 🩺 Treatment Plan")
-                        t_tabs = st.tabs([s["name"].split(":")[0] for s in disease_info["treatment"]["stages"]])
-                        
-                        for i, tab in enumerate(t_tabs):
-                            stage = disease_info["treatment"]["stages"][i]
-                            with tab:
-                                st.markdown(f"**{stage['name']}**")
-                                st.write(f"*{stage['description']}*")
-                                for comp in stage["components"]:
-                                    st.write(f"- {comp}")
-                                if stage["medications"]:
-                                    st.caption(f"**Recommended Meds:** {', '.join(stage['medications'])}")
-
-                        # 4. Medications & Dosages
-                        if disease_info.get("medications"):
-                            st.markdown("### 💊 Medications & Dosages")
-                            cols = st.columns(len(disease_info["medications"]))
-                            for i, med in enumerate(disease_info["medications"]):
-                                with cols[i]:
-                                    st.markdown(f"""
-                                    <div style="border:1px solid #444; padding:10px; border-radius:5px; background:rgba(255,255,255,0.05);">
-                                        <strong>{med['name']}</strong><br>
-                                        <span style="font-size:0.8em">
-                                        <b>Dosage:</b> {med['dosage']}<br>
-                                        <b>Freq:</b> {med['frequency']}<br>
-                                        <b>Note:</b> {med['side_effects']}
-                                        </span>
-                                    </div>
-                                    """, unsafe_allow_html=True)
-                                    if st.button(f"🔔 Set Reminder ({med['name']})", key=f"rem_{i}"):
-                                        success = create_reminder_via_api(
-                                            medication=med['name'],
-                                            dosage=med.get('dosage', 'As prescribed'),
-                                            frequency=med.get('frequency', 'As needed'),
-                                            disease=disease
-                                        )
-                                        if success:
-                                            st.balloons()
-                                        st.rerun()
-
-                        # 5. Emergency Signs
-                        st.markdown("### ⚠️ Emergency Signs")
-                        st.error(f"**Action Required:** {disease_info['emergency']['action']}")
-                        for sign in disease_info["emergency"]["signs"]:
-                            st.write(f"🚨 {sign}")
-
-                        # 6. Expected Recovery
-                        with st.expander("📊 Expected Recovery Timeline"):
-                            for step in disease_info["recovery"]["timeline"]:
-                                st.write(f"✅ {step}")
-                            st.caption(f"**Success Rate:** {disease_info['recovery']['success_rate']}")
-
-                        # PDF Download
-                        pdf_bytes = create_pdf(disease, confidence, solution, image, disease_info)
+                    for i, tab in enumerate(t_tabs):
+                        stage = disease_info["treatment"]["stages"][i]
+                        with tab:
+                            st.markdown(f"**{stage['name']}**")
+                            st.write(f"*{stage['description']}*")
+                            for comp in stage["components"]:
+                                st.write(f"- {comp}")
+                            if stage["medications"]:
+                                st.caption(f"**Recommended Meds:** {', '.join(stage['medications'])}")
+
+                    # 4. Medications & Dosages
+                    if disease_info.get("medications"):
+                        st.markdown("### 💊 Medications & Dosages")
+                        cols = st.columns(len(disease_info["medications"]))
+                        for i, med in enumerate(disease_info["medications"]):
+                            with cols[i]:
+                                st.markdown(f"""
+                                <div style="border:1px solid #444; padding:10px; border-radius:5px; background:rgba(255,255,255,0.05);">
+                                    <strong>{med['name']}</strong><br>
+                                    <span style="font-size:0.8em">
+                                    <b>Dosage:</b> {med['dosage']}<br>
+                                    <b>Freq:</b> {med['frequency']}<br>
+                                    <b>Note:</b> {med['side_effects']}
+                                    </span>
+                                </div>
+                                """, unsafe_allow_html=True)
+                                if st.button(f"🔔 Set Reminder ({med['name']})", key=f"rem_{i}"):
+                                    success = create_reminder_via_api(
+                                        medication=med['name'],
+                                        dosage=med.get('dosage', 'As prescribed'),
+                                        frequency=med.get('frequency', 'As needed'),
+                                        disease=disease
+                                    )
+                                    if success:
+                                        st.balloons()
+                                    st.rerun()
+
+                    # 5. Emergency Signs
+                    st.markdown("### ⚠️ Emergency Signs")
+                    st.error(f"**Action Required:** {disease_info['emergency']['action']}")
+                    for sign in disease_info["emergency"]["signs"]:
+                        st.write(f"🚨 {sign}")
+
+                    # 6. Expected Recovery
+                    with st.expander("📊 Expected Recovery Timeline"):
+                        for step in disease_info["recovery"]["timeline"]:
+                            st.write(f"✅ {step}")
+                        st.caption(f"**Success Rate:** {disease_info['recovery']['success_rate']}")
+
+                    # PDF Download: built only on request, then served from cache on reruns
+                    report_hash = report_content_hash(disease, confidence, solution, disease_info)
+                    if st.session_state.get("report_requested") != report_hash:
+                        if st.button("📄 Prepare Full Medical Report (PDF)", use_container_width=True):
+                            st.session_state.report_requested = report_hash
+                    if st.session_state.get("report_requested") == report_hash:
+                        with st.spinner("📄 Preparing report..."):
+                            pdf_bytes = get_report_pdf(report_hash, disease, confidence, solution, disease_info)
                         st.download_button(
                             label="📥 Download Full Medical Report (PDF)",
                             data=pdf_bytes,
-                            file_name=f"Plantify_Report_{datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf",
+                            file_name=f"Plantify_Report_{report_hash[:8]}.pdf",
                             mime="application/pdf",
                             use_container_width=True
                         )
-                        
-                    else:
-                        st.info("💡 **Tip:** For best results, please upload a clear image of a single plant leaf against a plain background.")
                     
-                    # Performance metrics
-                    total_time = (time.time() - start_time) * 1000
-                    st.caption(f"⚡ Total request time: {total_time:.1f}ms")
+                else:
+                    st.info("💡 **Tip:** For best results, please upload a clear image of a single plant leaf against a plain background.")
+                
+                # Performance metrics
+                st.caption(f"⚡ Total request time: {current_scan['total_time_ms']:.1f}ms")
                     
         except Exception as e:
             st.error(f"❌ Error processing image: {str(e)}")